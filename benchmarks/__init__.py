@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Load tests of the public and admin views.
+
+See ``python -m benchmarks.run --help``.
+"""
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Seed a dataset, serve the app with gunicorn and measure the throughput and
+latency of the main views at a target concurrency.
+
+Usage::
+
+    python -m benchmarks.run --pages 10 --incidents 500 --concurrency 16
+    BENCH_DATABASE_URI=postgres://localhost/clearstate_bench \\
+        python -m benchmarks.run
+
+The results are written as JSON to the output directory, so that runs can
+be compared.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode
+except ImportError:
+    from httplib import HTTPConnection
+    from urllib import urlencode
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(HERE, os.pardir))
+
+
+def percentile(values, percent):
+    """
+    The nearest-rank percentile of the sorted values
+    """
+    if not values:
+        return None
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+class Client(object):
+    """
+    A minimal HTTP client that keeps the session cookie.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookie = None
+
+    def request(self, method, path, form=None):
+        connection = HTTPConnection(self.host, self.port, timeout=60)
+        headers = {}
+        body = None
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            return response.status, response.getheader('X-Query-Count')
+        finally:
+            connection.close()
+
+    def login(self, email, password):
+        return self.request(
+            'POST', '/login', {'email': email, 'password': password}
+        )
+
+
+def scenarios(ids, email, password):
+    """
+    Returns the scenarios as (name, needs_login, expected_status, request)
+    where request is a function that makes one request with a client and
+    returns the status and query count.
+    """
+    def status_page(client):
+        return client.request(
+            'GET', '/pages/%d' % random.choice(ids['pages'])
+        )
+
+    def dashboard(client):
+        return client.request(
+            'GET', '/pages/%d/dashboard' % random.choice(ids['pages'])
+        )
+
+    def incidents(client):
+        return client.request(
+            'GET', '/pages/%d/incidents' % random.choice(ids['pages'])
+        )
+
+    def update_incident(client):
+        return client.request(
+            'GET', '/pages/%d/incidents/%d' % random.choice(ids['incidents'])
+        )
+
+    def login(client):
+        client.request('GET', '/login')
+        return client.login(email, password)
+
+    return [
+        ('render_status_page', False, 200, status_page),
+        ('dashboard', True, 200, dashboard),
+        ('incidents', True, 200, incidents),
+        ('update_incident', True, 200, update_incident),
+        # A successful login redirects to the pages
+        ('login', False, 302, login),
+    ]
+
+
+def run_scenario(host, port, request, concurrency, requests, expected=200,
+                 login=None):
+    """
+    Make `requests` requests from `concurrency` threads. Returns the
+    measurements of the scenario. Responses with a status other than the
+    expected one are counted as errors.
+    """
+    latencies = []
+    queries = []
+    errors = [0]
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker():
+        client = Client(host, port)
+        if login and client.login(*login)[0] != 302:
+            raise RuntimeError('Could not log in as %s' % login[0])
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.time()
+            try:
+                status, query_count = request(client)
+            except (socket.error, IOError):
+                status, query_count = None, None
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+                if status != expected:
+                    errors[0] += 1
+                if query_count is not None:
+                    queries.append(int(query_count))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'duration': duration,
+        'requests_per_second': len(latencies) / duration,
+        'latency_ms': dict(
+            ('p%d' % p, percentile(latencies, p) * 1000)
+            for p in (50, 95, 99)
+        ) if latencies else {},
+        'queries_per_request': (
+            float(sum(queries)) / len(queries) if queries else None
+        ),
+    }
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start on %s:%d' % (host, port))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--components', type=int, default=20,
+                        help='Components per page')
+    parser.add_argument('--incidents', type=int, default=200,
+                        help='Incidents per page')
+    parser.add_argument('--updates', type=int, default=4,
+                        help='Updates per incident')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='Reuse the data of a previous run')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500,
+                        help='Requests per scenario')
+    parser.add_argument('--workers', type=int, default=3,
+                        help='Number of gunicorn workers')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--scenario', action='append',
+                        help='Only run the named scenarios')
+    parser.add_argument('--output', default=os.path.join(HERE, 'results'),
+                        help='Directory to write the results to')
+    args = parser.parse_args(argv)
+
+    from benchmarks.settings import BenchConfig
+    from benchmarks import seed as seeding
+    from clearstate.app import create_app
+    from clearstate.page.models import Page, Incident
+
+    app = create_app(BenchConfig)
+    with app.test_request_context():
+        if not args.no_seed:
+            print('Seeding %s' % BenchConfig.SQLALCHEMY_DATABASE_URI)
+            ids = seeding.seed(
+                args.pages, args.components, args.incidents, args.updates
+            )
+        else:
+            ids = {
+                'pages': [page.id for page in Page.query],
+                'incidents': [
+                    (incident.page_id, incident.id)
+                    for incident in Incident.query
+                ],
+            }
+
+    host = '127.0.0.1'
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn.app.wsgiapp', 'benchmarks.wsgi:app',
+        '-b', '%s:%d' % (host, args.port), '-w', str(args.workers),
+        '--log-level', 'warning',
+    ], cwd=PROJECT_ROOT, env=dict(
+        os.environ,
+        BENCH_DATABASE_URI=BenchConfig.SQLALCHEMY_DATABASE_URI
+    ))
+    try:
+        wait_for_port(host, args.port)
+        results = {}
+        for name, needs_login, expected, request in scenarios(
+                ids, seeding.EMAIL, seeding.PASSWORD):
+            if args.scenario and name not in args.scenario:
+                continue
+            results[name] = result = run_scenario(
+                host, args.port, request, args.concurrency, args.requests,
+                expected=expected,
+                login=(seeding.EMAIL, seeding.PASSWORD) if needs_login
+                else None,
+            )
+            print(
+                '%-20s %8.1f req/s  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  '
+                '%5s queries/req  %d errors' % (
+                    name, result['requests_per_second'],
+                    result['latency_ms'].get('p50', 0),
+                    result['latency_ms'].get('p95', 0),
+                    result['latency_ms'].get('p99', 0),
+                    result['queries_per_request'] is not None and
+                    '%.1f' % result['queries_per_request'] or '-',
+                    result['errors'],
+                )
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    started = datetime.utcnow()
+    path = os.path.join(
+        args.output, 'bench-%s.json' % started.strftime('%Y%m%dT%H%M%S')
+    )
+    with open(path, 'w') as f:
+        json.dump({
+            'time': started.isoformat(),
+            'database': BenchConfig.SQLALCHEMY_DATABASE_URI.split(':', 1)[0],
+            'dataset': {
+                'pages': args.pages,
+                'components': args.components,
+                'incidents': args.incidents,
+                'updates': args.updates,
+            },
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'scenarios': results,
+        }, f, indent=2, sort_keys=True)
+    print('Results written to %s' % path)
+
+
+if __name__ == '__main__':
+    main()
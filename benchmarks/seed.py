@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Seed the benchmark database with the factories of the tests.
+"""
+import random
+from datetime import datetime, timedelta
+
+from clearstate.database import db
+from clearstate.page.models import Component, IncidentUpdate
+
+from tests.factories import UserFactory, PageFactory, ComponentFactory, \
+    IncidentFactory, IncidentUpdateFactory
+
+#: Credentials of the user the benchmark logs in as
+EMAIL = 'bench@example.com'
+PASSWORD = 'benchmark'
+
+
+def seed(pages=10, components=20, incidents=200, updates=4, days=365,
+         seed=0):
+    """
+    Recreate the tables and fill them with data. Returns a dict of the ids
+    the scenarios need.
+
+    :param pages: Number of status pages
+    :param components: Number of components per page
+    :param incidents: Number of incidents per page
+    :param updates: Number of updates per incident
+    :param days: Spread the incidents over this many days in the past
+    :param seed: Seed of the random numbers, for repeatable datasets
+    """
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+
+    UserFactory(email=EMAIL, password=PASSWORD)
+
+    now = datetime.utcnow()
+    ids = {'pages': [], 'incidents': []}
+    for page_no in range(pages):
+        page = PageFactory(site_url='status-%d.example.com' % page_no)
+        for component_no in range(components):
+            ComponentFactory(
+                page=page,
+                status=rng.choice(list(Component.status_map.keys())),
+            )
+        db.session.flush()
+        ids['pages'].append(page.id)
+
+        for incident_no in range(incidents):
+            create_time = now - timedelta(seconds=rng.randint(0, days * 86400))
+            incident = IncidentFactory(page=page, create_time=create_time)
+            for update_no in range(updates):
+                update_time = create_time + timedelta(minutes=15 * update_no)
+                IncidentUpdateFactory(
+                    incident=incident,
+                    status=IncidentUpdate.statuses[
+                        min(update_no, len(IncidentUpdate.statuses) - 1)
+                    ],
+                    create_time=update_time,
+                    update_time=update_time,
+                )
+            db.session.flush()
+            ids['incidents'].append((page.id, incident.id))
+        db.session.commit()
+
+    return ids
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import os
+
+from clearstate.settings import ProdConfig
+
+os_env = os.environ
+
+
+class BenchConfig(ProdConfig):
+    """Production configuration against the benchmark database."""
+    ENV = 'bench'
+    SECRET_KEY = 'benchmark'
+    SQLALCHEMY_DATABASE_URI = os_env.get(
+        'BENCH_DATABASE_URI', 'sqlite:////tmp/clearstate-bench.db'
+    )
+    # The harness logs in without fetching a form first
+    WTF_CSRF_ENABLED = False
+    QUERY_PROFILER_SAMPLE_RATE = 1
+    QUERY_PROFILER_HEADERS = True
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+The app served by gunicorn during a benchmark.
+
+Every request is profiled, so every response carries the number of SQL
+statements executed for it in an ``X-Query-Count`` header.
+"""
+from clearstate.app import create_app
+
+from benchmarks.settings import BenchConfig
+
+app = create_app(BenchConfig)
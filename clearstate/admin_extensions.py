@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Extensions of the admin app, which the status app does not import.
+
+Each extension is initialized in the app factory located in app.py
+"""
+
+from flask.ext.bcrypt import Bcrypt
+bcrypt = Bcrypt()
+
+from flask.ext.migrate import Migrate
+migrate = Migrate()
+
+from flask.ext.debugtoolbar import DebugToolbarExtension
+debug_toolbar = DebugToolbarExtension()
+
+
+from flask.ext.gravatar import Gravatar
+gravatar = Gravatar(
+    size=100,
+    rating='g',
+    default='retro',
+    force_default=False,
+    force_lower=False,
+    use_ssl=True,
+    base_url=None
+)
@@ -4,17 +4,23 @@ from flask import Flask, render_template
 
 from clearstate.settings import ProdConfig
 from clearstate.assets import assets
+from clearstate.manifest import asset_manifest
 from clearstate.extensions import (
-    bcrypt,
     cache,
     db,
     login_manager,
+    babel,
+)
+from clearstate.admin_extensions import (
+    bcrypt,
     migrate,
     debug_toolbar,
     gravatar,
-    babel,
 )
-from clearstate import public, user, page
+from clearstate.profiling import query_profiler
+from clearstate.passwords import password_hasher
+from clearstate import public, user
+from clearstate.page import views as page_views, notifications  # noqa
 
 
 def create_app(config_object=ProdConfig):
@@ -34,6 +40,7 @@ def create_app(config_object=ProdConfig):
 
 def register_extensions(app):
     assets.init_app(app)
+    asset_manifest.init_app(app)
     bcrypt.init_app(app)
     cache.init_app(app)
     db.init_app(app)
@@ -41,16 +48,18 @@ def register_extensions(app):
     debug_toolbar.init_app(app)
     migrate.init_app(app, db)
     gravatar.init_app(app)
+    query_profiler.init_app(app)
+    password_hasher.init_app(app)
 
     babel.init_app(app)
-    babel.timezoneselector(page.views.get_timezone_from_page)
+    babel.timezoneselector(page_views.get_timezone_from_page)
     return None
 
 
 def register_blueprints(app):
     app.register_blueprint(public.views.blueprint)
     app.register_blueprint(user.views.blueprint)
-    app.register_blueprint(page.views.blueprint)
+    app.register_blueprint(page_views.blueprint)
     return None
 
 
@@ -1,6 +1,31 @@
 # -*- coding: utf-8 -*-
+"""
+Static assets.
+
+The bundles are built at deploy time by ``python manage.py build_assets``,
+which writes every bundle (and the other files in FINGERPRINTED) under a
+name with a hash of its contents, next to gzip and brotli compressed
+copies, and records the names in a manifest, which manifest.py serves
+them from.
+
+Without a manifest, as in development, the bundles are built by
+Flask-Assets on request.
+"""
+import gzip
+import hashlib
+import json
+import os
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from flask.ext.assets import Bundle, Environment
 
+from clearstate.compat import text_type
+
 css = Bundle(
     "libs/bootstrap/dist/css/bootstrap.css",
     "css/style.css",
@@ -16,7 +41,93 @@ js = Bundle(
     output="public/js/common.js"
 )
 
+BUNDLES = {
+    "js_all": js,
+    "css_all": css,
+}
+
+#: Static files linked to by the templates that are fingerprinted as well
+FINGERPRINTED = [
+    "libs/font-awesome4/css/font-awesome.min.css",
+]
+
 assets = Environment()
 
-assets.register("js_all", js)
-assets.register("css_all", css)
+for name, bundle in BUNDLES.items():
+    assets.register(name, bundle)
+
+
+def fingerprinted_name(path, data):
+    """
+    Returns the path with a hash of the data before the extension.
+    """
+    root, ext = os.path.splitext(path)
+    return '%s.%s%s' % (root, hashlib.md5(data).hexdigest()[:12], ext)
+
+
+def gzip_compress(data):
+    out = BytesIO()
+    # No file name or time in the header, so builds are reproducible
+    with gzip.GzipFile(filename='', mode='wb', fileobj=out, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def write_file(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build_assets(app, manifest_path=None, bundles=None, files=None):
+    """
+    Build the bundles and write the fingerprinted and compressed assets
+    to the static folder. Returns the manifest, which is saved to the
+    STATIC_MANIFEST file.
+
+    The assets of earlier builds are left in place, for the pages rendered
+    before a deploy.
+
+    :param manifest_path: Where to save the manifest instead
+    :param bundles: The bundles by name, defaults to BUNDLES
+    :param files: Other static files to fingerprint, defaults to
+                  FINGERPRINTED
+    """
+    bundles = BUNDLES if bundles is None else bundles
+    files = FINGERPRINTED if files is None else files
+    static = app.static_folder
+    contents = {}
+    with app.app_context():
+        debug = app.config['ASSETS_DEBUG']
+        app.config['ASSETS_DEBUG'] = False
+        try:
+            for name, bundle in bundles.items():
+                bundle.env = assets
+                hunk, = bundle.build(force=True)
+                data = hunk.data()
+                if isinstance(data, text_type):
+                    data = data.encode('utf-8')
+                contents[name] = (bundle.output, data)
+        finally:
+            app.config['ASSETS_DEBUG'] = debug
+    for path in files:
+        with open(os.path.join(static, path), 'rb') as f:
+            contents[path] = (path, f.read())
+
+    manifest = {}
+    for name, (path, data) in contents.items():
+        target = fingerprinted_name(path, data)
+        write_file(os.path.join(static, target), data)
+        write_file(os.path.join(static, target + '.gz'), gzip_compress(data))
+        if brotli is not None:
+            write_file(
+                os.path.join(static, target + '.br'), brotli.compress(data)
+            )
+        manifest[name] = target
+
+    write_file(manifest_path or app.config['STATIC_MANIFEST'], json.dumps(
+        manifest, indent=2, sort_keys=True, separators=(',', ': ')
+    ).encode('utf-8'))
+    return manifest
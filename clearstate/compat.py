@@ -10,11 +10,13 @@ if PY2:
     text_type = unicode
     binary_type = str
     string_types = (str, unicode)
+    integer_types = (int, long)
     unicode = unicode
     basestring = basestring
 else:
     text_type = str
     binary_type = bytes
     string_types = (str,)
+    integer_types = (int,)
     unicode = str
     basestring = (str, bytes)
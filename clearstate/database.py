@@ -2,10 +2,15 @@
 """Database module, including the SQLAlchemy database object and DB-related
 utilities.
 """
+import json
+from datetime import datetime
+
+from flask import g, has_app_context
+from sqlalchemy import and_, inspect, or_
 from sqlalchemy.orm import relationship
 
 from .extensions import db
-from .compat import basestring
+from .compat import basestring, integer_types
 
 # Alias common SQLAlchemy names
 Column = db.Column
@@ -60,14 +65,37 @@ class SurrogatePK(object):
 
     @classmethod
     def get_by_id(cls, id):
+        """
+        Returns the record with the given id or None. Records are looked up
+        once per request (or app context).
+        """
         if any(
             (isinstance(id, basestring) and id.isdigit(),
              isinstance(id, (int, float))),
         ):
-            return cls.query.get(int(id))
+            return get_cached(cls, int(id))
         return None
 
 
+def get_cached(cls, id):
+    """
+    Returns the record of the model with the given primary key, looking it
+    up only once in the current app context.
+    """
+    if not has_app_context():
+        return cls.query.get(id)
+
+    cache = getattr(g, '_identity_cache', None)
+    if cache is None:
+        cache = g._identity_cache = {}
+
+    instance = cache.get((cls, id))
+    if instance is None or instance not in db.session:
+        # Not looked up yet, deleted or from a session that was closed
+        instance = cache[(cls, id)] = cls.query.get(id)
+    return instance
+
+
 def ReferenceCol(tablename, nullable=False, pk_name='id', **kwargs):
     """Column that adds primary key foreign key reference.
 
@@ -79,3 +107,147 @@ def ReferenceCol(tablename, nullable=False, pk_name='id', **kwargs):
     return db.Column(
         db.ForeignKey("{0}.{1}".format(tablename, pk_name)),
         nullable=nullable, **kwargs)
+
+
+class KeysetPagination(object):
+    """
+    A page of results paginated on a set of unique ordering columns, in
+    descending order. Unlike OFFSET based pagination, fetching a page costs
+    the same however deep into the results it is.
+
+    Use :func:`keyset_paginate` to create one.
+    """
+
+    def __init__(self, items, keys, has_prev, has_next, total=None):
+        self.items = items
+        self.keys = keys
+        self.has_prev = has_prev
+        self.has_next = has_next
+        #: An estimate of the total number of results, if asked for
+        self.total = total
+
+    def _cursor(self, item):
+        return encode_cursor([getattr(item, key) for key in self.keys])
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return self._cursor(self.items[0])
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return self._cursor(self.items[-1])
+
+
+def encode_cursor(values):
+    """
+    Encode the values of the ordering columns of a row as a string that can
+    be used in a URL.
+    """
+    return json.dumps([
+        value.strftime('%Y%m%d%H%M%S%f') if isinstance(value, datetime)
+        else value
+        for value in values
+    ], separators=(',', ':'))
+
+
+def decode_cursor(cursor, columns):
+    """
+    Decode a cursor created by :func:`encode_cursor`. Raises ValueError if
+    the cursor is not valid for the columns.
+    """
+    values = json.loads(cursor)
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+    decoded = []
+    for column, value in zip(columns, values):
+        if isinstance(column.type, db.DateTime):
+            if not isinstance(value, basestring):
+                raise ValueError('Invalid cursor')
+            value = datetime.strptime(value, '%Y%m%d%H%M%S%f')
+        elif isinstance(column.type, db.Integer):
+            if isinstance(value, bool) or not isinstance(value, integer_types):
+                raise ValueError('Invalid cursor')
+        elif not isinstance(value, basestring):
+            raise ValueError('Invalid cursor')
+        decoded.append(value)
+    return decoded
+
+
+def _after(columns, values, descending):
+    """
+    Criterion that selects the rows after the given values in the (row
+    value) order of the columns. Expanded as ORs of ANDs, since not every
+    database supports comparing tuples.
+    """
+    criteria = []
+    for index, (column, value) in enumerate(zip(columns, values)):
+        compare = column < value if descending else column > value
+        criteria.append(and_(*[
+            c == v for c, v in zip(columns[:index], values[:index])
+        ] + [compare]))
+    return or_(*criteria)
+
+
+def estimate_count(query):
+    """
+    Returns an estimate of the number of rows the query returns. On
+    PostgreSQL this is the estimate of the planner, which does not scan the
+    rows. Other databases count the rows.
+    """
+    connection = query.session.connection(
+        mapper=inspect(query.column_descriptions[0]['type'])
+    )
+    if connection.dialect.name != 'postgresql':
+        return query.order_by(None).count()
+    statement = query.order_by(None).statement.compile(connection)
+    # Executed as a plain string, in the parameter style of the driver
+    plan = connection.execute(
+        'EXPLAIN (FORMAT JSON) ' + str(statement), statement.params
+    ).scalar()
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def keyset_paginate(query, columns, per_page, after=None, before=None,
+                    estimate=False):
+    """
+    Paginate the query in descending order of the columns, which together
+    must be unique.
+
+    :param query: The query to paginate, without an order
+    :param columns: The mapped columns to order on, like
+                    ``[Model.create_time, Model.id]``
+    :param per_page: The number of items in a page
+    :param after: The cursor of the last item of the previous page
+    :param before: The cursor of the first item of the next page
+    :param estimate: Also estimate the total number of items
+    :raises ValueError: if a cursor is not valid
+    """
+    keys = [column.key for column in columns]
+    total = estimate_count(query) if estimate else None
+
+    if before is not None:
+        # Walk backwards from the cursor and reverse the results
+        items = query.filter(
+            _after(columns, decode_cursor(before, columns), descending=False)
+        ).order_by(*[column.asc() for column in columns]).limit(
+            per_page + 1
+        ).all()
+        has_prev = len(items) > per_page
+        items = list(reversed(items[:per_page]))
+        return KeysetPagination(items, keys, has_prev, True, total)
+
+    if after is not None:
+        query = query.filter(
+            _after(columns, decode_cursor(after, columns), descending=True)
+        )
+    items = query.order_by(*[column.desc() for column in columns]).limit(
+        per_page + 1
+    ).all()
+    return KeysetPagination(
+        items[:per_page], keys, after is not None, len(items) > per_page,
+        total
+    )
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Links to the static assets built by ``python manage.py build_assets`` and
+serving of the built assets.
+
+The templates link to assets with ``asset_urls``, which looks them up in
+the manifest written by the build. The built files are served with a far
+future expiry, and precompressed for clients accepting it.
+"""
+import json
+import mimetypes
+import os
+
+from flask import current_app, request, send_from_directory, url_for
+
+#: Precompressed variants, in the order they are preferred
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+class AssetManifest(object):
+    """
+    Links to the built assets and serves them.
+
+    STATIC_MANIFEST
+        Path of the manifest written by `build_assets`. The manifest
+        is read once per process.
+    STATIC_MAX_AGE
+        Seconds for which browsers and proxies may cache the built assets.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATIC_MANIFEST', None)
+        app.config.setdefault('STATIC_MAX_AGE', 365 * 24 * 60 * 60)
+        app.extensions['asset_manifest'] = self.load(
+            app.config['STATIC_MANIFEST']
+        )
+        app.jinja_env.globals['asset_urls'] = asset_urls
+        app.view_functions['static'] = send_static_file
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, TypeError, ValueError):
+            return {}
+
+
+asset_manifest = AssetManifest()
+
+
+def asset_urls(name):
+    """
+    Returns the urls of a bundle or of another static file.
+    """
+    manifest = current_app.extensions['asset_manifest']
+    if name in manifest:
+        return [url_for('static', filename=manifest[name])]
+    # Not built, as in development. Flask-Assets is only imported then.
+    from clearstate.assets import BUNDLES, assets
+    if name in BUNDLES:
+        return assets[name].urls()
+    return [url_for('static', filename=name)]
+
+
+def send_static_file(filename):
+    """
+    Serve a static file. The built assets are cached for STATIC_MAX_AGE
+    and served compressed if the client accepts one of their encodings.
+    """
+    app = current_app
+    manifest = app.extensions['asset_manifest']
+    if filename not in manifest.values():
+        return app.send_static_file(filename)
+
+    for encoding, ext in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(
+                os.path.join(app.static_folder, filename + ext)):
+            response = send_from_directory(
+                app.static_folder, filename + ext,
+                mimetype=mimetypes.guess_type(filename)[0],
+            )
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(app.static_folder, filename)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % (
+        app.config['STATIC_MAX_AGE']
+    )
+    return response
@@ -1,3 +1 @@
 '''The page module.'''
-
-from . import views
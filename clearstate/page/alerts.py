@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Ingestion of the alerts of monitoring systems.
+
+Monitoring systems post batches of alerts to a page, each with a name and
+whether it is firing or resolved. The alert rules of the page map alert
+names to components, and the status of a component becomes the worst
+status of the rules whose alerts are firing, or operational when none are.
+
+Alert storms are absorbed:
+
+* A batch is written in one transaction, and every component changes
+  status at most once per batch, however many of its alerts the batch has.
+* Only the alerts whose state changed are written.
+* A component is made worse as soon as an alert fires, but only recovers
+  once it has been in its status for ALERT_RECOVERY_DELAY seconds, so an
+  alert flapping between firing and resolved does not flap the component.
+  A recovery that is held back is recorded with the time it is due, and
+  applied by :func:`apply_due_recoveries` (which the notification worker
+  runs), or by a later batch.
+"""
+from datetime import datetime, timedelta
+from fnmatch import fnmatchcase
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from clearstate.database import db
+from clearstate.page.models import Component, AlertRule, Alert
+from clearstate.compat import string_types
+
+
+class InvalidAlerts(ValueError):
+    pass
+
+
+def parse_alerts(data):
+    """
+    Returns the state of every alert in a batch as an ordered list of
+    (name, firing) pairs, keeping only the last state of an alert that is
+    repeated. A batch is either a list of alerts or an object with an
+    `alerts` list, where an alert is an object like::
+
+        {"name": "api-latency", "status": "firing"}
+
+    The status is `firing` (the default) or `resolved`.
+    """
+    if isinstance(data, dict):
+        data = data.get('alerts')
+    if not isinstance(data, list):
+        raise InvalidAlerts('Expected a list of alerts')
+
+    states = {}
+    for alert in data:
+        if not isinstance(alert, dict) or \
+                not isinstance(alert.get('name'), string_types) or \
+                not alert['name'] or len(alert['name']) > 255:
+            raise InvalidAlerts('Every alert needs a name')
+        status = alert.get('status', 'firing')
+        if status not in ('firing', 'resolved'):
+            raise InvalidAlerts('Invalid status %r' % status)
+        states.pop(alert['name'], None)
+        states[alert['name']] = status == 'firing'
+    return list(states.items())
+
+
+def record_alerts(page_id, states, now):
+    """
+    Store the state of the alerts, writing only those that changed.
+    Returns the number of alerts written.
+    """
+    names = [name for name, _ in states]
+    alerts = dict(
+        (alert.name, alert) for alert in Alert.query.filter(
+            Alert.page_id == page_id, Alert.name.in_(names)
+        )
+    ) if names else {}
+    written = 0
+    for name, firing in states:
+        alert = alerts.get(name)
+        if alert is None:
+            db.session.add(Alert(
+                page_id=page_id, name=name, firing=firing, update_time=now
+            ))
+        elif alert.firing != firing:
+            alert.firing = firing
+            alert.update_time = now
+        else:
+            continue
+        written += 1
+    return written
+
+
+def component_statuses(page_id):
+    """
+    Returns the status the alerts of the page call for, of every component
+    that has alert rules.
+    """
+    statuses = list(Component.status_map.keys())
+    rules = AlertRule.query.filter(AlertRule.page_id == page_id).all()
+    firing = [
+        name for name, in db.session.query(Alert.name).filter(
+            Alert.page_id == page_id, Alert.firing == True  # noqa
+        )
+    ]
+    result = {}
+    for rule in rules:
+        status = result.setdefault(rule.component_id, statuses[0])
+        if statuses.index(rule.status) > statuses.index(status) and any(
+                fnmatchcase(name, rule.pattern) for name in firing):
+            result[rule.component_id] = rule.status
+    return result
+
+
+def update_components(page_id, now):
+    """
+    Set the components of the page to the status their alerts call for,
+    holding back the recoveries that are not due yet. Returns the
+    components changed and held back, and the status of every component
+    with alert rules.
+    """
+    statuses = list(Component.status_map.keys())
+    recovery_delay = timedelta(
+        seconds=current_app.config['ALERT_RECOVERY_DELAY']
+    )
+    targets = component_statuses(page_id)
+    components = Component.query.filter(
+        Component.id.in_(list(targets))
+    ).all() if targets else []
+
+    changed, held = [], []
+    for component in components:
+        status = targets[component.id]
+        if status == component.status:
+            component.recovery_due = None
+            continue
+        if statuses.index(status) < statuses.index(component.status) and \
+                component.status_since is not None and \
+                now - component.status_since < recovery_delay:
+            component.recovery_due = component.status_since + recovery_delay
+            held.append(component)
+            continue
+        component.status = status
+        component.recovery_due = None
+        changed.append(component)
+    return changed, held, targets
+
+
+def ingest_alerts(page, data, now=None):
+    """
+    Record a batch of alerts posted to the page and update the status of
+    the components accordingly, in a single transaction.
+
+    Returns a summary of the alerts written and the component transitions
+    made and held back.
+    """
+    now = now or datetime.utcnow()
+    states = parse_alerts(data)
+    page_id = page.id
+    try:
+        written = record_alerts(page_id, states, now)
+        db.session.flush()
+    except IntegrityError:
+        # A concurrent batch added one of the new alerts first. They are
+        # updated instead.
+        db.session.rollback()
+        written = record_alerts(page_id, states, now)
+        db.session.flush()
+
+    changed, held, targets = update_components(page_id, now)
+    db.session.commit()
+
+    return {
+        'alerts': len(states),
+        'written': written,
+        'changed': [component.serialize() for component in changed],
+        'held': [
+            dict(component.serialize(), target=targets[component.id])
+            for component in held
+        ],
+    }
+
+
+def apply_due_recoveries(now=None):
+    """
+    Apply the recoveries held back by earlier batches that are due now,
+    whether or not alerts were posted since. Returns the number of
+    components that recovered.
+    """
+    now = now or datetime.utcnow()
+    page_ids = [
+        page_id for page_id, in db.session.query(Component.page_id).filter(
+            Component.recovery_due <= now
+        ).distinct()
+    ]
+    recovered = 0
+    for page_id in page_ids:
+        changed, _, _ = update_components(page_id, now)
+        recovered += len(changed)
+    db.session.commit()
+    return recovered
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+An in-process index of the domains of status pages.
+
+Requests to the root of the site are routed to a status page based on the
+host name. Looking up the index does not need a query, the index is loaded
+once and is reloaded only when a page changes (or periodically, to pick up
+changes made by other worker processes).
+
+The index is shared by the threads of a process. It is replaced in one
+step, and is invalidated once the changes to a page are committed.
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from werkzeug.urls import url_parse
+
+from clearstate.database import db
+from clearstate.page.models import Page
+
+
+def normalize_host(value):
+    """
+    Returns the lower cased host name without the port from a host header
+    or a site url (which may or may not have a scheme and path).
+    """
+    value = (value or '').strip().lower()
+    if '://' in value:
+        value = url_parse(value).netloc
+    value = value.split('/', 1)[0]
+    return value.split(':', 1)[0]
+
+
+class PageDomainIndex(object):
+    """
+    Maps host names to the ID of the page that should be served for them.
+    """
+
+    def __init__(self):
+        #: The index and when it was loaded, replaced together
+        self._state = None
+        #: Changed by every invalidation, so that an index loaded before
+        #: is not kept
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Build the index from the active pages in the database. Returns the
+        index.
+        """
+        with self._lock:
+            state = self._state
+            if not self.expired(state):
+                # Loaded by another thread meanwhile
+                return state[0]
+            generation = self._generation
+            pages = db.session.query(Page.id, Page.site_url).filter(
+                Page.active == True  # noqa
+            )
+            index = dict(
+                (normalize_host(site_url), page_id)
+                for page_id, site_url in pages
+            )
+            if generation == self._generation:
+                self._state = (index, time.time())
+            return index
+
+    def invalidate(self):
+        """
+        Mark the index as stale. It is reloaded on the next lookup.
+        """
+        self._generation += 1
+        self._state = None
+
+    def expired(self, state):
+        """
+        Returns True if the index and load time in state must be reloaded.
+        The state is read once by the caller, as other threads replace it.
+        """
+        if state is None:
+            return True
+        ttl = current_app.config['PAGE_DOMAIN_INDEX_TTL']
+        return ttl is not None and time.time() - state[1] > ttl
+
+    def lookup(self, host):
+        """
+        Returns the ID of the page served on the given host or None.
+
+        :param host: The host header of the request
+        """
+        state = self._state
+        if self.expired(state):
+            index = self.load()
+        else:
+            index = state[0]
+        return index.get(normalize_host(host))
+
+
+domain_index = PageDomainIndex()
+
+
+def invalidate_domain_index_later(target):
+    """
+    Invalidate the index once the transaction commits, so that it is not
+    reloaded with the rows before the change, or with a change that is
+    rolled back.
+    """
+    session = object_session(target)
+    if session is not None:
+        session.info['domain_index_stale'] = True
+
+
+@event.listens_for(Page, 'after_insert')
+@event.listens_for(Page, 'after_delete')
+def invalidate_domain_index(mapper, connection, target):
+    invalidate_domain_index_later(target)
+
+
+@event.listens_for(Page, 'after_update')
+def invalidate_domain_index_on_update(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.site_url.history.has_changes() or \
+            state.attrs.active.history.has_changes():
+        invalidate_domain_index_later(target)
+
+
+@event.listens_for(Session, 'after_commit')
+def drop_domain_index(session):
+    if session.info.pop('domain_index_stale', False):
+        domain_index.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_domain_index(session):
+    session.info.pop('domain_index_stale', None)
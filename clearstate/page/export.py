@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Export of status pages as static files.
+
+Every page is exported to a directory named after its host name, which a
+web server or CDN can serve without the app or the database::
+
+    <output>/<host>/index.html              The status page as of today
+    <output>/<host>/status.json             The machine readable status
+    <output>/<host>/history/<date>.html     Incidents of the days till date
+                                            (and the uptime as of today)
+    <output>/<host>/incidents/<id>.html     An incident and its updates
+    <output>/<host>/static/...              The stylesheets, scripts and
+                                            fonts the pages link to
+
+The files are rendered through the app itself, so they are identical to
+what the app serves. A manifest of the inputs each file was rendered from
+is kept in the output directory, and later exports only render the files
+whose inputs changed. A file that fails to render is left as it was.
+
+Like the built assets, the static files of earlier exports are left in
+place.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import re
+from datetime import date, datetime
+
+import pytz
+from werkzeug.urls import url_parse
+
+from clearstate.page.domains import normalize_host
+from clearstate.page.models import Page, Incident
+
+MANIFEST = '.manifest.json'
+
+#: Links in the exported pages
+LINK = re.compile(r'(?:href|src)="([^"]+)"')
+
+#: Links in the exported stylesheets, to fonts and images
+CSS_URL = re.compile(r'''url\(\s*['"]?([^'")]+)''')
+
+#: Windows of history pages are aligned to this date so that the name and
+#: contents of a history page do not change from one day to the next
+EPOCH = date(1970, 1, 1)
+
+
+def fingerprint(*inputs):
+    return hashlib.sha1(repr(inputs).encode('utf-8')).hexdigest()
+
+
+class StaticExport(object):
+    """
+    Exports all the pages to an output directory.
+
+    :param app: The application to render the pages with
+    :param output_dir: The directory to write the files to
+    :param days: The number of days shown on a page, defaults to
+                 STATUS_PAGE_DAYS
+    """
+
+    def __init__(self, app, output_dir, days=None):
+        self.app = app
+        self.output_dir = output_dir
+        self.days = days or app.config['STATUS_PAGE_DAYS']
+        # Pages are rendered again when the assets they link to are rebuilt
+        self.assets = sorted(
+            app.extensions.get('asset_manifest', {}).items()
+        )
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.output_dir, MANIFEST)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def files(self, page):
+        """
+        Yields the path, url and fingerprint of the inputs of every file
+        exported for the page.
+        """
+        host = normalize_host(page.site_url) or str(page.id)
+        tz = page.effective_tz
+        today = datetime.now(tz).date()
+        # Every page shows the uptime of the components till today (UTC)
+        uptime_date = datetime.utcnow().date()
+        incidents = Incident.query.filter(
+            Incident.page_id == page.id
+        ).order_by(Incident.id).all()
+
+        def local_date(incident):
+            return pytz.utc.localize(incident.create_time).astimezone(
+                tz
+            ).date()
+
+        yield (
+            os.path.join(host, 'index.html'),
+            '/pages/%d' % page.id,
+            fingerprint(page.version, today, uptime_date, self.assets),
+        )
+        yield (
+            os.path.join(host, 'status.json'),
+            '/pages/%d/status.json' % page.id,
+            fingerprint(page.version),
+        )
+
+        # Group the incidents into windows of days ending on aligned dates
+        windows = {}
+        for incident in incidents:
+            offset = (local_date(incident) - EPOCH).days
+            end = offset - offset % self.days + self.days - 1
+            windows.setdefault(end, []).append(incident)
+        for end in sorted(windows):
+            end_date = date.fromordinal(EPOCH.toordinal() + end)
+            till_date = min(end_date, today)
+            yield (
+                os.path.join(
+                    host, 'history', '%s.html' % end_date.isoformat()
+                ),
+                '/pages/%d?date=%s' % (page.id, till_date.isoformat()),
+                fingerprint(
+                    page.name, page.timezone, till_date, uptime_date,
+                    self.assets, [
+                        (
+                            incident.id, incident.title,
+                            incident.current_status, incident.create_time,
+                            incident.last_update_time,
+                        ) for incident in windows[end]
+                    ]
+                ),
+            )
+
+        for incident in incidents:
+            yield (
+                os.path.join(host, 'incidents', '%d.html' % incident.id),
+                '/pages/%d/history/%d' % (page.id, incident.id),
+                fingerprint(
+                    page.name, page.timezone, incident.title,
+                    incident.create_time, incident.last_update_time,
+                    self.assets,
+                ),
+            )
+
+    def write(self, path, data):
+        """
+        Write the file atomically so that a half written file is never
+        served.
+        """
+        path = os.path.join(self.output_dir, path)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.rename(path + '.tmp', path)
+
+    def copy_assets(self, host, html, copied):
+        """
+        Copy the static files linked to by the page to the directory of the
+        host, with the files the stylesheets link to in turn.
+
+        :param copied: The files copied to the host in this run
+        """
+        prefix = self.app.static_url_path + '/'
+        for link in LINK.findall(html):
+            path = url_parse(link).path
+            if path.startswith(prefix):
+                self.copy_asset(host, path[len(prefix):], copied)
+
+    def copy_asset(self, host, filename, copied):
+        filename = posixpath.normpath(filename)
+        if filename.startswith('..') or (host, filename) in copied:
+            return
+        copied.add((host, filename))
+        try:
+            with open(os.path.join(self.app.static_folder, filename), 'rb') \
+                    as f:
+                data = f.read()
+        except IOError:
+            self.app.logger.warning('Could not export %s', filename)
+            return
+
+        target = os.path.join(self.output_dir, host, 'static', filename)
+        try:
+            with open(target, 'rb') as f:
+                unchanged = f.read() == data
+        except IOError:
+            unchanged = False
+        if not unchanged:
+            self.write(os.path.join(host, 'static', filename), data)
+
+        if filename.endswith('.css'):
+            for url in CSS_URL.findall(data.decode('utf-8', 'replace')):
+                url = url_parse(url.strip())
+                if url.scheme or url.netloc or url.path.startswith('/'):
+                    continue
+                self.copy_asset(host, posixpath.join(
+                    posixpath.dirname(filename), url.path
+                ), copied)
+
+    def run(self, full=False):
+        """
+        Export the pages. Returns the number of files written, skipped
+        because they did not change and removed.
+
+        :param full: Render every file, even if its inputs did not change
+        """
+        previous = self.load_manifest()
+        old_manifest = {} if full else previous
+        manifest = {}
+        written = skipped = 0
+        copied = set()
+
+        # Every request closes the session, so load what is needed up front
+        pages = Page.query.filter(Page.active == True).all()  # noqa
+        files = [file for page in pages for file in self.files(page)]
+
+        client = self.app.test_client()
+        days = self.app.config['STATUS_PAGE_DAYS']
+        self.app.config['STATUS_PAGE_DAYS'] = self.days
+        try:
+            for path, url, inputs in files:
+                if old_manifest.get(path) == inputs and \
+                        os.path.exists(os.path.join(self.output_dir, path)):
+                    manifest[path] = inputs
+                    skipped += 1
+                    continue
+                response = client.get(url)
+                if response.status_code != 200:
+                    self.app.logger.warning(
+                        'Could not export %s: %s', url, response.status
+                    )
+                    # Keep the file exported before, to be rendered again
+                    # by the next run
+                    if path in previous:
+                        manifest[path] = None
+                    continue
+                self.write(path, response.data)
+                if path.endswith('.html'):
+                    host = path.split(os.sep, 1)[0]
+                    self.copy_assets(
+                        host, response.data.decode('utf-8'), copied
+                    )
+                manifest[path] = inputs
+                written += 1
+        finally:
+            self.app.config['STATUS_PAGE_DAYS'] = days
+
+        # Remove the files of deleted pages and incidents
+        removed = 0
+        for path in set(previous) - set(manifest):
+            try:
+                os.remove(os.path.join(self.output_dir, path))
+                removed += 1
+            except OSError:
+                pass
+
+        self.write(MANIFEST, json.dumps(manifest, indent=2).encode('utf-8'))
+        return written, skipped, removed
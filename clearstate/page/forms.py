@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from flask_wtf import Form
 from wtforms import TextField, SelectField, TextAreaField, RadioField
-from wtforms.validators import DataRequired, URL, Optional, ValidationError
+from wtforms.validators import DataRequired, URL, Optional, ValidationError, \
+    Email
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
-from clearstate.page.models import timezones, IncidentUpdate
+from clearstate.page.models import timezones, IncidentUpdate, Component
 
 
 class PageForm(Form):
@@ -60,3 +61,29 @@ class PageDeleteForm(Form):
     def validate_name(self, field):
         if field.data.lower() != self.page_name.lower():
             raise ValidationError('Name should match the page name')
+
+
+class SubscriberForm(Form):
+    kind = SelectField(
+        'Notify by', choices=[('email', 'Email'), ('webhook', 'Webhook')],
+        validators=[DataRequired()]
+    )
+    address = TextField(
+        'Email address or webhook URL', validators=[DataRequired()]
+    )
+
+    def validate_address(self, field):
+        validator = Email() if self.kind.data == 'email' else URL()
+        validator(self, field)
+
+
+ALERT_STATUSES = list(Component.status_map.keys())[1:]
+
+
+class AlertRuleForm(Form):
+    pattern = TextField('Alert names', validators=[DataRequired()])
+    component = QuerySelectField('Component', get_label='name')
+    status = SelectField(
+        'Status', choices=zip(ALERT_STATUSES, ALERT_STATUSES),
+        default='Major Outage', validators=[DataRequired()]
+    )
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Live updates of status pages, streamed to viewers as Server-Sent Events.
+
+Every process keeps one channel per page that has viewers connected. The
+channel polls the version of the page and only when it changes, loads the
+components and incident updates to find out what changed. The changes are
+then fanned out to all the viewers of the page in the process. The database
+is therefore polled once per page and not once per viewer.
+
+A stream takes a worker thread for as long as the viewer stays on the page,
+so a process serves at most LIVE_UPDATES_MAX_STREAMS of them, leaving the
+other threads to the rest of the requests. Viewers turned away poll the
+status of the page instead.
+"""
+import json
+import threading
+import time
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+from clearstate.database import db
+from clearstate.routing import read_from_replica
+from clearstate.page.models import Page, Component, Incident, \
+    IncidentUpdate
+
+
+class TooManyStreams(Exception):
+    """
+    The process already streams LIVE_UPDATES_MAX_STREAMS pages.
+    """
+
+
+class PageChannel(object):
+    """
+    Watches a page for changes and publishes them to the subscribers.
+
+    :param page_id: ID of the page to watch
+    """
+
+    def __init__(self, page_id):
+        self.page_id = page_id
+        self.subscribers = set()
+        self.version = None
+        self.statuses = {}
+        self.last_update_id = 0
+
+    def subscribe(self, maxsize=100):
+        queue = Queue(maxsize)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event, data):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait((self.version, event, data))
+            except Full:
+                # The viewer is not reading, it would not miss much
+                pass
+
+    def prime(self):
+        """
+        Load the current state of the page, without publishing anything.
+        """
+        self.version = db.session.query(Page.version).filter(
+            Page.id == self.page_id
+        ).scalar()
+        self.statuses = dict(
+            db.session.query(Component.id, Component.status).filter(
+                Component.page_id == self.page_id
+            )
+        )
+        self.last_update_id = db.session.query(
+            db.func.max(IncidentUpdate.id)
+        ).join(Incident).filter(
+            Incident.page_id == self.page_id
+        ).scalar() or 0
+
+    def poll(self):
+        """
+        Check if the page changed since the last poll and publish the
+        component status changes and new incident updates if it did.
+
+        Returns the number of events published.
+        """
+        version = db.session.query(Page.version).filter(
+            Page.id == self.page_id
+        ).scalar()
+        if version is None or version == self.version:
+            return 0
+        self.version = version
+
+        events = []
+        components = Component.query.filter(
+            Component.page_id == self.page_id
+        ).all()
+        for component in components:
+            if self.statuses.get(component.id) != component.status:
+                data = component.serialize()
+                data['status_css'] = component.status_css
+                events.append(('component', data))
+        self.statuses = dict(
+            (component.id, component.status) for component in components
+        )
+
+        updates = IncidentUpdate.query.join(Incident).filter(
+            Incident.page_id == self.page_id,
+            IncidentUpdate.id > self.last_update_id,
+        ).order_by(IncidentUpdate.id).all()
+        for update in updates:
+            events.append(('incident-update', {
+                'id': update.id,
+                'status': update.status,
+                'message': update.message,
+                'create_time': update.create_time.isoformat(),
+                'incident': update.incident.serialize(),
+            }))
+            self.last_update_id = update.id
+
+        for event, data in events:
+            self.publish(event, data)
+        return len(events)
+
+
+class LiveUpdates(object):
+    """
+    The channels of the pages being watched in this process. A channel
+    polls the database in a background thread for as long as it has
+    subscribers.
+    """
+
+    def __init__(self):
+        self.channels = {}
+        self.streams = 0
+        self.lock = threading.Lock()
+
+    def subscribe(self, app, page_id):
+        """
+        Returns a queue on which the changes to the page are put as
+        ``(version, event, data)`` tuples.
+
+        Raises :class:`TooManyStreams` if the process already has
+        LIVE_UPDATES_MAX_STREAMS subscribers.
+        """
+        with self.lock:
+            if self.streams >= app.config['LIVE_UPDATES_MAX_STREAMS']:
+                raise TooManyStreams()
+            self.streams += 1
+            channel = self.channels.get(page_id)
+            if channel is None:
+                channel = self.channels[page_id] = PageChannel(page_id)
+                thread = threading.Thread(
+                    target=self.watch, args=(app, channel)
+                )
+                thread.daemon = True
+                thread.start()
+            return channel.subscribe(app.config['LIVE_UPDATES_QUEUE_SIZE'])
+
+    def unsubscribe(self, page_id, queue):
+        with self.lock:
+            channel = self.channels.get(page_id)
+            if channel is not None and queue in channel.subscribers:
+                channel.unsubscribe(queue)
+                self.streams -= 1
+
+    def watch(self, app, channel):
+        interval = app.config['LIVE_UPDATES_POLL_INTERVAL']
+        with app.app_context():
+            read_from_replica()
+            while True:
+                with self.lock:
+                    if not channel.subscribers:
+                        del self.channels[channel.page_id]
+                        return
+                try:
+                    if channel.version is None:
+                        channel.prime()
+                    else:
+                        channel.poll()
+                except Exception:
+                    app.logger.exception(
+                        'Could not poll page %s for changes', channel.page_id
+                    )
+                finally:
+                    db.session.remove()
+                time.sleep(interval)
+
+
+live_updates = LiveUpdates()
+
+
+def format_event(version, event, data):
+    """
+    Format an event in the text/event-stream format
+    """
+    return 'id: %s\nevent: %s\ndata: %s\n\n' % (
+        version, event, json.dumps(data)
+    )
+
+
+def stream_events(queue, keepalive):
+    """
+    Yields the events put on the queue of a subscriber, and a comment every
+    `keepalive` seconds to keep the connection open when nothing happens.
+    """
+    yield 'retry: 5000\n\n'
+    while True:
+        try:
+            event = queue.get(timeout=keepalive)
+        except Empty:
+            yield ': keepalive\n\n'
+        else:
+            yield format_event(*event)
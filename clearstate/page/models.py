@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
-from itertools import groupby
 from collections import OrderedDict
 
 from dateutil.relativedelta import relativedelta
 import pytz
 from pytz import common_timezones
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import Session, backref, column_property, \
+    object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from clearstate.database import (
     Column,
     db,
@@ -17,6 +20,41 @@ from clearstate.database import (
 timezones = list(common_timezones)
 
 
+_timezones = {}
+
+
+def get_timezone(name):
+    """
+    Returns the pytz timezone with the given name, creating it only once.
+    """
+    tz = _timezones.get(name)
+    if tz is None:
+        tz = _timezones[name] = pytz.timezone(name)
+    return tz
+
+
+def split_by_day(start, end):
+    """
+    Splits the time between two naive datetimes into the (date, seconds)
+    spent on each day.
+    """
+    while start < end:
+        next_day = datetime.combine(
+            start.date() + relativedelta(days=1), datetime.min.time()
+        )
+        upto = min(next_day, end)
+        yield start.date(), int((upto - start).total_seconds())
+        start = upto
+
+
+incident_statuses = [
+    'Investigating',
+    'Identified',
+    'Watching',
+    'Fixed',
+]
+
+
 class Page(SurrogatePK, Model):
     __tablename__ = 'page'
 
@@ -26,34 +64,201 @@ class Page(SurrogatePK, Model):
     timezone = Column(db.Enum(*timezones), nullable=True)
     active = Column(db.Boolean(), default=True)
 
+    #: Incremented whenever the page or anything displayed on it changes.
+    #: Used to key cached renderings of the page.
+    version = Column(db.Integer, nullable=False, default=0)
+    #: The time at which the version was last incremented
+    update_time = Column(
+        db.DateTime, nullable=False,
+        default=datetime.utcnow,
+    )
+
+    #: The number of components, maintained as they are added and removed
+    component_count = Column(db.Integer, nullable=False, default=0)
+    #: The number of incidents that have ever happened, maintained as they
+    #: are added and removed
+    incident_count = Column(db.Integer, nullable=False, default=0)
+
+    #: Secret that monitoring systems authenticate with to post alerts
+    alert_token = Column(db.String(64), unique=True, nullable=True)
+
     @property
-    def component_count(self):
+    def etag(self):
         """
-        Returns the number of components
+        A strong entity tag for representations of the page
         """
-        return Component.query.filter(
-            Component.page_id == self.id
-        ).count()
+        return '%d-%d' % (self.id, self.version)
+
+    @property
+    def overall_status(self):
+        """
+        The worst status among the components of the page
+        """
+        statuses = list(Component.status_map.keys())
+        return max(
+            [component.status for component in self.components] or
+            [statuses[0]],
+            key=statuses.index
+        )
 
     @property
-    def incident_count(self):
+    def open_incidents(self):
         """
-        Returns the number of incidents that have ever happened
+        Incidents that have not been fixed yet, most recent first
         """
         return Incident.query.filter(
             Incident.page_id == self.id,
-        ).count()
+            or_(
+                Incident.current_status == None,  # noqa
+                Incident.current_status != 'Fixed',
+            )
+        ).order_by(Incident.create_time.desc()).all()
+
+    def serialize(self):
+        """
+        Returns a JSON serializable summary of the page, its components and
+        open incidents.
+        """
+        return {
+            'id': self.id,
+            'name': self.name,
+            'site_url': self.site_url,
+            'timezone': self.effective_tz.zone,
+            'update_time': self.update_time.isoformat(),
+            'status': self.overall_status,
+            'groups': [
+                {
+                    'name': group and group.name,
+                    'components': [
+                        component.serialize() for component in components
+                    ],
+                }
+                for group, components in self.components_by_group()
+            ],
+            'incidents': [
+                incident.serialize() for incident in self.open_incidents
+            ],
+        }
+
+    def uptime(self, till_date=None, days=90):
+        """
+        Returns a list of (component, uptime, days) for the components of the
+        page, where uptime is the percentage of time the component was
+        operational and days is a list of dicts with the `date`, the worst
+        `status` and the `seconds` spent in each status on the day.
+
+        All the rollups are loaded with a single query.
+
+        :param till_date: The last (UTC) date to include, today by default
+        :param days: The number of days to go back from `till_date`
+        """
+        now = datetime.utcnow()
+        till_date = till_date or now.date()
+        dates = [
+            till_date - relativedelta(days=delta_days)
+            for delta_days in reversed(range(days))
+        ]
+        components = sorted(self.components, key=lambda c: c.name)
+
+        seconds = {}
+        rollups = db.session.query(
+            ComponentDailyStatus.component_id,
+            ComponentDailyStatus.date,
+            ComponentDailyStatus.status,
+            ComponentDailyStatus.seconds,
+        ).join(Component).filter(
+            Component.page_id == self.id,
+            ComponentDailyStatus.date >= dates[0],
+            ComponentDailyStatus.date <= dates[-1],
+        )
+        for component_id, date, status, duration in rollups:
+            by_status = seconds.setdefault((component_id, date), {})
+            by_status[status] = by_status.get(status, 0) + duration
+
+        # The time since the last transition is not rolled up yet
+        for component in components:
+            if component.status_since is None:
+                continue
+            for date, duration in split_by_day(component.status_since, now):
+                by_status = seconds.setdefault((component.id, date), {})
+                by_status[component.status] = \
+                    by_status.get(component.status, 0) + duration
+
+        statuses = list(Component.status_map.keys())
+        result = []
+        for component in components:
+            component_days = []
+            operational = total = 0
+            for date in dates:
+                by_status = seconds.get((component.id, date), {})
+                # Statuses are ordered by severity
+                seen = [status for status in statuses if by_status.get(status)]
+                component_days.append({
+                    'date': date,
+                    'status': seen[-1] if seen else None,
+                    'seconds': by_status,
+                })
+                operational += by_status.get(statuses[0], 0)
+                total += sum(by_status.values())
+            uptime = 100.0 * operational / total if total else None
+            result.append((component, uptime, component_days))
+        return result
+
+    @classmethod
+    def reconcile_counts(cls):
+        """
+        Recount the components and incidents of every page, fixing any drift
+        in the maintained counts.
+        """
+        return cls.query.update({
+            cls.component_count: db.select(
+                [db.func.count(Component.id)]
+            ).where(Component.page_id == cls.id).as_scalar(),
+            cls.incident_count: db.select(
+                [db.func.count(Incident.id)]
+            ).where(Incident.page_id == cls.id).as_scalar(),
+        }, synchronize_session=False)
 
     def components_by_group(self):
         """
         Returns all the components in the page grouped by their
         component group. Since the component group is not mandatory, the
         group could be none.
+
+        The result is a list of (group, components) pairs ordered by the
+        name of the group, with the components without a group last. The
+        components are ordered by name. The groups and components are
+        loaded with two queries, and the `group` of the components and the
+        `components` of the page are populated with them.
         """
-        key = lambda component: component.group
-        return groupby(
-            sorted(self.components, key=key), key=key
-        )
+        groups = ComponentGroup.query.filter(
+            ComponentGroup.page_id == self.id
+        ).order_by(ComponentGroup.name, ComponentGroup.id).all()
+        components = Component.query.filter(
+            Component.page_id == self.id
+        ).order_by(Component.name, Component.id).all()
+
+        groups_by_id = dict((group.id, group) for group in groups)
+        components_by_group_id = dict((group.id, []) for group in groups)
+        ungrouped = []
+        for component in components:
+            group = groups_by_id.get(component.group_id)
+            set_committed_value(component, 'group', group)
+            if group is None:
+                ungrouped.append(component)
+            else:
+                components_by_group_id[group.id].append(component)
+
+        if 'components' not in self.__dict__:
+            set_committed_value(self, 'components', components)
+
+        result = [
+            (group, components_by_group_id[group.id])
+            for group in groups if components_by_group_id[group.id]
+        ]
+        if ungrouped:
+            result.append((None, ungrouped))
+        return result
 
     @property
     def effective_tz(self):
@@ -62,26 +267,53 @@ class Page(SurrogatePK, Model):
 
         UTC if no timezone is defined for the page.
         """
-        return pytz.timezone(
-            self.timezone if self.timezone else 'UTC'
-        )
+        return get_timezone(self.timezone or 'UTC')
 
     def get_incidents(self, till_date, days):
         """
         Returns an iterator that returns a date and incidents pair or
         an empty list
+
+        The dates are calendar days in the timezone of the page and all the
+        incidents in the window are fetched with a single query.
+
+        :param till_date: The last (most recent) date to include
+        :param days: The number of days to go back from `till_date`
         """
-        for delta_days in range(days):
-            date = till_date - relativedelta(days=delta_days)
-            start_time = datetime.combine(date, datetime.min.time())
-            end_time = datetime.combine(date, datetime.max.time())
+        if isinstance(till_date, datetime):
+            till_date = till_date.date()
+        if days < 1:
+            return
+
+        tz = self.effective_tz
+
+        def to_utc(date):
+            # Local midnight of the date in the page's timezone, as the naive
+            # UTC time the incidents are stored in.
+            return tz.localize(
+                datetime.combine(date, datetime.min.time())
+            ).astimezone(pytz.utc).replace(tzinfo=None)
+
+        dates = [
+            till_date - relativedelta(days=delta_days)
+            for delta_days in range(days)
+        ]
+        incidents_by_date = dict((date, []) for date in dates)
+
+        incidents = Incident.query.filter(
+            Incident.page_id == self.id,
+            Incident.create_time >= to_utc(dates[-1]),
+            Incident.create_time < to_utc(till_date + relativedelta(days=1)),
+        ).order_by(Incident.create_time.desc()).all()
+
+        for incident in incidents:
+            local_date = pytz.utc.localize(
+                incident.create_time
+            ).astimezone(tz).date()
+            incidents_by_date[local_date].append(incident)
 
-            # XXX: Does timezone matter here ?
-            yield date, Incident.query.filter(
-                Incident.page_id == self.id,
-                Incident.create_time >= start_time,
-                Incident.create_time <= end_time,
-            ).all()
+        for date in dates:
+            yield date, incidents_by_date[date]
 
 
 class ComponentGroup(SurrogatePK, Model):
@@ -105,10 +337,11 @@ class Component(SurrogatePK, Model):
     name = Column(db.String(50), nullable=False)
     description = Column(db.Text())
     link = Column(db.String(100))
-    status = Column(
+    # The previous status is loaded on change to log the transition
+    status = column_property(Column(
         db.Enum(*status_map.keys()),
         nullable=False, default='Operational'
-    )
+    ), active_history=True)
 
     page_id = Column(db.ForeignKey('page.id'), nullable=False)
     page = relationship('Page', backref='components')
@@ -118,13 +351,81 @@ class Component(SurrogatePK, Model):
     )
     group = relationship('ComponentGroup', backref='components')
 
+    #: Time since which the component is in its current status
+    status_since = Column(db.DateTime, nullable=True)
+    #: When a recovery called for by the alerts, and held back so that
+    #: flapping alerts do not flap the component, is due
+    recovery_due = Column(db.DateTime, nullable=True, index=True)
+
     @property
     def status_css(self):
         return self.status_map[self.status]
 
+    def serialize(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'link': self.link,
+            'status': self.status,
+        }
+
+
+class ComponentStatusChange(SurrogatePK, Model):
+    """
+    An append only log of the status transitions of components.
+    """
+    __tablename__ = 'page_component_status_change'
+
+    component_id = Column(
+        db.ForeignKey('page_component.id'), nullable=False, index=True
+    )
+    # Removed along with the component by remove_component_history
+    component = relationship('Component', backref=backref(
+        'status_changes', passive_deletes='all'
+    ))
+
+    previous_status = Column(
+        db.Enum(*Component.status_map.keys()), nullable=True
+    )
+    status = Column(db.Enum(*Component.status_map.keys()), nullable=False)
+    create_time = Column(
+        db.DateTime, nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+class ComponentDailyStatus(SurrogatePK, Model):
+    """
+    The number of seconds a component spent in a status on a (UTC) day.
+
+    The rollups are updated when the component leaves a status, so the
+    time since the last transition is not included yet.
+    """
+    __tablename__ = 'page_component_daily_status'
+    __table_args__ = (
+        db.UniqueConstraint('component_id', 'date', 'status'),
+        {'extend_existing': True},
+    )
+
+    component_id = Column(
+        db.ForeignKey('page_component.id'), nullable=False
+    )
+    date = Column(db.Date, nullable=False)
+    status = Column(db.Enum(*Component.status_map.keys()), nullable=False)
+    seconds = Column(db.Integer, nullable=False, default=0)
+
 
 class Incident(SurrogatePK, Model):
     __tablename__ = 'page_incident'
+    __table_args__ = (
+        # For the timeline and the keyset pagination of the incidents
+        db.Index(
+            'ix_page_incident_page_id_create_time',
+            'page_id', 'create_time', 'id',
+        ),
+        {'extend_existing': True},
+    )
 
     title = Column(db.String(100), nullable=False)
 
@@ -136,21 +437,25 @@ class Incident(SurrogatePK, Model):
         default=datetime.utcnow,
     )
 
+    #: State of the most recent update, maintained by the updates when
+    #: they are saved (see :func:`sync_incident_last_update`)
+    current_status = Column(db.Enum(*incident_statuses), nullable=True)
+    current_message = Column(db.Text(), nullable=True)
+    last_update_time = Column(db.DateTime, nullable=True)
+
     @property
     def message(self):
         """
         The message of the incident is the last message on the updates
         """
-        if self.last_update:
-            return self.last_update.message
+        return self.current_message
 
     @property
     def status(self):
         """
         Status of the most recent update
         """
-        if self.last_update:
-            return self.last_update.status
+        return self.current_status
 
     @property
     def last_update(self):
@@ -164,6 +469,22 @@ class Incident(SurrogatePK, Model):
             IncidentUpdate.create_time.desc(),
         ).first()
 
+    def refresh_last_update(self):
+        """
+        Recompute the state of the most recent update from the updates
+        table. Useful to backfill existing incidents.
+        """
+        last_update = self.last_update
+        if last_update:
+            self.current_status = last_update.status
+            self.current_message = last_update.message
+            self.last_update_time = last_update.last_modified
+        else:
+            self.current_status = None
+            self.current_message = None
+            self.last_update_time = None
+        return self
+
     @property
     def first_update(self):
         """
@@ -178,10 +499,7 @@ class Incident(SurrogatePK, Model):
         """
         Return the last updated time based on the updates
         """
-        return max(filter(None, [
-            self.last_update.create_time,
-            self.last_update.update_time,
-        ]))
+        return self.last_update_time
 
     @property
     def icon(self):
@@ -201,20 +519,27 @@ class Incident(SurrogatePK, Model):
             filter(None, [self.create_time, self.update_time])
         ).date()
 
+    def serialize(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'status': self.status,
+            'message': self.message,
+            'create_time': self.create_time.isoformat(),
+            'update_time': self.update_time and self.update_time.isoformat(),
+        }
+
 
 class IncidentUpdate(SurrogatePK, Model):
     __tablename__ = 'page_incident_update'
 
-    statuses = [
-        'Investigating',
-        'Identified',
-        'Watching',
-        'Fixed',
-    ]
+    statuses = incident_statuses
     status = Column(db.Enum(*statuses), nullable=False)
     message = Column(db.Text(), nullable=False)
 
-    incident_id = Column(db.ForeignKey('page_incident.id'), nullable=False)
+    incident_id = Column(
+        db.ForeignKey('page_incident.id'), nullable=False, index=True
+    )
     incident = relationship('Incident', backref='updates')
 
     create_time = Column(
@@ -226,3 +551,358 @@ class IncidentUpdate(SurrogatePK, Model):
         onupdate=datetime.utcnow,
         default=datetime.utcnow,
     )
+
+    @property
+    def last_modified(self):
+        """
+        The time at which the update was created or last edited
+        """
+        return max(filter(None, [self.create_time, self.update_time]))
+
+
+class AlertRule(SurrogatePK, Model):
+    """
+    Sets the status of a component while alerts with a matching name fire.
+    """
+    __tablename__ = 'page_alert_rule'
+
+    page_id = Column(db.ForeignKey('page.id'), nullable=False, index=True)
+    page = relationship('Page', backref='alert_rules')
+
+    #: A shell style pattern matched against the names of alerts
+    pattern = Column(db.String(255), nullable=False)
+    component_id = Column(
+        db.ForeignKey('page_component.id'), nullable=False
+    )
+    component = relationship('Component', backref=backref(
+        'alert_rules', cascade='all, delete-orphan'
+    ))
+    #: Status of the component while a matching alert fires
+    status = Column(
+        db.Enum(*Component.status_map.keys()), nullable=False,
+        default='Major Outage',
+    )
+
+
+class Alert(SurrogatePK, Model):
+    """
+    The last known state of an alert of a monitoring system.
+    """
+    __tablename__ = 'page_alert'
+    __table_args__ = (
+        db.UniqueConstraint('page_id', 'name'),
+        {'extend_existing': True},
+    )
+
+    page_id = Column(db.ForeignKey('page.id'), nullable=False)
+    name = Column(db.String(255), nullable=False)
+    firing = Column(db.Boolean(), nullable=False, default=True)
+    update_time = Column(
+        db.DateTime, nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+class Subscriber(SurrogatePK, Model):
+    """
+    A recipient of the notifications of a page, by email or webhook.
+    """
+    __tablename__ = 'page_subscriber'
+
+    kinds = ['email', 'webhook']
+
+    page_id = Column(db.ForeignKey('page.id'), nullable=False, index=True)
+    page = relationship('Page', backref='subscribers')
+
+    kind = Column(db.Enum(*kinds), nullable=False)
+    #: The email address or the url of the webhook
+    address = Column(db.String(255), nullable=False)
+    active = Column(db.Boolean(), nullable=False, default=True)
+    create_time = Column(
+        db.DateTime, nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+class Notification(SurrogatePK, Model):
+    """
+    An outbound notification to a subscriber, queued until it is delivered.
+
+    Notifications of the same event (an incident or a component) that are
+    not sent yet share a collapse key, and a newer event replaces the
+    payload of the queued notification instead of queueing another one.
+    """
+    __tablename__ = 'page_notification'
+    __table_args__ = (
+        # For the worker to find the notifications that are due
+        db.Index('ix_page_notification_state_due_time', 'state', 'due_time'),
+        {'extend_existing': True},
+    )
+
+    states = ['pending', 'sending', 'sent', 'failed']
+
+    subscriber_id = Column(
+        db.ForeignKey('page_subscriber.id'), nullable=False, index=True
+    )
+    subscriber = relationship('Subscriber', backref=backref(
+        'notifications', cascade='all, delete-orphan'
+    ))
+
+    collapse_key = Column(db.String(50), nullable=False)
+    #: The event as JSON
+    payload = Column(db.Text(), nullable=False)
+
+    state = Column(db.Enum(*states), nullable=False, default='pending')
+    attempts = Column(db.Integer, nullable=False, default=0)
+    #: When a pending notification should be attempted, or when the claim
+    #: of a worker sending it expires
+    due_time = Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    #: Token of the worker sending the notification
+    claim = Column(db.String(32), nullable=True, index=True)
+    last_error = Column(db.Text(), nullable=True)
+
+    create_time = Column(
+        db.DateTime, nullable=False,
+        default=datetime.utcnow,
+    )
+    sent_time = Column(db.DateTime, nullable=True)
+
+
+@event.listens_for(IncidentUpdate, 'after_insert')
+@event.listens_for(IncidentUpdate, 'after_update')
+def sync_incident_last_update(mapper, connection, target):
+    """
+    Copy the state of an update that was just written to its incident, if
+    it is now the most recent update on the incident.
+
+    This keeps the incident's status and message readable without querying
+    the updates.
+    """
+    last_update_time = target.last_modified
+    values = {
+        'current_status': target.status,
+        'current_message': target.message,
+        'last_update_time': last_update_time,
+    }
+    table = Incident.__table__
+    connection.execute(
+        table.update().where(
+            table.c.id == target.incident_id
+        ).where(
+            or_(
+                table.c.last_update_time == None,  # noqa
+                table.c.last_update_time <= last_update_time,
+            )
+        ).values(**values)
+    )
+
+    # Keep an incident that is already loaded in the session in sync too.
+    # An expired incident will read the new values from the database.
+    session = object_session(target)
+    incident = session.identity_map.get(
+        Incident.__mapper__.identity_key_from_primary_key(
+            [target.incident_id]
+        )
+    ) if session is not None else None
+    if incident is None or 'last_update_time' not in incident.__dict__:
+        return
+    if incident.last_update_time is None or \
+            incident.last_update_time <= last_update_time:
+        for key, value in values.items():
+            set_committed_value(incident, key, value)
+
+
+def has_changes(target):
+    """
+    Returns True if any column of the given record was modified. Records
+    are also flushed when only their relationships changed.
+    """
+    return object_session(target).is_modified(
+        target, include_collections=False
+    )
+
+
+@event.listens_for(Page, 'before_update')
+def increment_page_version(mapper, connection, target):
+    """
+    Bump the version of a page when any of its own fields are edited.
+    """
+    if has_changes(target):
+        target.version = Page.version + 1
+        target.update_time = datetime.utcnow()
+
+
+def touch_page(connection, page_id):
+    """
+    Bump the version of the page with the given id, invalidating cached
+    renderings of the page.
+
+    :param connection: The connection of the ongoing flush
+    :param page_id: ID of the page or a scalar subquery that selects it
+    """
+    table = Page.__table__
+    connection.execute(
+        table.update().where(
+            table.c.id == page_id
+        ).values(
+            version=table.c.version + 1,
+            update_time=datetime.utcnow(),
+        )
+    )
+
+
+def touch_page_of_record(mapper, connection, target):
+    session = object_session(target)
+    if target in session.dirty and not has_changes(target):
+        return
+
+    # Bump each page once per flush, however many of its records changed
+    touched = session.info.setdefault('touched_pages', set())
+    if target.page_id not in touched:
+        touched.add(target.page_id)
+        touch_page(connection, target.page_id)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def reset_touched_pages(session, flush_context):
+    session.info.pop('touched_pages', None)
+
+
+def touch_page_of_incident_update(mapper, connection, target):
+    if target in object_session(target).dirty and not has_changes(target):
+        return
+    incidents = Incident.__table__
+    touch_page(
+        connection,
+        db.select([incidents.c.page_id]).where(
+            incidents.c.id == target.incident_id
+        ).as_scalar()
+    )
+
+
+for identifier in ('after_insert', 'after_update', 'after_delete'):
+    for model in (Component, ComponentGroup, Incident):
+        event.listen(model, identifier, touch_page_of_record)
+    event.listen(IncidentUpdate, identifier, touch_page_of_incident_update)
+
+
+def add_daily_status(connection, component_id, status, start, end):
+    """
+    Add the time a component spent in a status between start and end to the
+    daily rollups.
+
+    The component is locked first, so that concurrent transactions changing
+    the status of the component do not both insert the row of a day.
+    """
+    components = Component.__table__
+    connection.execute(
+        db.select([components.c.id]).where(
+            components.c.id == component_id
+        ).with_for_update()
+    )
+    table = ComponentDailyStatus.__table__
+    for date, seconds in split_by_day(start, end):
+        criteria = db.and_(
+            table.c.component_id == component_id,
+            table.c.date == date,
+            table.c.status == status,
+        )
+        result = connection.execute(
+            table.update().where(criteria).values(
+                seconds=table.c.seconds + seconds
+            )
+        )
+        if not result.rowcount:
+            connection.execute(table.insert().values(
+                component_id=component_id, date=date, status=status,
+                seconds=seconds,
+            ))
+
+
+def log_status_change(connection, component_id, previous_status, status,
+                      time):
+    connection.execute(ComponentStatusChange.__table__.insert().values(
+        component_id=component_id,
+        previous_status=previous_status,
+        status=status,
+        create_time=time,
+    ))
+
+
+@event.listens_for(Component, 'before_insert')
+def start_component_status(mapper, connection, target):
+    target.status_since = target.status_since or datetime.utcnow()
+
+
+@event.listens_for(Component, 'after_insert')
+def log_initial_component_status(mapper, connection, target):
+    log_status_change(
+        connection, target.id, None, target.status, target.status_since
+    )
+
+
+@event.listens_for(Component, 'before_delete')
+def remove_component_history(mapper, connection, target):
+    for model in (ComponentStatusChange, ComponentDailyStatus):
+        table = model.__table__
+        connection.execute(
+            table.delete().where(table.c.component_id == target.id)
+        )
+
+
+@event.listens_for(Component, 'before_update')
+def log_component_status_change(mapper, connection, target):
+    """
+    Log a status transition and roll up the time spent in the previous
+    status.
+    """
+    history = inspect(target).attrs.status.history
+    if not history.deleted or history.deleted[0] == target.status:
+        return
+    previous_status, = history.deleted
+    now = datetime.utcnow()
+    if target.status_since is not None:
+        add_daily_status(
+            connection, target.id, previous_status, target.status_since, now
+        )
+    log_status_change(
+        connection, target.id, previous_status, target.status, now
+    )
+    target.status_since = now
+
+
+def add_to_page_count(connection, page_id, column, delta):
+    table = Page.__table__
+    connection.execute(
+        table.update().where(
+            table.c.id == page_id
+        ).values({column: table.c[column] + delta})
+    )
+
+
+def count_records_of_page(column):
+    """
+    Returns listeners that maintain the given count column of the page as
+    records are inserted, deleted or moved to another page.
+    """
+    def after_insert(mapper, connection, target):
+        add_to_page_count(connection, target.page_id, column, 1)
+
+    def after_delete(mapper, connection, target):
+        add_to_page_count(connection, target.page_id, column, -1)
+
+    def after_update(mapper, connection, target):
+        history = inspect(target).attrs.page_id.history
+        if history.deleted and history.added:
+            add_to_page_count(connection, history.deleted[0], column, -1)
+            add_to_page_count(connection, history.added[0], column, 1)
+
+    return after_insert, after_update, after_delete
+
+
+for model, column in [
+        (Component, 'component_count'), (Incident, 'incident_count')]:
+    for identifier, listener in zip(
+            ('after_insert', 'after_update', 'after_delete'),
+            count_records_of_page(column)):
+        event.listen(model, identifier, listener)
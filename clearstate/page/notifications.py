@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""
+Notifications of the subscribers of a page, by email and webhook.
+
+Posting an incident update or changing the status of a component queues a
+notification for every subscriber of the page, in the same transaction.
+Nothing is sent while handling the request: a separate worker process
+(``python manage.py notification_worker``) claims the notifications that
+are due and delivers them from a pool of threads.
+
+* The notifications of a subscriber about the same incident or component
+  are collapsed while they wait to be sent, for NOTIFICATION_COLLAPSE_DELAY
+  seconds, so a quick succession of updates sends only the latest.
+* The notifications claimed at once are batched per recipient domain, and
+  each batch is sent over a single SMTP or HTTP connection.
+* Failed deliveries are retried with an exponential back off, until
+  NOTIFICATION_MAX_ATTEMPTS attempts have failed.
+* A worker claims notifications for a limited time, after which another
+  worker may claim them, so notifications of a worker that died are sent.
+
+The worker also applies the component recoveries held back by the alerts
+(see alerts.py) once they are due.
+"""
+import json
+import smtplib
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.header import Header
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from multiprocessing.pool import ThreadPool
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import joinedload
+from werkzeug.urls import url_parse
+
+from clearstate.database import db
+from clearstate.page.alerts import apply_due_recoveries
+from clearstate.page.models import Component, Incident, IncidentUpdate, \
+    Subscriber, Notification
+
+
+def enqueue(connection, page_id, collapse_key, payload):
+    """
+    Queue a notification with the payload for every active subscriber of
+    the page. Notifications with the same collapse key that were not
+    attempted yet get the new payload instead.
+
+    :param connection: The connection of the ongoing flush
+    :param page_id: ID of the page or a scalar subquery that selects it
+    :param collapse_key: Identifies what the notification is about
+    :param payload: The event as a dictionary
+    """
+    now = datetime.utcnow()
+    payload = json.dumps(payload)
+    delay = current_app.config['NOTIFICATION_COLLAPSE_DELAY']
+    notifications = Notification.__table__
+    subscribers = Subscriber.__table__
+
+    queued = db.and_(
+        notifications.c.collapse_key == collapse_key,
+        notifications.c.state == 'pending',
+        notifications.c.attempts == 0,
+    )
+    connection.execute(
+        notifications.update().where(queued).where(
+            notifications.c.subscriber_id.in_(
+                db.select([subscribers.c.id]).where(
+                    subscribers.c.page_id == page_id
+                )
+            )
+        ).values(payload=payload)
+    )
+    connection.execute(
+        notifications.insert().from_select(
+            [
+                'subscriber_id', 'collapse_key', 'payload', 'state',
+                'attempts', 'due_time', 'create_time',
+            ],
+            db.select([
+                subscribers.c.id,
+                db.literal(collapse_key),
+                db.literal(payload),
+                db.literal('pending'),
+                db.literal(0),
+                db.literal(now + timedelta(seconds=delay)),
+                db.literal(now),
+            ]).where(
+                subscribers.c.page_id == page_id
+            ).where(
+                subscribers.c.active == True  # noqa
+            ).where(
+                ~db.exists().where(queued).where(
+                    notifications.c.subscriber_id == subscribers.c.id
+                )
+            )
+        )
+    )
+
+
+@event.listens_for(IncidentUpdate, 'after_insert')
+def notify_incident_update(mapper, connection, target):
+    incidents = Incident.__table__
+    page_id, title = connection.execute(
+        db.select([incidents.c.page_id, incidents.c.title]).where(
+            incidents.c.id == target.incident_id
+        )
+    ).first()
+    enqueue(connection, page_id, 'incident:%d' % target.incident_id, {
+        'event': 'incident-update',
+        'incident': {
+            'id': target.incident_id,
+            'title': title,
+            'status': target.status,
+            'message': target.message,
+        },
+        'create_time': target.create_time.isoformat(),
+    })
+
+
+@event.listens_for(Component, 'after_update')
+def notify_component_status(mapper, connection, target):
+    history = inspect(target).attrs.status.history
+    if not history.deleted or history.deleted[0] == target.status:
+        return
+    enqueue(connection, target.page_id, 'component:%d' % target.id, {
+        'event': 'component',
+        'component': {
+            'id': target.id,
+            'name': target.name,
+            'status': target.status,
+        },
+        'create_time': target.status_since.isoformat(),
+    })
+
+
+def format_email(page, payload):
+    """
+    Returns the subject and the text of the email of a notification
+    """
+    if payload['event'] == 'incident-update':
+        incident = payload['incident']
+        return (
+            u'[%s] %s: %s' % (page['name'], incident['title'],
+                              incident['status']),
+            u'%s\n\n%s\n\n%s' % (
+                incident['title'], incident['message'], page['url']
+            ),
+        )
+    component = payload['component']
+    return (
+        u'[%s] %s: %s' % (page['name'], component['name'],
+                          component['status']),
+        u'%s is now %s.\n\n%s' % (
+            component['name'], component['status'], page['url']
+        ),
+    )
+
+
+def recipient_domain(kind, address):
+    """
+    Returns the domain of an email address, or the scheme and host of a
+    webhook, which share a connection.
+    """
+    if kind == 'email':
+        return address.rpartition('@')[2].lower()
+    url = url_parse(address)
+    return '%s://%s' % (url.scheme.lower(), url.netloc.lower())
+
+
+class NotificationWorker(object):
+    """
+    Claims due notifications and delivers them from a pool of threads.
+
+    :param app: The application, for its configuration and database
+    :param concurrency: Number of batches delivered at the same time
+    """
+
+    def __init__(self, app, concurrency=None):
+        self.app = app
+        self.config = app.config
+        self.concurrency = concurrency or self.config['NOTIFICATION_WORKERS']
+        self.pool = ThreadPool(self.concurrency)
+
+    def claim(self):
+        """
+        Claim a batch of due notifications. Returns the claimed
+        notifications, with their subscribers and pages loaded.
+        """
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        due = db.and_(
+            Notification.state.in_(['pending', 'sending']),
+            Notification.due_time <= now,
+        )
+        ids = [id for id, in db.session.query(Notification.id).filter(
+            due
+        ).order_by(Notification.due_time).limit(
+            self.config['NOTIFICATION_BATCH_SIZE']
+        )]
+        if not ids:
+            return []
+        # Only the notifications no other worker claimed in between
+        Notification.query.filter(Notification.id.in_(ids), due).update({
+            'state': 'sending',
+            'claim': token,
+            'due_time': now + timedelta(
+                seconds=self.config['NOTIFICATION_CLAIM_TIMEOUT']
+            ),
+        }, synchronize_session=False)
+        db.session.commit()
+        return Notification.query.filter(
+            Notification.claim == token
+        ).options(
+            joinedload(Notification.subscriber).joinedload(Subscriber.page)
+        ).all()
+
+    def batches(self, notifications):
+        """
+        Group the notifications in batches of the same kind and recipient
+        domain. The notifications are converted to dictionaries, as the
+        delivery threads do not use the database session.
+        """
+        batches = {}
+        for notification in notifications:
+            subscriber = notification.subscriber
+            page = subscriber.page
+            key = (
+                subscriber.kind,
+                recipient_domain(subscriber.kind, subscriber.address)
+            )
+            batches.setdefault(key, []).append({
+                'id': notification.id,
+                'address': subscriber.address,
+                'page': {
+                    'id': page.id,
+                    'name': page.name,
+                    'url': page.site_url if '://' in page.site_url
+                    else 'http://%s' % page.site_url,
+                },
+                'payload': json.loads(notification.payload),
+            })
+        return [
+            (kind, domain, items)
+            for (kind, domain), items in batches.items()
+        ]
+
+    def deliver(self, batch):
+        """
+        Deliver a batch. Returns a list of (id, error) of the
+        notifications, where error is None if it was delivered.
+
+        If the delivery fails, the notifications delivered before the
+        failure are still reported as delivered, so they are not sent
+        again.
+        """
+        kind, domain, items = batch
+        results = []
+        try:
+            if kind == 'email':
+                self.send_emails(items, results)
+            else:
+                self.post_webhooks(domain, items, results)
+        except Exception as exc:
+            done = set(id for id, error in results)
+            results.extend(
+                (item['id'], repr(exc)) for item in items
+                if item['id'] not in done
+            )
+        return results
+
+    def send_emails(self, items, results):
+        """
+        Send the emails of the items over one SMTP connection, adding the
+        (id, error) of each item to the results as it is sent.
+        """
+        config = self.config
+        smtp = smtplib.SMTP(
+            config['NOTIFICATION_SMTP_HOST'],
+            config['NOTIFICATION_SMTP_PORT'],
+            timeout=config['NOTIFICATION_TIMEOUT'],
+        )
+        try:
+            if config['NOTIFICATION_SMTP_USE_TLS']:
+                smtp.starttls()
+            if config['NOTIFICATION_SMTP_USERNAME']:
+                smtp.login(
+                    config['NOTIFICATION_SMTP_USERNAME'],
+                    config['NOTIFICATION_SMTP_PASSWORD'],
+                )
+            for item in items:
+                subject, text = format_email(item['page'], item['payload'])
+                message = MIMEText(text.encode('utf-8'), 'plain', 'utf-8')
+                message['Subject'] = Header(subject, 'utf-8')
+                message['From'] = formataddr((
+                    Header(item['page']['name'], 'utf-8').encode(),
+                    config['NOTIFICATION_SENDER'],
+                ))
+                message['To'] = item['address']
+                try:
+                    smtp.sendmail(
+                        config['NOTIFICATION_SENDER'], [item['address']],
+                        message.as_string()
+                    )
+                except smtplib.SMTPRecipientsRefused as exc:
+                    results.append((item['id'], repr(exc)))
+                else:
+                    results.append((item['id'], None))
+        finally:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass
+
+    def post_webhooks(self, domain, items, results):
+        """
+        Post the items to their webhooks over one connection to the scheme
+        and host in domain, adding the (id, error) of each item to the
+        results as it is posted.
+        """
+        origin = url_parse(domain)
+        connection_class = HTTPSConnection \
+            if origin.scheme == 'https' else HTTPConnection
+        connection = None
+        for item in items:
+            url = url_parse(item['address'])
+            if connection is None:
+                connection = connection_class(
+                    origin.netloc, timeout=self.config['NOTIFICATION_TIMEOUT']
+                )
+            path = url.path or '/'
+            if url.query:
+                path += '?' + url.query
+            body = dict(item['payload'], page=item['page'])
+            try:
+                connection.request(
+                    'POST', path, json.dumps(body), {
+                        'Content-Type': 'application/json',
+                        'User-Agent': 'Clearstate',
+                    }
+                )
+                response = connection.getresponse()
+                response.read()
+            except (HTTPException, socket.error) as exc:
+                # Reconnect for the next notification
+                connection.close()
+                connection = None
+                results.append((item['id'], repr(exc)))
+                continue
+            if 200 <= response.status < 300:
+                results.append((item['id'], None))
+            else:
+                results.append((
+                    item['id'], 'HTTP %d %s' % (
+                        response.status, response.reason
+                    )
+                ))
+        if connection is not None:
+            connection.close()
+
+    def record(self, results):
+        """
+        Mark the delivered notifications as sent and schedule the others
+        for another attempt.
+        """
+        now = datetime.utcnow()
+        delivered = [id for id, error in results if error is None]
+        if delivered:
+            Notification.query.filter(
+                Notification.id.in_(delivered)
+            ).update({
+                'state': 'sent', 'sent_time': now, 'claim': None,
+                'attempts': Notification.attempts + 1, 'last_error': None,
+            }, synchronize_session=False)
+
+        failed = dict((id, error) for id, error in results if error)
+        for notification in Notification.query.filter(
+                Notification.id.in_(failed.keys())) if failed else []:
+            notification.attempts += 1
+            notification.last_error = failed[notification.id]
+            notification.claim = None
+            if notification.attempts >= \
+                    self.config['NOTIFICATION_MAX_ATTEMPTS']:
+                notification.state = 'failed'
+            else:
+                notification.state = 'pending'
+                notification.due_time = now + timedelta(
+                    seconds=self.retry_delay(notification.attempts)
+                )
+        db.session.commit()
+
+    def retry_delay(self, attempts):
+        """
+        Seconds to wait before the next attempt after attempts failed
+        """
+        return min(
+            self.config['NOTIFICATION_RETRY_DELAY'] * 2 ** (attempts - 1),
+            self.config['NOTIFICATION_MAX_RETRY_DELAY'],
+        )
+
+    def run_once(self):
+        """
+        Claim and deliver a batch of notifications. Returns the number of
+        notifications attempted.
+        """
+        with self.app.app_context():
+            try:
+                # The components that recover now are notified right away
+                apply_due_recoveries()
+                notifications = self.claim()
+                if not notifications:
+                    return 0
+                results = []
+                for batch_results in self.pool.imap_unordered(
+                        self.deliver, self.batches(notifications)):
+                    results.extend(batch_results)
+                self.record(results)
+                failed = sum(1 for _, error in results if error)
+                self.app.logger.info(
+                    'Delivered %d notifications, %d failed',
+                    len(results) - failed, failed
+                )
+                return len(results)
+            finally:
+                db.session.remove()
+
+    def run(self):
+        """
+        Deliver notifications as they become due, until interrupted.
+        """
+        while True:
+            if not self.run_once():
+                time.sleep(self.config['NOTIFICATION_POLL_INTERVAL'])
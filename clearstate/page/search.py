@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Full text search of the incidents of a page.
+
+Every incident is indexed as one document made of its title and the
+messages of its updates, in a table created next to the models:
+
+* On SQLite, an FTS5 virtual table ranked with bm25, if SQLite was built
+  with FTS5.
+* On Postgres, a table with a weighted tsvector column and a GIN index,
+  ranked with ts_rank_cd.
+
+The document of an incident is rewritten in the flush that changes its
+title or any of its updates. Other databases are searched without an index.
+"""
+import re
+
+from flask.ext.sqlalchemy import Pagination
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session, object_session
+
+from clearstate.database import db
+from clearstate.page.models import Incident, IncidentUpdate
+
+SEARCH_TABLE = 'page_incident_search'
+
+#: Weight of a match in the title relative to a match in a message, as
+#: the default weights of the A and B labels in Postgres
+TITLE_WEIGHT = 2.5
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+    "title, messages, page_id UNINDEXED, tokenize='porter unicode61')"
+]
+POSTGRES_DDL = [
+    "CREATE TABLE IF NOT EXISTS %s ("
+    "incident_id INTEGER PRIMARY KEY "
+    "REFERENCES page_incident (id) ON DELETE CASCADE, "
+    "page_id INTEGER NOT NULL, "
+    "document TSVECTOR NOT NULL)",
+]
+#: Indexes of the Postgres table by name. CREATE INDEX IF NOT EXISTS needs
+#: Postgres 9.5, so they are only created if pg_indexes does not list them.
+POSTGRES_INDEXES = [
+    ("ix_%s_document", "CREATE INDEX %s ON %s USING GIN (document)"),
+    ("ix_%s_page_id", "CREATE INDEX %s ON %s (page_id)"),
+]
+
+
+#: Whether FTS5 is compiled in, by version of the SQLite library
+_sqlite_fts5 = {}
+
+
+def sqlite_has_fts5(connection):
+    """
+    Returns True if the SQLite library has the FTS5 extension, which not
+    every build of SQLite has.
+    """
+    version = connection.dialect.dbapi.sqlite_version
+    if version not in _sqlite_fts5:
+        options = [
+            option for option, in connection.execute(
+                'PRAGMA compile_options'
+            )
+        ]
+        _sqlite_fts5[version] = 'ENABLE_FTS5' in options
+    return _sqlite_fts5[version]
+
+
+def search_backend(connection):
+    """
+    Returns the name of the dialect if it has a text index, else None.
+    """
+    name = connection.dialect.name
+    if name == 'sqlite':
+        return name if sqlite_has_fts5(connection) else None
+    return name if name == 'postgresql' else None
+
+
+def create_search_index(target, connection, **kwargs):
+    backend = search_backend(connection)
+    statements = {'sqlite': SQLITE_DDL, 'postgresql': POSTGRES_DDL}.get(
+        backend, []
+    )
+    for statement in statements:
+        connection.execute(
+            statement % ((SEARCH_TABLE,) * statement.count('%s'))
+        )
+    if backend != 'postgresql':
+        return
+    for name, statement in POSTGRES_INDEXES:
+        name = name % SEARCH_TABLE
+        exists = connection.execute(text(
+            'SELECT 1 FROM pg_indexes WHERE indexname = :name'
+        ), name=name).scalar()
+        if not exists:
+            connection.execute(statement % (name, SEARCH_TABLE))
+
+
+def drop_search_index(target, connection, **kwargs):
+    if search_backend(connection):
+        connection.execute('DROP TABLE IF EXISTS %s' % SEARCH_TABLE)
+
+
+event.listen(db.metadata, 'after_create', create_search_index)
+event.listen(db.metadata, 'before_drop', drop_search_index)
+
+
+def in_list(name, values):
+    """
+    Returns the placeholders and parameters of an IN clause of values.
+    """
+    params = dict(('%s_%d' % (name, i), v) for i, v in enumerate(values))
+    return ', '.join(':' + key for key in sorted(params)), params
+
+
+def index_incidents(connection, incident_ids):
+    """
+    Rewrite the documents of the given incidents from their title and
+    updates. Incidents that no longer exist are removed from the index.
+    """
+    backend = search_backend(connection)
+    if backend is None or not incident_ids:
+        return
+    placeholders, params = in_list('incident_id', sorted(incident_ids))
+    if backend == 'sqlite':
+        connection.execute(text(
+            'DELETE FROM %s WHERE rowid IN (%s)' % (SEARCH_TABLE, placeholders)
+        ), **params)
+        connection.execute(text(
+            'INSERT INTO %s (rowid, title, messages, page_id) '
+            'SELECT i.id, i.title, ('
+            '  SELECT group_concat(u.message, \' \') '
+            '  FROM page_incident_update u WHERE u.incident_id = i.id'
+            '), i.page_id '
+            'FROM page_incident i WHERE i.id IN (%s)' % (
+                SEARCH_TABLE, placeholders
+            )
+        ), **params)
+    else:
+        connection.execute(text(
+            'DELETE FROM %s WHERE incident_id IN (%s)' % (
+                SEARCH_TABLE, placeholders
+            )
+        ), **params)
+        connection.execute(text(
+            'INSERT INTO %s (incident_id, page_id, document) '
+            'SELECT i.id, i.page_id, '
+            'setweight(to_tsvector(\'english\', i.title), \'A\') || '
+            'setweight(to_tsvector(\'english\', coalesce(('
+            '  SELECT string_agg(u.message, \' \') '
+            '  FROM page_incident_update u WHERE u.incident_id = i.id'
+            '), \'\')), \'B\') '
+            'FROM page_incident i WHERE i.id IN (%s)' % (
+                SEARCH_TABLE, placeholders
+            )
+        ), **params)
+
+
+def reindex_incident_later(target, incident_id):
+    """
+    Index the incident at the end of the flush, once however many of its
+    updates changed.
+    """
+    session = object_session(target)
+    session.info.setdefault('search_incidents', set()).add(incident_id)
+
+
+@event.listens_for(Incident, 'after_insert')
+@event.listens_for(Incident, 'after_delete')
+def index_incident(mapper, connection, target):
+    reindex_incident_later(target, target.id)
+
+
+@event.listens_for(Incident, 'after_update')
+def index_incident_on_update(mapper, connection, target):
+    if inspect(target).attrs.title.history.has_changes():
+        reindex_incident_later(target, target.id)
+
+
+@event.listens_for(IncidentUpdate, 'after_insert')
+@event.listens_for(IncidentUpdate, 'after_delete')
+def index_incident_of_update(mapper, connection, target):
+    reindex_incident_later(target, target.incident_id)
+
+
+@event.listens_for(IncidentUpdate, 'after_update')
+def index_incident_of_update_on_update(mapper, connection, target):
+    if inspect(target).attrs.message.history.has_changes():
+        reindex_incident_later(target, target.incident_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def index_changed_incidents(session, flush_context):
+    incident_ids = session.info.pop('search_incidents', None)
+    if incident_ids:
+        index_incidents(
+            session.connection(mapper=inspect(Incident)), incident_ids
+        )
+
+
+def rebuild_search_index(batch_size=500):
+    """
+    Index all the incidents, for databases created before the index.
+    """
+    connection = db.session.connection(mapper=inspect(Incident))
+    create_search_index(db.metadata, connection)
+    incident_ids = [id for id, in db.session.query(Incident.id)]
+    for start in range(0, len(incident_ids), batch_size):
+        index_incidents(connection, incident_ids[start:start + batch_size])
+
+
+def search_incidents(page_id, query, page=1, per_page=10):
+    """
+    Returns a pagination of the incidents of the page matching the query,
+    best matches first. An incident matches if it contains any word of the
+    query or a word starting with it.
+
+    :param page_id: ID of the status page to search
+    :param query: The text typed by the user
+    :param page: Number of the page of results, starting from 1
+    :param per_page: Number of incidents on a page of results
+    """
+    terms = WORD.findall(query.lower())
+    if not terms:
+        return Pagination(None, page, per_page, 0, [])
+
+    connection = db.session.connection(mapper=inspect(Incident))
+    backend = search_backend(connection)
+    if backend is None:
+        return search_incidents_without_index(
+            page_id, terms, page, per_page
+        )
+
+    params = {
+        'page_id': page_id,
+        'limit': per_page,
+        'offset': (page - 1) * per_page,
+    }
+    if backend == 'sqlite':
+        params['query'] = ' OR '.join('"%s"*' % term for term in terms)
+        where = '%s MATCH :query AND page_id = :page_id' % SEARCH_TABLE
+        select = (
+            'SELECT rowid FROM %s WHERE %s '
+            'ORDER BY bm25(%s, %s, 1.0), rowid DESC '
+            'LIMIT :limit OFFSET :offset' % (
+                SEARCH_TABLE, where, SEARCH_TABLE, TITLE_WEIGHT
+            )
+        )
+        count = 'SELECT count(*) FROM %s WHERE %s' % (SEARCH_TABLE, where)
+    else:
+        params['query'] = ' | '.join('%s:*' % term for term in terms)
+        where = (
+            "page_id = :page_id AND "
+            "document @@ to_tsquery('english', :query)"
+        )
+        select = (
+            "SELECT incident_id FROM %s WHERE %s "
+            "ORDER BY ts_rank_cd(document, to_tsquery('english', :query)) "
+            "DESC, incident_id DESC "
+            "LIMIT :limit OFFSET :offset" % (SEARCH_TABLE, where)
+        )
+        count = 'SELECT count(*) FROM %s WHERE %s' % (SEARCH_TABLE, where)
+
+    incident_ids = [id for id, in connection.execute(text(select), **params)]
+    total = connection.execute(text(count), **params).scalar()
+    incidents = dict(
+        (incident.id, incident) for incident in Incident.query.filter(
+            Incident.id.in_(incident_ids)
+        )
+    ) if incident_ids else {}
+    return Pagination(
+        None, page, per_page, total,
+        [incidents[id] for id in incident_ids if id in incidents]
+    )
+
+
+def search_incidents_without_index(page_id, terms, page, per_page):
+    """
+    Scan the titles and messages of the incidents, most recent first.
+    """
+    conditions = []
+    for term in terms:
+        pattern = '%%%s%%' % term
+        conditions.append(Incident.title.ilike(pattern))
+        conditions.append(Incident.updates.any(
+            IncidentUpdate.message.ilike(pattern)
+        ))
+    return Incident.query.filter(
+        Incident.page_id == page_id, db.or_(*conditions)
+    ).order_by(
+        Incident.create_time.desc(), Incident.id.desc()
+    ).paginate(page, per_page, error_out=False)
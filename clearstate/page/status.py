@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+The public, read only views of status pages.
+
+They are registered on the pages blueprint of the full app, and on their
+own by the status app (see clearstate/status_app.py), so this module must
+not import the admin views, forms or extensions.
+"""
+from datetime import datetime
+
+from flask import render_template, request, session, current_app, abort, \
+    jsonify, Response
+from werkzeug.http import is_resource_modified
+
+from clearstate.extensions import cache
+from clearstate.routing import replica_reads
+from clearstate.page.models import Page, Incident, get_timezone
+from clearstate.page.live import live_updates, stream_events, \
+    TooManyStreams
+
+
+def get_timezone_from_page():
+    """
+    This function looks into the current request to see if there is a page_id
+    in the url parameters. If there is one, it returns the timezone or returns
+    UTC.
+
+    The page is the same instance the view looked up, so this does not
+    query the database again.
+    """
+    if request.view_args is not None and 'page_id' in request.view_args:
+        page = Page.get_by_id(request.view_args['page_id'])
+        if page is not None:
+            return page.effective_tz
+    return get_timezone('UTC')
+
+
+@replica_reads
+def render_status_page(page_id):
+    """
+    Render the given status page.
+
+    This handler is invoked to view the page in the case of multiple pages
+    with the decorated URL. The other way to reach here is through a sub
+    handler.
+    """
+    page = Page.get_by_id(page_id)
+    if page is None:
+        abort(404)
+
+    # Paginating past incidents. Today is the current date where the page
+    # is, not where the server is.
+    till_date = datetime.now(page.effective_tz).date()
+    if 'date' in request.args:
+        try:
+            till_date = datetime.strptime(
+                request.args['date'], '%Y-%m-%d'
+            ).date()
+        except ValueError:
+            pass
+
+    # The rendered page is cached until the page or anything on it changes,
+    # which bumps the version of the page, or the (UTC) day the uptime is
+    # shown till changes.
+    days = current_app.config['STATUS_PAGE_DAYS']
+    cache_key = 'status-page/%d/%d/%s/%d/%s' % (
+        page.id, page.version, till_date.isoformat(), days,
+        datetime.utcnow().date().isoformat()
+    )
+    rv = cache.get(cache_key)
+    if rv is None:
+        incidents = page.get_incidents(till_date, days)
+        rv = render_template(
+            'pages/public-page.html', page=page, incidents=incidents,
+            uptime=page.uptime(),
+        )
+        # Do not cache the flashed messages of a visitor for everyone else
+        if '_flashes' not in session:
+            cache.set(
+                cache_key, rv,
+                timeout=current_app.config['STATUS_PAGE_CACHE_TIMEOUT']
+            )
+    return rv
+
+
+@replica_reads
+def status_json(page_id):
+    """
+    A machine readable summary of the status page.
+
+    The response carries an ETag and Last-Modified header derived from the
+    version of the page and conditional requests are answered with a 304
+    without building the summary.
+    """
+    page = Page.get_by_id(page_id)
+    if page is None:
+        abort(404)
+
+    if not is_resource_modified(
+            request.environ, etag=page.etag, last_modified=page.update_time):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(page.serialize())
+    response.set_etag(page.etag)
+    response.last_modified = page.update_time
+    return response
+
+
+@replica_reads
+def render_incident(page_id, incident_id):
+    """
+    Render the public view of an incident and its updates.
+    """
+    incident = Incident.get_by_id(incident_id)
+    if incident is None or incident.page_id != page_id:
+        abort(404)
+    return render_template(
+        'pages/public-incident.html', page=incident.page, incident=incident
+    )
+
+
+@replica_reads
+def events(page_id):
+    """
+    Stream the changes to the components and incidents of the page as
+    Server-Sent Events.
+
+    Answers 503 when the process streams as many pages as it may, which
+    makes the page poll status.json instead.
+    """
+    page = Page.get_by_id(page_id)
+    if page is None:
+        abort(404)
+
+    app = current_app._get_current_object()
+    try:
+        queue = live_updates.subscribe(app, page.id)
+    except TooManyStreams:
+        return Response(
+            'Too many live updates', status=503, mimetype='text/plain',
+            headers={'Retry-After': '60'}
+        )
+
+    response = Response(
+        stream_events(queue, app.config['LIVE_UPDATES_KEEPALIVE']),
+        mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            # Do not let nginx buffer the stream
+            'X-Accel-Buffering': 'no',
+        }
+    )
+    # Called even if the stream is closed before it started
+    response.call_on_close(
+        lambda: live_updates.unsubscribe(page.id, queue)
+    )
+    return response
+
+
+def register_status_views(blueprint):
+    """
+    Add the public views to a blueprint named pages, so that their
+    endpoints are the same in both apps.
+    """
+    blueprint.add_url_rule('/<int:page_id>', view_func=render_status_page)
+    blueprint.add_url_rule('/<int:page_id>/status.json', view_func=status_json)
+    blueprint.add_url_rule(
+        '/<int:page_id>/history/<int:incident_id>', view_func=render_incident
+    )
+    blueprint.add_url_rule('/<int:page_id>/events', view_func=events)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Export and import of a status page and its history as JSON lines.
+
+A page is exported as one JSON object per line. Every record has a `type`
+and the ids it had in the source database. Records are written parents
+first (the page, its component groups, components, their status history,
+incidents and the updates of the incidents), so an import only needs to
+remember the new ids of the parents::
+
+    {"type": "page", "id": 1, "name": "Clearstate", ...}
+    {"type": "component", "id": 4, "page_id": 1, "group_id": null, ...}
+    {"type": "incident_update", "id": 9, "incident_id": 3, ...}
+
+Both directions stream: the export reads in batches with server side
+cursors, and the import inserts in chunks committed one at a time.
+"""
+import json
+import re
+from datetime import date, datetime
+
+from flask import current_app
+
+from clearstate.database import db
+from clearstate.page.domains import domain_index
+from clearstate.page.models import Page, ComponentGroup, Component, \
+    ComponentStatusChange, ComponentDailyStatus, Incident, IncidentUpdate
+from clearstate.page.search import index_incidents
+
+#: The types of records in the order they are exported, with the columns
+#: that refer to records of other types
+RECORD_TYPES = [
+    ('page', Page, {}),
+    ('component_group', ComponentGroup, {'page_id': 'page'}),
+    ('component', Component, {
+        'page_id': 'page', 'group_id': 'component_group',
+    }),
+    ('component_status_change', ComponentStatusChange, {
+        'component_id': 'component',
+    }),
+    ('component_daily_status', ComponentDailyStatus, {
+        'component_id': 'component',
+    }),
+    ('incident', Incident, {'page_id': 'page'}),
+    ('incident_update', IncidentUpdate, {'incident_id': 'incident'}),
+]
+MODELS = dict((name, model) for name, model, _ in RECORD_TYPES)
+REFERENCES = dict(
+    (name, references) for name, _, references in RECORD_TYPES
+)
+#: Types whose new ids are needed to import the records that refer to them
+REFERENCED = set(
+    target for references in REFERENCES.values()
+    for target in references.values()
+)
+
+DATETIME_SEPARATORS = re.compile(r'[-T:.]')
+
+#: Columns that are not copied, but maintained on import
+DERIVED = {
+    'page': ('version', 'component_count', 'incident_count'),
+}
+
+#: Secrets, which are neither exported nor imported. An imported page gets
+#: a new alert token when one is reset in its settings.
+SECRET = {
+    'page': ('alert_token',),
+}
+
+
+def to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+def parse_datetime(value):
+    """
+    Parse a date or date time written by :func:`to_json`. Much faster than
+    strptime, which matters for the hundreds of thousands of updates.
+    """
+    parts = [int(part) for part in DATETIME_SEPARATORS.split(value)]
+    if len(parts) == 3:
+        return date(*parts)
+    return datetime(*parts)
+
+
+def from_json(table, record):
+    """
+    Convert the JSON values of a record to the python types of the columns
+    of the table.
+    """
+    for column in table.columns:
+        value = record.get(column.name)
+        if value is None:
+            continue
+        if isinstance(column.type, (db.DateTime, db.Date)):
+            try:
+                record[column.name] = parse_datetime(value)
+            except (TypeError, ValueError):
+                raise ValueError(
+                    'Invalid %s of %s: %r' % (column.name, table.name, value)
+                )
+    return record
+
+
+def export_queries(page_id):
+    """
+    Yields the type name and the query of the records of every type, for
+    the page with the given id.
+    """
+    components = db.select([Component.id]).where(
+        Component.page_id == page_id
+    )
+    incidents = db.select([Incident.id]).where(Incident.page_id == page_id)
+    filters = {
+        'page': Page.id == page_id,
+        'component_group': ComponentGroup.page_id == page_id,
+        'component': Component.page_id == page_id,
+        'component_status_change':
+            ComponentStatusChange.component_id.in_(components),
+        'component_daily_status':
+            ComponentDailyStatus.component_id.in_(components),
+        'incident': Incident.page_id == page_id,
+        'incident_update': IncidentUpdate.incident_id.in_(incidents),
+    }
+    for name, model, _ in RECORD_TYPES:
+        table = model.__table__
+        yield name, db.session.query(table).filter(
+            filters[name]
+        ).order_by(table.c.id)
+
+
+def export_page(page_id, out, batch_size=1000):
+    """
+    Write the page with the given id and its history to the file like
+    object as JSON lines. Returns the number of records written.
+    """
+    encoder = json.JSONEncoder(default=to_json)
+    count = 0
+    for name, query in export_queries(page_id):
+        for row in query.yield_per(batch_size):
+            record = dict(zip(row.keys(), row))
+            record['type'] = name
+            for column in DERIVED.get(name, ()) + SECRET.get(name, ()):
+                record.pop(column, None)
+            # Not sorting the keys lets json use its C encoder
+            out.write(encoder.encode(record))
+            out.write('\n')
+            count += 1
+    return count
+
+
+class PageImport(object):
+    """
+    Imports a page exported by :func:`export_page` as a new page. The
+    records get new ids, so a page can be imported next to the page it was
+    exported from, given another name and site url.
+
+    Every chunk of records is committed on its own, so a failed import
+    leaves the records imported until then, which can be removed by
+    deleting the page.
+
+    :param name: Name of the new page, instead of the exported one
+    :param site_url: Site url of the new page, instead of the exported one
+    :param chunk_size: Number of records inserted per transaction
+    """
+
+    def __init__(self, name=None, site_url=None, chunk_size=1000):
+        self.overrides = dict(
+            (key, value) for key, value in
+            [('name', name), ('site_url', site_url)] if value
+        )
+        self.chunk_size = chunk_size
+        self.ids = dict((name, {}) for name in REFERENCED)
+        self.pending = []
+        self.pending_type = None
+        self.counts = dict((name, 0) for name in MODELS)
+        self.since_commit = 0
+
+    def run(self, lines):
+        """
+        Import the records from an iterable of JSON lines. Returns the new
+        page.
+        """
+        self.connection = db.engine.connect()
+        try:
+            self.transaction = self.connection.begin()
+            for line in lines:
+                line = line.strip()
+                if line:
+                    self.add(json.loads(line))
+            self.flush()
+            self.finish()
+            self.transaction.commit()
+        except:
+            self.transaction.rollback()
+            raise
+        finally:
+            self.connection.close()
+
+        domain_index.invalidate()
+        page_id, = self.ids['page'].values()
+        return Page.get_by_id(page_id)
+
+    def add(self, record):
+        name = record.pop('type')
+        if name not in MODELS:
+            raise ValueError('Unknown record type: %r' % name)
+        if name == 'page' and self.ids['page']:
+            raise ValueError('An export can only have one page')
+
+        table = MODELS[name].__table__
+        old_id = record.pop('id')
+        for column, target in REFERENCES[name].items():
+            if record.get(column) is not None:
+                try:
+                    record[column] = self.ids[target][record[column]]
+                except KeyError:
+                    raise ValueError(
+                        '%s %s refers to missing %s %s' % (
+                            name, old_id, target, record[column]
+                        )
+                    )
+        if name == 'page':
+            record.update(self.overrides)
+        # Exports made before the secrets were left out have them
+        for column in SECRET.get(name, ()):
+            record.pop(column, None)
+        record = from_json(table, record)
+        self.counts[name] += 1
+
+        if name in REFERENCED:
+            # The new id is needed by the records that follow
+            self.flush()
+            self.ids[name][old_id] = self.connection.execute(
+                table.insert(), record
+            ).inserted_primary_key[0]
+            self.maybe_commit()
+        else:
+            if name != self.pending_type:
+                self.flush()
+                self.pending_type = name
+            self.pending.append(record)
+            if len(self.pending) >= self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Insert the records waiting to be inserted in a single statement
+        """
+        if self.pending:
+            table = MODELS[self.pending_type].__table__
+            self.connection.execute(table.insert(), self.pending)
+            self.pending = []
+            self.maybe_commit(force=True)
+
+    def maybe_commit(self, force=False):
+        self.since_commit += 1
+        if force or self.since_commit >= self.chunk_size:
+            self.transaction.commit()
+            self.transaction = self.connection.begin()
+            self.since_commit = 0
+
+    def finish(self):
+        """
+        Maintain what the model events would have maintained, had the
+        records been inserted through the session.
+        """
+        if not self.ids['page']:
+            raise ValueError('The export has no page')
+        page_id, = self.ids['page'].values()
+        table = Page.__table__
+        self.connection.execute(
+            table.update().where(table.c.id == page_id).values(
+                component_count=self.counts['component'],
+                incident_count=self.counts['incident'],
+            )
+        )
+        incident_ids = sorted(self.ids['incident'].values())
+        for start in range(0, len(incident_ids), 500):
+            index_incidents(self.connection, incident_ids[start:start + 500])
+        current_app.logger.info(
+            'Imported page %s: %s', page_id, ', '.join(
+                '%d %s' % (self.counts[name], name)
+                for name, _, _ in RECORD_TYPES
+            )
+        )
@@ -1,31 +1,30 @@
 # -*- coding: utf-8 -*-
-from datetime import datetime
+import os
+from binascii import hexlify
 
-from flask import Blueprint, render_template, redirect, url_for, request, flash
+from flask import Blueprint, render_template, redirect, url_for, request, \
+    flash, current_app, abort, jsonify
 from flask.ext.login import login_required
+from werkzeug.security import safe_str_cmp
+
+from clearstate.database import db, keyset_paginate
 
 from clearstate.page.models import Page, Component, ComponentGroup, Incident, \
-    IncidentUpdate
+    IncidentUpdate, Subscriber, AlertRule
+from clearstate.page.status import register_status_views, \
+    get_timezone_from_page, render_status_page  # noqa
+from clearstate.page.search import search_incidents
+from clearstate.page.alerts import ingest_alerts, InvalidAlerts
 from clearstate.page.forms import PageForm, ComponentForm, \
     ComponentGroupForm, IncidentForm, PageDeleteForm, EditIncidentForm, \
-    UpdateIncidentForm
+    UpdateIncidentForm, SubscriberForm, AlertRuleForm
+from clearstate.compat import string_types
 from clearstate.utils import flash_errors
 
 blueprint = Blueprint(
     "pages", __name__, url_prefix='/pages', static_folder="../static"
 )
-
-
-def get_timezone_from_page():
-    """
-    This function looks into the current request to see if there is a page_id
-    in the url parameters. If there is one, it returns the timezone or returns
-    UTC.
-    """
-    if request.view_args is not None and 'page_id' in request.view_args:
-        page_id = request.view_args['page_id']
-        return Page.get_by_id(page_id).timezone
-    return 'UTC'
+register_status_views(blueprint)
 
 
 @blueprint.route("/")
@@ -66,31 +65,6 @@ def add_page():
     return render_template("pages/create-page.html", pages=pages, form=form)
 
 
-@blueprint.route('/<int:page_id>')
-def render_status_page(page_id):
-    """
-    Render the given status page.
-
-    This handler is invoked to view the page in the case of multiple pages
-    with the decorated URL. The other way to reach here is through a sub
-    handler.
-    """
-    page = Page.get_by_id(page_id)
-
-    # Paginating past incidents
-    till_date = datetime.today()
-    if 'date' in request.args:
-        try:
-            till_date = datetime.strptime(request.args['date'], '%Y-%m-%d')
-        except ValueError:
-            pass
-
-    incidents = page.get_incidents(till_date, 10)
-    return render_template(
-        'pages/public-page.html', page=page, incidents=incidents
-    )
-
-
 @blueprint.route('/<int:page_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit(page_id):
@@ -203,6 +177,62 @@ def update_component_status(page_id):
     return redirect(url_for('pages.dashboard', page_id=page_id))
 
 
+@blueprint.route(
+    '/<int:page_id>/components/update-statuses',
+    methods=['POST'])
+@login_required
+def update_component_statuses(page_id):
+    """
+    Update the status of many components of the page at once.
+
+    Expects a JSON body of the form ``{"components": {"<id>": "<status>"}}``
+    and applies all the changes in a single transaction. Responds with the
+    status of every component in the page.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    changes = data.get('components')
+    if not isinstance(changes, dict):
+        abort(400)
+    if not all(
+        isinstance(status, string_types) for status in changes.values()
+    ):
+        abort(400)
+
+    try:
+        changes = dict(
+            (int(component_id), status)
+            for component_id, status in changes.items()
+        )
+    except ValueError:
+        abort(400)
+    if any(status not in Component.status_map for status in changes.values()):
+        abort(400)
+
+    components = Component.query.filter(
+        Component.page_id == page_id
+    ).all()
+    components_by_id = dict(
+        (component.id, component) for component in components
+    )
+    if not set(changes).issubset(components_by_id):
+        # Some of the components do not belong to this page
+        abort(400)
+
+    for component_id, status in changes.items():
+        components_by_id[component_id].status = status
+    db.session.commit()
+
+    return jsonify(components=dict(
+        (component.id, {
+            'status': component.status,
+            'status_css': component.status_css,
+        })
+        for component in components
+    ))
+
+
 @blueprint.route(
     '/<int:page_id>/components/<int:component_id>/edit',
     methods=['GET', 'POST'])
@@ -258,26 +288,58 @@ def add_component_group(page_id):
 
 
 @blueprint.route('/<int:page_id>/incidents')
-@blueprint.route('/<int:page_id>/incidents/p<int:page_no>')
 @login_required
-def incidents(page_id, page_no=1):
+def incidents(page_id):
     """
-    Render the given status page's dashboard.
+    Render the incidents of the status page, most recent first.
+
+    The incidents are paginated with the `after` and `before` cursors in the
+    query string, which point to the last incident of the previous page and
+    the first incident of the next page.
 
     :param page_id: The ID of the status page
-    :param page_no: The pagination page number
     """
     page = Page.get_by_id(page_id)
-
-    incidents = Incident.query.filter(
-        Incident.page_id == page_id
-    ).order_by(Incident.create_time.desc()).paginate(page_no, 5)
+    after = request.args.get('after')
+    before = request.args.get('before')
+
+    try:
+        incidents = keyset_paginate(
+            Incident.query.filter(Incident.page_id == page_id),
+            [Incident.create_time, Incident.id], 5,
+            after=after, before=before,
+            # Counts the rows on other databases than PostgreSQL, so only
+            # on the first page
+            estimate=not (after or before),
+        )
+    except ValueError:
+        abort(400)
 
     return render_template(
         'pages/incidents.html', page=page, incidents=incidents
     )
 
 
+@blueprint.route('/<int:page_id>/incidents/search')
+@login_required
+def search(page_id):
+    """
+    Render the incidents of the status page matching the words in the `q`
+    argument, best matches first.
+
+    :param page_id: The ID of the status page
+    """
+    page = Page.get_by_id(page_id)
+    query = request.args.get('q', '')
+    results = search_incidents(
+        page_id, query, max(1, request.args.get('p', 1, type=int)), 10
+    )
+    return render_template(
+        'pages/search-incidents.html', page=page, query=query,
+        results=results
+    )
+
+
 @blueprint.route('/<int:page_id>/incidents/add', methods=['GET', 'POST'])
 @login_required
 def add_incident(page_id):
@@ -377,3 +439,128 @@ def edit_incident(page_id, incident_id):
     return render_template(
         'pages/edit-incident.html', page=page, form=form
     )
+
+
+@blueprint.route('/<int:page_id>/subscribers', methods=['GET', 'POST'])
+@login_required
+def subscribers(page_id):
+    """
+    Render the subscribers of the status page and add one on POST.
+    """
+    page = Page.get_by_id(page_id)
+
+    form = SubscriberForm(request.form)
+    if form.validate_on_submit():
+        subscriber = Subscriber(page_id=page_id)
+        form.populate_obj(subscriber)
+        subscriber.save()
+        flash('Subscriber has been added to the status page', 'success')
+        return redirect(url_for('pages.subscribers', page_id=page_id))
+    else:
+        flash_errors(form)
+
+    return render_template(
+        'pages/subscribers.html', page=page, form=form,
+        subscribers=Subscriber.query.filter_by(page_id=page_id).order_by(
+            Subscriber.kind, Subscriber.address
+        ).all()
+    )
+
+
+@blueprint.route(
+    '/<int:page_id>/subscribers/<int:subscriber_id>/delete',
+    methods=['POST'])
+@login_required
+def delete_subscriber(page_id, subscriber_id):
+    """
+    Remove a subscriber and the notifications waiting to be sent to it.
+    """
+    subscriber = Subscriber.get_by_id(subscriber_id)
+    if subscriber is None or subscriber.page_id != page_id:
+        abort(404)
+    subscriber.delete()
+    flash('Subscriber has been removed', 'success')
+    return redirect(url_for('pages.subscribers', page_id=page_id))
+
+
+@blueprint.route('/<int:page_id>/alerts', methods=['GET', 'POST'])
+@login_required
+def alerts(page_id):
+    """
+    Render the alert rules and token of the status page and add a rule on
+    POST.
+    """
+    page = Page.get_by_id(page_id)
+
+    form = AlertRuleForm(request.form)
+    form.component.query = Component.query.filter(
+        Component.page_id == page_id
+    ).order_by(Component.name)
+    if form.validate_on_submit():
+        rule = AlertRule(page_id=page_id)
+        form.populate_obj(rule)
+        rule.save()
+        flash('Alert rule has been added', 'success')
+        return redirect(url_for('pages.alerts', page_id=page_id))
+    else:
+        flash_errors(form)
+
+    return render_template(
+        'pages/alerts.html', page=page, form=form,
+        rules=AlertRule.query.filter_by(page_id=page_id).order_by(
+            AlertRule.pattern
+        ).all()
+    )
+
+
+@blueprint.route('/<int:page_id>/alerts/token', methods=['POST'])
+@login_required
+def reset_alert_token(page_id):
+    """
+    Generate a new alert token for the page, revoking the previous one.
+    """
+    page = Page.get_by_id(page_id)
+    page.alert_token = hexlify(os.urandom(24)).decode('ascii')
+    page.save()
+    flash('A new alert token has been generated', 'success')
+    return redirect(url_for('pages.alerts', page_id=page_id))
+
+
+@blueprint.route(
+    '/<int:page_id>/alerts/rules/<int:rule_id>/delete', methods=['POST'])
+@login_required
+def delete_alert_rule(page_id, rule_id):
+    rule = AlertRule.get_by_id(rule_id)
+    if rule is None or rule.page_id != page_id:
+        abort(404)
+    rule.delete()
+    flash('Alert rule has been removed', 'success')
+    return redirect(url_for('pages.alerts', page_id=page_id))
+
+
+@blueprint.route('/<int:page_id>/alerts/ingest', methods=['POST'])
+def ingest(page_id):
+    """
+    Accept a batch of alerts from a monitoring system, authenticated with
+    the alert token of the page as a bearer token. See
+    :func:`clearstate.page.alerts.ingest_alerts` for the format.
+    """
+    page = Page.get_by_id(page_id)
+    scheme, _, token = request.headers.get('Authorization', '').partition(
+        ' '
+    )
+    if page is None or not page.alert_token or \
+            scheme.lower() != 'bearer' or \
+            not safe_str_cmp(token.strip(), page.alert_token):
+        abort(401)
+
+    data = request.get_json(silent=True)
+    alerts = data.get('alerts') if isinstance(data, dict) else data
+    if isinstance(alerts, list) and \
+            len(alerts) > current_app.config['ALERT_MAX_BATCH']:
+        abort(413)
+    try:
+        summary = ingest_alerts(page, data)
+    except InvalidAlerts as exc:
+        return jsonify(error=str(exc)), 400
+    return jsonify(summary)
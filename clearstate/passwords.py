@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Hashing and checking of passwords in a bounded pool of threads.
+
+bcrypt takes a large fraction of a second of CPU per password, on purpose.
+Run inline by every request thread, a burst of logins would take all the
+CPU of a worker from the public status pages. Instead, passwords are hashed
+by PASSWORD_HASH_WORKERS threads per process, in the order they were asked
+for. At most PASSWORD_HASH_QUEUE_SIZE passwords wait for a thread, and
+asking for more, or waiting for longer than PASSWORD_HASH_TIMEOUT seconds,
+raises :class:`PasswordHasherBusy` so the login can be refused right away.
+
+bcrypt releases the GIL, so the request threads keep serving while a
+password is hashed.
+"""
+import os
+import threading
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+from flask import current_app
+
+from clearstate.admin_extensions import bcrypt
+
+#: The costs bcrypt accepts
+MIN_ROUNDS, MAX_ROUNDS = 4, 31
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Too many passwords are waiting to be hashed.
+    """
+
+
+def hash_rounds(pw_hash):
+    """
+    Returns the cost a bcrypt hash was made with, from its ``$2b$12$...``
+    prefix, or None if it is not a bcrypt hash.
+    """
+    parts = (pw_hash or '').split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class HashJob(object):
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self.done.set()
+
+
+class HashingPool(object):
+    """
+    Threads that run hashing jobs in the order they were submitted.
+
+    :param workers: Number of jobs run at the same time
+    :param queue_size: Number of jobs that may wait for a thread
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue = Queue(queue_size)
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def start(self):
+        # Threads do not survive a fork, so every process starts its own
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+            self.pid = os.getpid()
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if not job.cancelled:
+                job.run()
+
+    def submit(self, timeout, func, *args):
+        """
+        Run func with the arguments in the pool and return its result.
+        Raises :class:`PasswordHasherBusy` if the queue is full or the
+        result is not ready within timeout seconds.
+        """
+        if self.pid != os.getpid():
+            self.start()
+        job = HashJob(func, args)
+        try:
+            self.queue.put_nowait(job)
+        except Full:
+            raise PasswordHasherBusy()
+        if not job.done.wait(timeout):
+            job.cancelled = True
+            raise PasswordHasherBusy()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+
+class PasswordHasher(object):
+    """
+    Hashes and checks passwords with bcrypt in a :class:`HashingPool` of
+    the application.
+
+    PASSWORD_HASH_WORKERS
+        Number of passwords hashed at the same time by a process.
+    PASSWORD_HASH_QUEUE_SIZE
+        Number of passwords that may wait to be hashed.
+    PASSWORD_HASH_TIMEOUT
+        Seconds after which a password that was not hashed yet is given up.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 1)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_SIZE', 10)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+        app.extensions['password_hasher'] = HashingPool(
+            app.config['PASSWORD_HASH_WORKERS'],
+            app.config['PASSWORD_HASH_QUEUE_SIZE'],
+        )
+
+    def submit(self, func, *args):
+        return current_app.extensions['password_hasher'].submit(
+            current_app.config['PASSWORD_HASH_TIMEOUT'], func, *args
+        )
+
+    @property
+    def rounds(self):
+        """
+        The cost of new hashes, BCRYPT_LOG_ROUNDS within what bcrypt
+        accepts.
+        """
+        rounds = current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        return max(MIN_ROUNDS, min(MAX_ROUNDS, rounds))
+
+    def hash(self, password):
+        return self.submit(bcrypt.generate_password_hash, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        if not pw_hash:
+            return False
+        return self.submit(bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """
+        Returns True if the hash was not made with the configured cost.
+        """
+        return hash_rounds(pw_hash) != self.rounds
+
+
+password_hasher = PasswordHasher()
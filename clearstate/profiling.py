@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Counting and timing of the SQL statements executed for a request.
+
+A sample of the requests is profiled. The statements executed while
+handling a profiled request are counted and timed, and statements of the
+same shape executed several times (typically a lazy load in a loop, the
+N+1 query problem) are reported as suspects. The profile is logged and
+optionally returned in response headers::
+
+    X-Query-Count: 12
+    X-Query-Time: 8.3
+
+Requests that are not sampled only cost a clock read and an attribute lookup
+per statement, so the profiler can be left on in production.
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#: Collapse the placeholders of IN clauses, so that IN lists of different
+#: lengths have the same shape
+IN_LIST = re.compile(r'IN \((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,?)+\)')
+WHITESPACE = re.compile(r'\s+')
+
+_local = threading.local()
+
+
+def statement_shape(statement):
+    """
+    Returns the statement with its whitespace and IN lists normalized.
+    Parameters are already bound separately, so statements differing only
+    in their values have the same shape.
+    """
+    statement = WHITESPACE.sub(' ', statement).strip()
+    return IN_LIST.sub('IN (?)', statement)
+
+
+class QueryProfile(object):
+    """
+    The statements executed while the profile is active.
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.duration = 0.0
+
+    def record(self, statement, duration):
+        self.statements.append(statement)
+        self.duration += duration
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def repeated(self, threshold):
+        """
+        Returns a list of (count, shape) of the statement shapes executed at
+        least threshold times, most repeated first.
+        """
+        counts = Counter(statement_shape(s) for s in self.statements)
+        return sorted(
+            ((count, shape) for shape, count in counts.items()
+             if count >= threshold),
+            reverse=True
+        )
+
+
+def active_profiles():
+    """
+    Returns the profiles statements should be recorded in: the profile of
+    the current request, if it is sampled, and the profiles of any
+    :func:`count_queries` blocks.
+    """
+    profiles = list(getattr(_local, 'profiles', ()))
+    if has_app_context():
+        profile = getattr(g, '_query_profile', None)
+        if profile is not None:
+            profiles.append(profile)
+    return profiles
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    duration = time.time() - conn.info['query_start_time'].pop()
+    for profile in active_profiles():
+        profile.record(statement, duration)
+
+
+@event.listens_for(Engine, 'handle_error')
+def drop_timer(context):
+    """
+    A statement that fails is not recorded, and its start time must not be
+    left on the connection for the next statement.
+    """
+    if context.connection is None:
+        return
+    timers = context.connection.info.get('query_start_time')
+    if timers:
+        timers.pop()
+
+
+@contextmanager
+def count_queries():
+    """
+    Records the statements executed in the block, in the current thread::
+
+        with count_queries() as profile:
+            testapp.get('/pages/1')
+        assert profile.count <= 5
+    """
+    profile = QueryProfile()
+    if not hasattr(_local, 'profiles'):
+        _local.profiles = []
+    _local.profiles.append(profile)
+    try:
+        yield profile
+    finally:
+        _local.profiles.remove(profile)
+
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """
+    Fails if more than max_queries statements are executed in the block.
+    The statements are listed in the failure, to find the one that is new.
+    """
+    with count_queries() as profile:
+        yield profile
+    if profile.count > max_queries:
+        raise AssertionError(
+            '%d queries executed, expected at most %d:\n%s' % (
+                profile.count, max_queries,
+                '\n'.join(
+                    '%d. %s' % (index, statement_shape(statement))
+                    for index, statement in enumerate(profile.statements, 1)
+                )
+            )
+        )
+
+
+class QueryProfiler(object):
+    """
+    Profiles a sample of the requests of an application. Configured with:
+
+    QUERY_PROFILER_SAMPLE_RATE
+        The fraction of the requests to profile, between 0 and 1.
+    QUERY_PROFILER_HEADERS
+        Add the query count and time (in ms) to the responses of the
+        profiled requests.
+    QUERY_PROFILER_REPEAT_THRESHOLD
+        Number of executions of a statement shape in a request from which
+        it is reported as a N+1 suspect.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_PROFILER_SAMPLE_RATE', 0.0)
+        app.config.setdefault('QUERY_PROFILER_HEADERS', False)
+        app.config.setdefault('QUERY_PROFILER_REPEAT_THRESHOLD', 3)
+        app.before_request(self.start_profile)
+        app.after_request(self.end_profile)
+
+    def start_profile(self):
+        rate = current_app.config['QUERY_PROFILER_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            g._query_profile = QueryProfile()
+
+    def end_profile(self, response):
+        profile = getattr(g, '_query_profile', None)
+        g._query_profile = None
+        if profile is None:
+            return response
+
+        config = current_app.config
+        if config['QUERY_PROFILER_HEADERS']:
+            response.headers['X-Query-Count'] = str(profile.count)
+            response.headers['X-Query-Time'] = '%.1f' % (
+                profile.duration * 1000
+            )
+
+        suspects = profile.repeated(config['QUERY_PROFILER_REPEAT_THRESHOLD'])
+        message = '%s %s %s: %d queries in %.1fms' % (
+            request.method, request.path, response.status_code,
+            profile.count, profile.duration * 1000,
+        )
+        if suspects:
+            current_app.logger.warning(
+                '%s, N+1 suspects:\n%s', message, '\n'.join(
+                    '  %dx %s' % (count, shape) for count, shape in suspects
+                )
+            )
+        else:
+            current_app.logger.info(message)
+        return response
+
+
+query_profiler = QueryProfiler()
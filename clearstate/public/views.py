@@ -7,19 +7,23 @@ from flask import (
 from flask.ext.login import login_user, login_required, logout_user
 
 from clearstate.extensions import login_manager
-from clearstate.user.models import User, users_exist
+from clearstate.user.models import User
+from clearstate.user.setup import setup_flag
 from clearstate.page.models import Page
+from clearstate.page.domains import domain_index
+from clearstate.page.views import render_status_page
+from clearstate.passwords import PasswordHasherBusy
 from clearstate.public.forms import LoginForm
 from clearstate.user.forms import RegisterForm
-from clearstate.utils import flash_errors
+from clearstate.utils import flash_errors, busy_response
 from clearstate.database import db
 
 blueprint = Blueprint('public', __name__, static_folder="../static")
 
 
 @login_manager.user_loader
-def load_user(id):
-    return User.get_by_id(int(id))
+def load_user(session_id):
+    return User.get_by_session_id(session_id)
 
 
 @blueprint.route("/", methods=["GET"])
@@ -28,10 +32,15 @@ def home():
     The home page by default is expected to serve the status page, identified
     from the host name.
     """
-    # TODO: Find status page from host name
+    page_id = domain_index.lookup(request.host)
+    if page_id is not None:
+        # The timezone of the page is picked from the view args when
+        # formatting dates
+        request.view_args['page_id'] = page_id
+        return render_status_page(page_id)
 
     # If there are no matches, are there any pages or users at all ?
-    if not users_exist():
+    if not setup_flag.is_done():
         return redirect(url_for('user.initial_setup'))
     else:
         return redirect(url_for('pages.pages'))
@@ -42,7 +51,13 @@ def login():
     form = LoginForm(request.form)
     # Handle logging in
     if request.method == 'POST':
-        if form.validate_on_submit():
+        try:
+            valid = form.validate_on_submit()
+        except PasswordHasherBusy:
+            return busy_response("public/login.html", form=form)
+        if valid:
+            # Save the password if it was hashed again with another cost
+            db.session.commit()
             login_user(form.user)
             flash("You are logged in.", 'success')
             redirect_url = request.args.get("next") or \
@@ -65,11 +80,14 @@ def logout():
 def register():
     form = RegisterForm(request.form, csrf_enabled=False)
     if form.validate_on_submit():
-        new_user = User.create(
-            email=form.email.data,
-            password=form.password.data,
-            active=True
-        )
+        try:
+            User.create(
+                email=form.email.data,
+                password=form.password.data,
+                active=True
+            )
+        except PasswordHasherBusy:
+            return busy_response('public/register.html', form=form)
         flash("Thank you for registering. You can now log in.", 'success')
         return redirect(url_for('public.home'))
     else:
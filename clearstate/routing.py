@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Routing of the reads of public views to a read replica, and the pool
+settings of every database.
+
+Views decorated with :func:`replica_reads` read from the database in
+SQLALCHEMY_REPLICA_URI, if one is configured. Flushes, and every other
+view, use the primary database, so a burst of public traffic does not take
+the connections that admins need to post updates.
+
+The pool of every bind is configured in SQLALCHEMY_POOLS, by bind name
+(``primary``, ``replica`` or a key of SQLALCHEMY_BINDS)::
+
+    SQLALCHEMY_POOLS = {
+        'primary': {'pool_size': 5, 'max_overflow': 5, 'pre_ping': True},
+        'replica': {'pool_size': 20, 'max_overflow': 30},
+    }
+
+``pre_ping`` tests connections as they are checked out of the pool and
+replaces those the database closed, for example after a failover.
+"""
+from functools import wraps
+
+import sqlalchemy
+from flask import g, has_app_context
+from flask.ext.sqlalchemy import SQLAlchemy, SignallingSession, \
+    _EngineConnector, _EngineDebuggingSignalEvents, _record_queries
+from sqlalchemy import event, exc
+from sqlalchemy.engine.url import make_url
+
+#: Name of the bind of the read replica
+REPLICA = 'replica'
+
+#: The options of SQLALCHEMY_POOLS passed on to create_engine
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle')
+#: The options that only apply to pools of connections to a server
+SERVER_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+def read_from_replica():
+    """
+    Read from the replica for the rest of the application context.
+    """
+    g._replica_reads = True
+
+
+def replica_reads(view):
+    """
+    Decorate a view that only reads, so that it reads from the replica.
+    """
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        previous = getattr(g, '_replica_reads', False)
+        read_from_replica()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g._replica_reads = previous
+    return decorated_view
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """
+    Test a connection checked out of the pool. The pool replaces the
+    connection and tries again when this raises DisconnectionError.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+class RoutingSession(SignallingSession):
+    """
+    A session that reads from the replica in views that only read.
+    """
+
+    def __init__(self, db, *args, **kwargs):
+        self.db = db
+        SignallingSession.__init__(self, db, *args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context() and \
+                getattr(g, '_replica_reads', False):
+            table = getattr(mapper, 'mapped_table', None)
+            if getattr(table, 'info', {}).get('bind_key') is None:
+                replica = self.db.get_replica_engine(self.app)
+                if replica is not None:
+                    return replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingEngineConnector(_EngineConnector):
+    """
+    Creates the engine of a bind with the pool settings of the bind.
+    """
+
+    def get_uri(self):
+        if self._bind == REPLICA:
+            return self._app.config['SQLALCHEMY_REPLICA_URI']
+        return _EngineConnector.get_uri(self)
+
+    def get_engine(self):
+        with self._lock:
+            uri = self.get_uri()
+            echo = self._app.config['SQLALCHEMY_ECHO']
+            if (uri, echo) == self._connected_for:
+                return self._engine
+            info = make_url(uri)
+            options = {'convert_unicode': True}
+            self._sa.apply_pool_defaults(self._app, options)
+            pool = (self._app.config.get('SQLALCHEMY_POOLS') or {}).get(
+                self._bind or 'primary', {}
+            )
+            for key in POOL_OPTIONS:
+                if pool.get(key) is not None and not (
+                        info.drivername == 'sqlite' and
+                        key in SERVER_POOL_OPTIONS):
+                    options[key] = pool[key]
+            self._sa.apply_driver_hacks(self._app, info, options)
+            if echo:
+                options['echo'] = True
+            self._engine = engine = sqlalchemy.create_engine(info, **options)
+            if pool.get('pre_ping'):
+                event.listen(engine, 'checkout', ping_connection)
+            if _record_queries(self._app):
+                _EngineDebuggingSignalEvents(
+                    engine, self._app.import_name
+                ).register()
+            self._connected_for = (uri, echo)
+            return engine
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with a read replica and per bind pool settings.
+    """
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def make_connector(self, app, bind=None):
+        return RoutingEngineConnector(self, app, bind)
+
+    def get_replica_engine(self, app=None):
+        """
+        Returns the engine of the read replica, or None if there is none.
+        """
+        app = self.get_app(app)
+        if not app.config.get('SQLALCHEMY_REPLICA_URI'):
+            return None
+        return self.get_engine(app, bind=REPLICA)
@@ -9,7 +9,20 @@ class Config(object):
     APP_DIR = os.path.abspath(os.path.dirname(__file__))
     PROJECT_ROOT = os.path.abspath(os.path.join(APP_DIR, os.pardir))
     BCRYPT_LOG_ROUNDS = 13
+    # Passwords are hashed by a few threads per process, so that a burst of
+    # logins does not take the CPU from the status pages. Logins beyond the
+    # queue size, or waiting longer than the timeout, are refused.
+    PASSWORD_HASH_WORKERS = 1
+    PASSWORD_HASH_QUEUE_SIZE = 10
+    PASSWORD_HASH_TIMEOUT = 10
     ASSETS_DEBUG = False
+    # Written by `python manage.py build_assets` at deploy time. Without it,
+    # the bundles are built on request.
+    STATIC_MANIFEST = os.path.join(
+        APP_DIR, 'static', 'public', 'manifest.json'
+    )
+    # Seconds for which browsers may cache the fingerprinted assets
+    STATIC_MAX_AGE = 365 * 24 * 60 * 60
 
     # Debug toolbar
     DEBUG_TB_ENABLED = False
@@ -17,6 +30,108 @@ class Config(object):
 
     CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
 
+    # Seconds for which a rendered public status page is cached. The cache
+    # is invalidated when the page changes and every day, but the uptime of
+    # the components on it also grows by the minute, so this bounds how
+    # stale the uptime is.
+    STATUS_PAGE_CACHE_TIMEOUT = 5 * 60
+
+    # Days of incidents shown on a status page
+    STATUS_PAGE_DAYS = 10
+
+    # Seconds for which the logged in users are cached. A user is dropped
+    # from the cache when changed, but a cache that is not shared between
+    # processes (like "simple") only drops it in the process that changed it.
+    # Unless the cache is shared, the password and active flag of a cached
+    # user are therefore read on every request, so that a password change
+    # or deactivation ends the sessions in every process. None to tell
+    # from CACHE_TYPE.
+    USER_CACHE_TIMEOUT = 5 * 60
+    USER_CACHE_SHARED = None
+
+    # Seconds after which a process that knows the initial setup is done
+    # checks again, in case all the users were deleted by another process
+    SETUP_STATE_RECHECK_INTERVAL = 10 * 60
+
+    # Seconds after which the index of status page domains is reloaded to
+    # pick up pages changed by other processes. Changes made by the process
+    # itself are picked up immediately. None to never reload.
+    PAGE_DOMAIN_INDEX_TTL = 60
+
+    # Live updates of status pages. Each process polls the version of a
+    # watched page every interval seconds, regardless of the viewer count.
+    LIVE_UPDATES_POLL_INTERVAL = 2
+    LIVE_UPDATES_KEEPALIVE = 15
+    LIVE_UPDATES_QUEUE_SIZE = 100
+    # Streams per process, each of which takes a worker thread. Keep it
+    # well below the threads of a worker (--threads in the Procfile). The
+    # viewers beyond it poll status.json every LIVE_UPDATES_FALLBACK_POLL
+    # seconds instead.
+    LIVE_UPDATES_MAX_STREAMS = 10
+    LIVE_UPDATES_FALLBACK_POLL = 60
+
+    # Fraction of the requests whose SQL statements are counted and timed.
+    # The profile is logged, with the statements repeated at least the
+    # threshold number of times in a request as N+1 suspects.
+    QUERY_PROFILER_SAMPLE_RATE = 0.01
+    QUERY_PROFILER_REPEAT_THRESHOLD = 3
+    # Add X-Query-Count and X-Query-Time headers to profiled responses
+    QUERY_PROFILER_HEADERS = False
+
+    # Notifications of subscribers, delivered by the notification worker
+    NOTIFICATION_SENDER = os_env.get(
+        'CLEARSTATE_NOTIFICATION_SENDER', 'status@localhost'
+    )
+    NOTIFICATION_SMTP_HOST = os_env.get('CLEARSTATE_SMTP_HOST', 'localhost')
+    NOTIFICATION_SMTP_PORT = int(os_env.get('CLEARSTATE_SMTP_PORT', 25))
+    NOTIFICATION_SMTP_USERNAME = os_env.get('CLEARSTATE_SMTP_USERNAME')
+    NOTIFICATION_SMTP_PASSWORD = os_env.get('CLEARSTATE_SMTP_PASSWORD')
+    NOTIFICATION_SMTP_USE_TLS = bool(os_env.get('CLEARSTATE_SMTP_USE_TLS'))
+    # Seconds a notification waits for newer updates of the same incident
+    # or component, which replace it
+    NOTIFICATION_COLLAPSE_DELAY = 60
+    # Number of notifications claimed at once, and of threads sending them
+    NOTIFICATION_BATCH_SIZE = 100
+    NOTIFICATION_WORKERS = 8
+    # Failed deliveries are retried after 30s, 1m, 2m, ... up to 6 hours
+    NOTIFICATION_RETRY_DELAY = 30
+    NOTIFICATION_MAX_RETRY_DELAY = 6 * 60 * 60
+    NOTIFICATION_MAX_ATTEMPTS = 10
+    # Socket timeout of a delivery, and seconds after which notifications
+    # claimed by a worker that did not finish can be claimed again
+    NOTIFICATION_TIMEOUT = 10
+    NOTIFICATION_CLAIM_TIMEOUT = 5 * 60
+    NOTIFICATION_POLL_INTERVAL = 5
+
+    # Alerts of monitoring systems. A component recovers only once it has
+    # been in its status for the delay, which damps flapping alerts.
+    ALERT_RECOVERY_DELAY = 5 * 60
+    ALERT_MAX_BATCH = 1000
+
+    # Optional read replica. The public status pages read from it, while
+    # writes and the admin views use SQLALCHEMY_DATABASE_URI.
+    SQLALCHEMY_REPLICA_URI = os_env.get('SQLALCHEMY_REPLICA_URI')
+
+    # Connection pool of every bind: 'primary', 'replica' or a key of
+    # SQLALCHEMY_BINDS. pre_ping tests connections before they are used, to
+    # replace those the database closed. Pool sizes are ignored by SQLite.
+    SQLALCHEMY_POOLS = {
+        'primary': {
+            'pool_size': int(os_env.get('DATABASE_POOL_SIZE', 5)),
+            'max_overflow': int(os_env.get('DATABASE_MAX_OVERFLOW', 10)),
+            'pool_recycle': 30 * 60,
+            'pre_ping': True,
+        },
+        'replica': {
+            'pool_size': int(os_env.get('DATABASE_REPLICA_POOL_SIZE', 10)),
+            'max_overflow': int(
+                os_env.get('DATABASE_REPLICA_MAX_OVERFLOW', 20)
+            ),
+            'pool_recycle': 30 * 60,
+            'pre_ping': True,
+        },
+    }
+
 
 class ProdConfig(Config):
     """Production configuration."""
@@ -46,6 +161,11 @@ class DevConfig(Config):
 
     # Don't bundle/minify static assets
     ASSETS_DEBUG = True
+    STATIC_MANIFEST = None
+
+    # Profile every request
+    QUERY_PROFILER_SAMPLE_RATE = 1
+    QUERY_PROFILER_HEADERS = True
 
     CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
 
@@ -56,3 +176,6 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
     BCRYPT_LOG_ROUNDS = 1  # For faster tests
     WTF_CSRF_ENABLED = False  # Allows form testing
+    STATIC_MANIFEST = None
+    QUERY_PROFILER_SAMPLE_RATE = 1
+    QUERY_PROFILER_HEADERS = True
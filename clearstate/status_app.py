@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+The status app, which only serves the public status pages.
+
+Pods that serve the status pages do not need the admin views, forms,
+password hashing, migrations, debug toolbar or gravatars, and the status
+app does not import them, so it starts quickly and takes little memory.
+It registers:
+
+* The status pages, status.json, incidents and live events, with the same
+  endpoints as in the full app (see clearstate/page/status.py).
+* The root of the site, for status pages served on their own domain.
+* The static files.
+
+Serve it with gunicorn, loading the app before forking the workers so
+that they share its memory::
+
+    gunicorn clearstate.status_wsgi:app -c clearstate/status_gunicorn.py
+"""
+import os
+import resource
+import sys
+import time
+
+from flask import Flask, Blueprint, request, abort, render_template
+
+from clearstate.settings import ProdConfig
+from clearstate.extensions import cache, db, babel
+from clearstate.manifest import asset_manifest
+from clearstate.profiling import query_profiler
+from clearstate.page.domains import domain_index
+from clearstate.page.status import register_status_views, \
+    get_timezone_from_page, render_status_page
+
+#: Templates compiled on startup, before the workers are forked
+TEMPLATES = [
+    'pages/public-page.html',
+    'pages/public-incident.html',
+    '404.html',
+    '500.html',
+]
+
+
+def memory_usage():
+    """
+    Returns the resident memory of the process in megabytes, or the peak
+    resident memory where it is not known.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024.0 / 1024
+    except (IOError, IndexError, ValueError):
+        # Kilobytes on Linux, bytes on OS X
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage / (1024.0 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def report_startup(app, started):
+    app.logger.info(
+        'Status app of process %d started in %.2fs, %d modules loaded, '
+        '%.1f MB resident', os.getpid(), time.time() - started,
+        len(sys.modules), memory_usage()
+    )
+
+
+def home():
+    """
+    Serve the status page of the domain of the request.
+    """
+    page_id = domain_index.lookup(request.host)
+    if page_id is None:
+        abort(404)
+    # The timezone of the page is picked from the view args when formatting
+    # dates
+    request.view_args['page_id'] = page_id
+    return render_status_page(page_id)
+
+
+def create_status_app(config_object=ProdConfig, started=None):
+    """
+    Create the status app.
+
+    :param config_object: The configuration object to use.
+    :param started: When the process started, to report the startup time
+                    since then.
+    """
+    started = started or time.time()
+    app = Flask('clearstate')
+    app.config.from_object(config_object)
+
+    cache.init_app(app)
+    db.init_app(app)
+    asset_manifest.init_app(app)
+    query_profiler.init_app(app)
+    babel.init_app(app)
+    babel.timezoneselector(get_timezone_from_page)
+
+    blueprint = Blueprint('pages', __name__, url_prefix='/pages')
+    register_status_views(blueprint)
+    app.register_blueprint(blueprint)
+    # The same endpoint as the home page of the full app, which the
+    # templates link to
+    public = Blueprint('public', __name__)
+    public.add_url_rule('/', 'home', home)
+    app.register_blueprint(public)
+
+    def render_error(error):
+        error_code = getattr(error, 'code', 500)
+        return render_template("{0}.html".format(error_code)), error_code
+    for errcode in [404, 500]:
+        app.errorhandler(errcode)(render_error)
+
+    # Compile the templates once, in the process that forks the workers
+    for template in TEMPLATES:
+        app.jinja_env.get_template(template)
+
+    report_startup(app, started)
+    return app
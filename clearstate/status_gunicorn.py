@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn settings of the status app::
+
+    gunicorn clearstate.status_wsgi:app -c clearstate/status_gunicorn.py
+
+The app is loaded once, before the workers are forked, so the workers
+start at once and share the memory of the modules and compiled templates
+until they write to it.
+"""
+import gc
+import os
+
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 3))
+threads = int(os.environ.get('STATUS_THREADS', 25))
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+
+
+def when_ready(server):
+    # Leave no garbage for every worker to collect, and write to, on its own
+    gc.collect()
+
+
+def post_fork(server, worker):
+    from clearstate.database import db
+    from clearstate.status_wsgi import app
+
+    # Connections opened before the fork must not be shared by the workers
+    with app.app_context():
+        db.engine.dispose()
+        replica = db.get_replica_engine()
+        if replica is not None:
+            replica.dispose()
+
+
+def post_worker_init(worker):
+    from clearstate.status_app import memory_usage
+
+    worker.log.info(
+        'Worker %d ready, %.1f MB resident', worker.pid, memory_usage()
+    )
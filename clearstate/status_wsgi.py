@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+The WSGI entry point of the status app (see status_app.py).
+"""
+import os
+import time
+
+started = time.time()
+
+from clearstate.status_app import create_status_app  # noqa
+from clearstate.settings import DevConfig, ProdConfig  # noqa
+
+if os.environ.get("CLEARSTATE_ENV") == 'prod':
+    app = create_status_app(ProdConfig, started=started)
+else:
+    app = create_status_app(DevConfig, started=started)
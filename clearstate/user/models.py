@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 import datetime as dt
+import hashlib
 
+from flask import current_app
 from flask.ext.login import UserMixin
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload, object_session
 
-from clearstate.extensions import bcrypt
+from clearstate.extensions import cache
+from clearstate.passwords import password_hasher, PasswordHasherBusy
 from clearstate.database import (
     Column,
     db,
@@ -49,15 +54,153 @@ class User(UserMixin, SurrogatePK, Model):
             self.password = None
 
     def set_password(self, password):
-        self.password = bcrypt.generate_password_hash(password)
+        self.password = password_hasher.hash(password)
 
     def check_password(self, value):
-        return bcrypt.check_password_hash(self.password, value)
+        """
+        Check the password of the user. A password hashed with another cost
+        than BCRYPT_LOG_ROUNDS is hashed again with the configured cost, to
+        be saved with the user.
+
+        Raises PasswordHasherBusy if too many passwords are being checked.
+        """
+        if not password_hasher.check(self.password, value):
+            return False
+        if password_hasher.needs_rehash(self.password):
+            try:
+                self.set_password(value)
+            except PasswordHasherBusy:
+                # Rehashed on a later login instead
+                pass
+        return True
+
+    @property
+    def credential_stamp(self):
+        """
+        Changes when the password of the user changes or the user is
+        deactivated, which ends the sessions of the user.
+        """
+        return make_credential_stamp(self.password, self.active)
+
+    def get_id(self):
+        """
+        The id stored in the session by Flask-Login, made of the id of the
+        user and the credential stamp.
+        """
+        return u'%d:%s' % (self.id, self.credential_stamp)
+
+    @classmethod
+    def get_by_session_id(cls, session_id):
+        """
+        Returns the user with the session id returned by :meth:`get_id`,
+        or None if there is no such user or the credentials changed since.
+
+        Users are cached for USER_CACHE_TIMEOUT seconds, with their roles.
+        The cached user is dropped when the user or the roles change.
+        """
+        id, _, stamp = session_id.partition(':')
+        if not id.isdigit():
+            return None
+        user = cache.get(user_cache_key(id))
+        if user is not None and not user_cache_shared():
+            # Another process may have changed the credentials, and only
+            # dropped the user from its own cache
+            current = db.session.query(cls.password, cls.active).filter(
+                cls.id == int(id)
+            ).first()
+            if current is None or \
+                    make_credential_stamp(*current) != user.credential_stamp:
+                user = None
+        if user is not None and user.credential_stamp == stamp:
+            # Cached users are detached copies
+            return db.session.merge(user, load=False)
+
+        # Not cached, or cached by a process before a change made by another
+        # one. Not get(), which skips the eager load of a user in the session.
+        user = cls.query.options(joinedload('roles')).filter(
+            cls.id == int(id)
+        ).first()
+        if user is None:
+            return None
+        cache.set(
+            user_cache_key(id), user,
+            timeout=current_app.config['USER_CACHE_TIMEOUT']
+        )
+        if user.credential_stamp != stamp:
+            return None
+        return user
 
     def __repr__(self):
         return '<User({email!r})>'.format(email=self.email)
 
 
+def make_credential_stamp(password, active):
+    return hashlib.sha1(
+        '%s:%s' % (password or '', bool(active))
+    ).hexdigest()[:16]
+
+
+def user_cache_key(id):
+    return 'user/%s' % id
+
+
+def user_cache_shared():
+    """
+    Returns True if the users are cached in a cache every process sees.
+    """
+    shared = current_app.config.get('USER_CACHE_SHARED')
+    if shared is None:
+        return current_app.config['CACHE_TYPE'] not in ('simple', 'null')
+    return shared
+
+
+def invalidate_user_later(target, user_id):
+    """
+    Drop the cached user once the transaction that changes it commits, so
+    that it is not cached again with what is about to change.
+    """
+    session = object_session(target)
+    if user_id is not None and session is not None:
+        session.info.setdefault('stale_users', set()).add(user_id)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_user(mapper, connection, target):
+    invalidate_user_later(target, target.id)
+
+
+@event.listens_for(Role, 'after_insert')
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def invalidate_user_of_role(mapper, connection, target):
+    history = inspect(target).attrs.user_id.history
+    for user_id in set(history.sum()) | set([target.user_id]):
+        invalidate_user_later(target, user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def drop_stale_users(session):
+    for user_id in session.info.pop('stale_users', ()):
+        cache.delete(user_cache_key(user_id))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_stale_users(session):
+    session.info.pop('stale_users', None)
+
+
+class SetupState(Model):
+    """
+    Has a single row once the initial setup is done, which is when the
+    first user is created. It is removed when the last user is deleted.
+    """
+    __tablename__ = 'setup_state'
+
+    id = Column(db.Integer, primary_key=True)
+    done_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+
 def users_exist():
     """
     Returns True if atleast one user exists in the database
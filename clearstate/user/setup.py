@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Whether the initial setup of the app is done.
+
+Every request to the root of a status domain needs to know, so the state
+is recorded in the setup_state table when the first user is created, and
+kept in process memory once read. A process that knows the setup is done
+only reads the table again every SETUP_STATE_RECHECK_INTERVAL seconds, to
+notice that all the users were deleted by another process.
+"""
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from clearstate.database import db
+from clearstate.user.models import User, SetupState, users_exist
+
+
+class SetupFlag(object):
+    """
+    The in-process copy of the setup state.
+    """
+
+    def __init__(self):
+        self._done = None
+        self._loaded_at = None
+
+    def load(self):
+        done = db.session.query(SetupState.id).first() is not None
+        if not done and users_exist():
+            # Set up before the state was recorded. Recorded in a
+            # transaction of its own, not to commit the session of the
+            # request.
+            try:
+                with db.engine.begin() as connection:
+                    insert_setup_state(connection)
+            except IntegrityError:
+                # Recorded by another process in the meantime
+                pass
+            done = True
+        self._done = done
+        self._loaded_at = time.time()
+
+    def invalidate(self):
+        """
+        Mark the state as stale. It is read again on the next check.
+        """
+        self._done = None
+
+    @property
+    def stale(self):
+        if not self._done:
+            # Until the setup is done, read the state every time
+            return True
+        interval = current_app.config['SETUP_STATE_RECHECK_INTERVAL']
+        return time.time() - self._loaded_at > interval
+
+    def is_done(self):
+        if self.stale:
+            self.load()
+        return self._done
+
+
+setup_flag = SetupFlag()
+
+
+def insert_setup_state(connection):
+    """
+    Record that the setup is done, unless it is recorded already.
+    """
+    setup = SetupState.__table__
+    connection.execute(
+        setup.insert().from_select(
+            ['id', 'done_at'],
+            db.select([db.literal(1), db.literal(datetime.utcnow())]).where(
+                ~db.exists().where(setup.c.id == 1)
+            )
+        )
+    )
+
+
+@event.listens_for(User, 'after_insert')
+def record_setup(mapper, connection, target):
+    insert_setup_state(connection)
+    setup_flag.invalidate()
+
+
+@event.listens_for(User, 'after_delete')
+def reset_setup(mapper, connection, target):
+    users = User.__table__
+    if connection.execute(
+            db.select([db.func.count()]).select_from(users)).scalar() == 0:
+        connection.execute(SetupState.__table__.delete())
+        setup_flag.invalidate()
+
+
+@event.listens_for(db.metadata, 'after_create')
+@event.listens_for(db.metadata, 'after_drop')
+def invalidate_setup_flag(target, connection, **kwargs):
+    setup_flag.invalidate()
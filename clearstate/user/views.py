@@ -3,9 +3,11 @@ from flask import Blueprint, render_template, redirect, url_for, current_app, \
      request, flash
 from flask.ext.login import login_required, login_user
 
+from clearstate.passwords import PasswordHasherBusy
 from clearstate.user.forms import RegisterForm
-from clearstate.user.models import User, users_exist
-from clearstate.utils import flash_errors
+from clearstate.user.models import User
+from clearstate.user.setup import setup_flag
+from clearstate.utils import flash_errors, busy_response
 
 blueprint = Blueprint(
     "user", __name__, url_prefix='/users', static_folder="../static"
@@ -24,7 +26,7 @@ def check_if_setup_done():
     """
     if request.path == url_for('user.initial_setup'):
         return
-    if not users_exist():
+    if not setup_flag.is_done():
         return redirect(url_for('user.initial_setup'))
 
 
@@ -37,7 +39,7 @@ def initial_setup():
     Seems like a fairly good way to determine if the app is being run for the
     first time.
     """
-    if users_exist():
+    if setup_flag.is_done():
         # Do not allow initial_setup to happen when users already exist
         # in the database.
         current_app.logger.info('Cannot run initial-setup when users exist.')
@@ -45,12 +47,15 @@ def initial_setup():
 
     form = RegisterForm(request.form)
     if form.validate_on_submit():
-        new_user = User.create(
-            full_name=form.full_name.data,
-            email=form.email.data,
-            password=form.password.data,
-            active=True
-        )
+        try:
+            new_user = User.create(
+                full_name=form.full_name.data,
+                email=form.email.data,
+                password=form.password.data,
+                active=True
+            )
+        except PasswordHasherBusy:
+            return busy_response('users/initial-setup.html', form=form)
         login_user(new_user)
         return redirect(url_for('pages.pages'))
     else:
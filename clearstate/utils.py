@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 '''Helper utilities and decorators.'''
-from flask import flash
+from flask import flash, make_response, render_template
 
 def flash_errors(form, category="warning"):
     '''Flash all errors for a form.'''
@@ -8,3 +8,15 @@ def flash_errors(form, category="warning"):
         for error in errors:
             flash("{0} - {1}"
                     .format(getattr(form, field).label.text, error), category)
+
+
+def busy_response(template, **context):
+    '''Render the form again with a 503, when too many passwords are being
+    hashed (see clearstate.passwords).'''
+    flash(
+        'Too many people are logging in right now. '
+        'Please try again in a moment.', 'warning'
+    )
+    response = make_response(render_template(template, **context), 503)
+    response.headers['Retry-After'] = '5'
+    return response
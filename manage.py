@@ -1,12 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import sys
 from flask.ext.script import Manager, Shell, Server
 from flask.ext.migrate import MigrateCommand
 
 from clearstate.app import create_app
+from clearstate.assets import build_assets as write_assets
 from clearstate.user.models import User
-from clearstate.settings import DevConfig, ProdConfig
+from clearstate.page.models import Page, Incident
+from clearstate.page.export import StaticExport
+from clearstate.page import search
+from clearstate.page.notifications import NotificationWorker
+from clearstate.page.transfer import export_page as write_page, PageImport
+from clearstate.settings import Config, DevConfig, ProdConfig
 from clearstate.database import db
 
 if os.environ.get("CLEARSTATE_ENV") == 'prod':
@@ -43,6 +50,104 @@ def init_db():
     db.create_all()
 
 
+@manager.command
+def backfill_incidents():
+    """Recompute the most recent update state stored on every incident"""
+    for incident in Incident.query.all():
+        incident.refresh_last_update()
+    db.session.commit()
+
+
+@manager.command
+def reconcile_counts():
+    """Recount the components and incidents of every page"""
+    Page.reconcile_counts()
+    db.session.commit()
+
+
+@manager.command
+def rebuild_search_index():
+    """Index all the incidents for the full text search"""
+    search.rebuild_search_index()
+    db.session.commit()
+
+
+@manager.command
+def build_assets():
+    """Build the fingerprinted and compressed static assets for deployment"""
+    manifest = write_assets(
+        app, app.config['STATIC_MANIFEST'] or Config.STATIC_MANIFEST
+    )
+    for name, path in sorted(manifest.items()):
+        print('%s: %s' % (name, path))
+
+
+@manager.option(
+    '-o', '--output', dest='output', default=os.path.join(HERE, 'export'),
+    help='Directory to export the pages to'
+)
+@manager.option(
+    '--full', dest='full', action='store_true', default=False,
+    help='Render every file even if it did not change'
+)
+def export_static(output, full):
+    """Export the status pages as static files"""
+    written, skipped, removed = StaticExport(app, output).run(full=full)
+    print('%d files written, %d unchanged, %d removed' % (
+        written, skipped, removed
+    ))
+
+
+@manager.option('page_id', type=int, help='ID of the page to export')
+@manager.option(
+    '-o', '--output', dest='output', default='-',
+    help='File to write the JSON lines to, - for the standard output'
+)
+def export_page(page_id, output):
+    """Export a page, its components and incidents as JSON lines"""
+    if Page.get_by_id(page_id) is None:
+        sys.exit('No page with the ID %s' % page_id)
+    if output == '-':
+        count = write_page(page_id, sys.stdout)
+    else:
+        with open(output, 'w') as f:
+            count = write_page(page_id, f)
+    sys.stderr.write('%d records exported\n' % count)
+
+
+@manager.option('input', help='File to read the JSON lines from, - for the '
+                'standard input')
+@manager.option('--name', dest='name', help='Name of the new page')
+@manager.option('--site-url', dest='site_url', help='Site URL of the new page')
+def import_page(input, name, site_url):
+    """Import a page exported with export_page as a new page"""
+    importer = PageImport(name=name, site_url=site_url)
+    if input == '-':
+        page = importer.run(sys.stdin)
+    else:
+        with open(input) as f:
+            page = importer.run(f)
+    print('Imported as page %d' % page.id)
+
+
+@manager.option(
+    '-c', '--concurrency', dest='concurrency', type=int, default=None,
+    help='Number of threads delivering notifications'
+)
+@manager.option(
+    '--once', dest='once', action='store_true', default=False,
+    help='Deliver the notifications that are due and exit'
+)
+def notification_worker(concurrency, once):
+    """Deliver the notifications of subscribers"""
+    worker = NotificationWorker(app, concurrency)
+    if once:
+        while worker.run_once():
+            pass
+    else:
+        worker.run()
+
+
 manager.add_command('server', Server())
 manager.add_command('shell', Shell(make_context=_make_context))
 manager.add_command('db', MigrateCommand)
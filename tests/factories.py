@@ -4,7 +4,8 @@ from factory import Sequence, PostGenerationMethodCall
 from factory.alchemy import SQLAlchemyModelFactory
 
 from clearstate.user.models import User
-from clearstate.page.models import Page, Incident
+from clearstate.page.models import Page, Component, Incident, \
+    IncidentUpdate
 from clearstate.database import db
 
 
@@ -44,3 +45,23 @@ class IncidentFactory(BaseFactory):
 
     class Meta:
         model = Incident
+
+
+class ComponentFactory(BaseFactory):
+
+    name = Sequence(lambda n: "Component {0}".format(n))
+    description = 'Some random component'
+    page = SubFactory(PageFactory)
+
+    class Meta:
+        model = Component
+
+
+class IncidentUpdateFactory(BaseFactory):
+
+    status = 'Investigating'
+    message = Sequence(lambda n: "Update {0}".format(n))
+    incident = SubFactory(IncidentFactory)
+
+    class Meta:
+        model = IncidentUpdate
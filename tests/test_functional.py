@@ -3,12 +3,59 @@
 
 See: http://webtest.readthedocs.org/
 """
+import asyncore
+import datetime as dt
+import email
+import email.header
+import email.utils
+import gzip
+import httplib
+import json
+import re
+import smtpd
+import smtplib
+import socket
+import subprocess
+import sys
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from Queue import Queue
+from io import BytesIO
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
 import pytest
 from flask import url_for
+from flask.ext.assets import Bundle
+import webtest
 
 
+from clearstate.app import create_app
+from clearstate.assets import build_assets
+from clearstate.manifest import asset_manifest, asset_urls
+from clearstate.settings import TestConfig
 from clearstate.user.models import User
-from clearstate.page.models import Page
+from clearstate.page.models import Page, Component, Incident, \
+    IncidentUpdate, Subscriber, Notification
+from clearstate.database import db
+from clearstate.page import export as export_module
+from clearstate.page.export import StaticExport
+from clearstate.page import status as status_module
+from clearstate.page.notifications import NotificationWorker
+from clearstate.profiling import assert_max_queries, count_queries
+from clearstate.status_app import create_status_app
+from clearstate.passwords import password_hasher, PasswordHasherBusy
+from .factories import IncidentFactory, PageFactory, UserFactory
+
+
+class Tomorrow(dt.datetime):
+    """
+    The datetime of the next (UTC) day
+    """
+
+    @classmethod
+    def utcnow(cls):
+        return dt.datetime.utcnow() + dt.timedelta(days=1)
 
 
 class TestLoggingIn:
@@ -60,6 +107,17 @@ class TestLoggingIn:
         # sees error
         assert "Unknown user" in res
 
+    def test_refused_when_busy(self, user, testapp, monkeypatch):
+        def busy(pw_hash, password):
+            raise PasswordHasherBusy()
+        monkeypatch.setattr(password_hasher, 'check', busy)
+        res = testapp.post('/login', {
+            'email': user.email,
+            'password': 'myprecious',
+        }, status=503)
+        assert res.headers['Retry-After'] == '5'
+        assert 'Too many people are logging in' in res
+
 
 class TestRegistering:
 
@@ -91,6 +149,19 @@ class TestRegistering:
         # sees error message
         assert "Passwords must match" in res
 
+    def test_refused_when_busy(self, db, testapp, monkeypatch):
+        def busy(password):
+            raise PasswordHasherBusy()
+        monkeypatch.setattr(password_hasher, 'hash', busy)
+        form = {
+            'full_name': 'Ops', 'email': 'foo@bar.com',
+            'password': 'secret', 'confirm': 'secret',
+        }
+        for url in ['/register/', '/users/initial-setup']:
+            res = testapp.post(url, form, status=503)
+            assert res.headers['Retry-After'] == '5'
+        assert User.query.count() == 0
+
 
 class TestPage:
 
@@ -120,6 +191,97 @@ class TestPage:
 
         assert Page.query.count() == 0
 
+    def test_public_page(self, page, testapp):
+        incident = IncidentFactory(page=page, title='Database unreachable')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+
+        res = testapp.get('/pages/%d' % page.id)
+        assert res.status_code == 200
+        assert 'Database unreachable' in res
+
+        Component.create(name='Public API', page_id=page.id)
+        res = testapp.get('/pages/%d' % page.id)
+        assert 'Public API' in res
+        assert 'uptime-day' in res
+
+        # Paginating to a date before the incident hides it
+        res = testapp.get('/pages/%d?date=2000-01-01' % page.id)
+        assert 'Database unreachable' not in res
+
+    def test_public_page_from_host_name(self, page, testapp):
+        incident = IncidentFactory(page=page, title='Database unreachable')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+
+        res = testapp.get('/', extra_environ={'HTTP_HOST': str(page.site_url)})
+        assert res.status_code == 200
+        assert 'Database unreachable' in res
+
+        # The index is updated when the domain of the page changes
+        page.site_url = 'status.example.com'
+        page.save()
+        res = testapp.get('/', extra_environ={'HTTP_HOST': 'demo.clearstate.io'})
+        assert res.status_code == 302
+        res = testapp.get(
+            '/', extra_environ={'HTTP_HOST': 'status.example.com:80'}
+        )
+        assert 'Database unreachable' in res
+
+    def test_status_json(self, page, testapp):
+        component = Component.create(name='API', page_id=page.id)
+        incident = IncidentFactory(page=page, title='Database unreachable')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+
+        url = '/pages/%d/status.json' % page.id
+        res = testapp.get(url)
+        assert res.json['status'] == 'Operational'
+        assert res.json['groups'][0]['components'][0]['name'] == 'API'
+        assert res.json['incidents'][0]['title'] == 'Database unreachable'
+        etag = res.headers['ETag']
+        assert res.headers['Last-Modified']
+
+        # Unchanged pages are not sent again
+        res = testapp.get(url, headers={'If-None-Match': etag}, status=304)
+        assert res.headers['ETag'] == etag
+
+        component.status = 'Major Outage'
+        component.save()
+        res = testapp.get(url, headers={'If-None-Match': etag})
+        assert res.status_code == 200
+        assert res.headers['ETag'] != etag
+        assert res.json['status'] == 'Major Outage'
+
+    def test_public_page_cache(self, page, testapp, monkeypatch):
+        res = testapp.get('/pages/%d' % page.id)
+        assert 'Database unreachable' not in res
+
+        incident = IncidentFactory(page=page, title='Database unreachable')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+
+        # The cached rendering is dropped once the incident is posted
+        res = testapp.get('/pages/%d' % page.id)
+        assert 'Database unreachable' in res
+
+        # ...and is served from the cache until the page changes again
+        Incident.query.filter_by(id=incident.id).update(
+            {'title': 'Changed behind our back'}
+        )
+        db.session.commit()
+        res = testapp.get('/pages/%d' % page.id)
+        assert 'Database unreachable' in res
+
+        # ...or the uptime on it moves on to the next day
+        monkeypatch.setattr(status_module, 'datetime', Tomorrow)
+        res = testapp.get('/pages/%d' % page.id)
+        assert 'Changed behind our back' in res
+
 
 class TestIncident:
 
@@ -168,3 +330,750 @@ class TestIncident:
         assert incident.title == 'Build processing delayed'
         assert incident.message == 'The deploy has been reverted.'
         assert incident.status == 'Fixed'
+
+
+class TestIncidents:
+
+    def test_keyset_pagination(self, user, page, testapp):
+        testapp.post(
+            '/login',
+            {
+                'email': user.email,
+                'password': 'myprecious',
+            }
+        )
+        # Some incidents share the creation time, the id breaks the tie
+        for index in range(12):
+            IncidentFactory(
+                page=page, title='Incident #%02d' % index,
+                create_time=dt.datetime(2015, 3, 1 + index // 2),
+            )
+        db.session.commit()
+
+        def titles(res):
+            return sorted(
+                int(title) for title in re.findall(r'Incident #(\d+)', res.text)
+            )
+
+        url = '/pages/%d/incidents' % page.id
+        res = testapp.get(url)
+        assert titles(res) == [7, 8, 9, 10, 11]
+        assert 'Newer' not in res
+        assert 'About 12 incidents' in res
+
+        res = res.click('Older')
+        assert titles(res) == [2, 3, 4, 5, 6]
+        # Only counted on the first page
+        assert 'About 12 incidents' not in res
+        res = res.click('Older')
+        assert titles(res) == [0, 1]
+        assert 'Older' not in res
+
+        res = res.click('Newer')
+        assert titles(res) == [2, 3, 4, 5, 6]
+        res = res.click('Newer')
+        assert titles(res) == [7, 8, 9, 10, 11]
+        assert 'Newer' not in res
+
+        testapp.get(url, {'after': 'garbage'}, status=400)
+        testapp.get(url, {'after': '[1,2]'}, status=400)
+        testapp.get(url, {'before': '["20150301000000000000","x"]'},
+                    status=400)
+
+
+    def test_search(self, user, page, testapp):
+        testapp.post(
+            '/login',
+            {
+                'email': user.email,
+                'password': 'myprecious',
+            }
+        )
+        for index in range(12):
+            IncidentFactory(page=page, title='Database failover #%d' % index)
+        IncidentFactory(page=page, title='DNS outage')
+        db.session.commit()
+
+        res = testapp.get('/pages/%d/incidents' % page.id)
+        form = res.forms['search-incidents-form']
+        form['q'] = 'database'
+        res = form.submit()
+        assert '12 incidents' in res
+        assert 'DNS outage' not in res
+        assert res.text.count('Database failover') == 10
+
+        res = res.click('More matches')
+        assert res.text.count('Database failover') == 2
+
+        # Pages before the first are the first
+        res = testapp.get(
+            '/pages/%d/incidents/search' % page.id, {'q': 'database', 'p': -3}
+        )
+        assert res.text.count('Database failover') == 10
+
+
+class TestComponent:
+
+    def test_update_statuses(self, user, page, testapp):
+        testapp.post(
+            '/login',
+            {
+                'email': user.email,
+                'password': 'myprecious',
+            }
+        )
+        api = Component.create(name='API', page_id=page.id)
+        web = Component.create(name='Web', page_id=page.id)
+        other_page = PageFactory(site_url='other.clearstate.io')
+        other = Component.create(name='Other', page=other_page)
+
+        url = '/pages/%d/components/update-statuses' % page.id
+        res = testapp.post_json(url, {
+            'components': {
+                str(api.id): 'Major Outage',
+                str(web.id): 'Partial Outage',
+            }
+        })
+        assert res.json['components'][str(api.id)]['status'] == 'Major Outage'
+        assert res.json['components'][str(web.id)]['status'] == \
+            'Partial Outage'
+        assert Component.get_by_id(api.id).status == 'Major Outage'
+
+        # Components of another page are refused along with the whole batch
+        res = testapp.post_json(url, {
+            'components': {
+                str(api.id): 'Operational',
+                str(other.id): 'Major Outage',
+            }
+        }, status=400)
+        assert Component.get_by_id(api.id).status == 'Major Outage'
+        assert Component.get_by_id(other.id).status == 'Operational'
+
+        # So are unknown statuses
+        testapp.post_json(url, {
+            'components': {str(api.id): 'On fire'}
+        }, status=400)
+        # And bodies of another shape
+        testapp.post_json(url, [str(api.id), 'Operational'], status=400)
+        testapp.post_json(url, {
+            'components': {str(api.id): []}
+        }, status=400)
+        assert Component.get_by_id(api.id).status == 'Major Outage'
+
+
+class TestStaticExport:
+
+    def test_incremental_export(self, app, page, tmpdir):
+        incident = IncidentFactory(page=page, title='Database unreachable')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+        output = str(tmpdir)
+        export = StaticExport(app, output)
+
+        # index, status.json, one history page and the incident
+        assert export.run() == (4, 0, 0)
+        site = tmpdir.join('demo.clearstate.io')
+        assert 'Database unreachable' in site.join('index.html').read()
+        assert 'Looking' in site.join('incidents', '%d.html' % incident.id).read()
+        assert 'Database unreachable' in \
+            site.join('history').listdir()[0].read()
+
+        # Nothing changed
+        assert export.run() == (0, 4, 0)
+
+        # An update changes everything but the old history pages
+        IncidentUpdate(
+            incident=incident, status='Fixed', message='Back up'
+        ).save()
+        assert export.run() == (4, 0, 0)
+
+        for update in incident.updates:
+            update.delete(commit=False)
+        incident.delete()
+        assert export.run() == (2, 0, 2)
+
+    def test_uptime_is_exported_daily(self, app, page, tmpdir, monkeypatch):
+        incident = IncidentFactory(page=page, title='Database unreachable')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+        export = StaticExport(app, str(tmpdir))
+        assert export.run() == (4, 0, 0)
+
+        # The pages that show the uptime are rendered again the next day
+        monkeypatch.setattr(export_module, 'datetime', Tomorrow)
+        assert export.run() == (2, 2, 0)
+
+    def test_assets_and_failures(self, app, page, tmpdir, monkeypatch):
+        static = tmpdir.mkdir('static')
+        css = static.mkdir('public').mkdir('css')
+        css.join('common.0123456789ab.css').write(
+            "@font-face{src:url('../fonts/icons.woff?v=4') format('woff')}"
+        )
+        static.join('public').mkdir('fonts').join('icons.woff').write('woff')
+        app.static_folder = str(static)
+        app.extensions['asset_manifest'] = {
+            'css_all': 'public/css/common.0123456789ab.css',
+            'js_all': 'public/js/common.0123456789ab.js',
+        }
+        incident = IncidentFactory(page=page, title='Database unreachable')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+        output = tmpdir.mkdir('export')
+        export = StaticExport(app, str(output), days=3)
+
+        assert export.run() == (4, 0, 0)
+        site = output.join('demo.clearstate.io')
+        assert site.join(
+            'static', 'public', 'css', 'common.0123456789ab.css'
+        ).check()
+        assert site.join('static', 'public', 'fonts', 'icons.woff').read() \
+            == 'woff'
+        # The windows of the history pages are as long as the page shows
+        end_date, = [
+            dt.datetime.strptime(name.purebasename, '%Y-%m-%d').date()
+            for name in site.join('history').listdir()
+        ]
+        assert (end_date - dt.date(1970, 1, 1)).days % 3 == 2
+
+        # A page that fails to render is kept, and rendered by the next run
+        incident.title = 'Database slow'
+        incident.save()
+        monkeypatch.setattr(
+            Incident, 'get_by_id', classmethod(lambda cls, id: None)
+        )
+        export.run()
+        incident_file = site.join('incidents', '%d.html' % incident.id)
+        assert 'Database unreachable' in incident_file.read()
+        monkeypatch.undo()
+        export.run()
+        assert 'Database slow' in incident_file.read()
+
+
+class TestQueryBudget:
+    """
+    The number of statements executed by the main views must not grow with
+    the number of components and incidents on a page.
+    """
+
+    def populate(self, page, count):
+        for index in range(count):
+            Component.create(name='Component %d' % index, page_id=page.id)
+            incident = IncidentFactory(page=page)
+            IncidentUpdate(
+                incident=incident, status='Investigating', message='Looking'
+            ).save()
+
+    @pytest.mark.parametrize('url, max_queries', [
+        ('/pages/%d', 6),
+        ('/pages/%d/status.json', 6),
+        ('/pages/%d/dashboard', 5),
+        ('/pages/%d/incidents', 5),
+    ])
+    def test_views(self, user, page, testapp, url, max_queries):
+        testapp.post(
+            '/login',
+            {
+                'email': user.email,
+                'password': 'myprecious',
+            }
+        )
+        self.populate(page, 6)
+        db.session.expire_all()
+
+        with assert_max_queries(max_queries):
+            res = testapp.get(url % page.id)
+        assert res.status_code == 200
+
+    def test_headers(self, page, testapp):
+        res = testapp.get('/pages/%d/status.json' % page.id)
+        assert int(res.headers['X-Query-Count']) > 0
+        assert float(res.headers['X-Query-Time']) >= 0
+
+
+class SMTPSink(smtpd.SMTPServer):
+    """
+    A local SMTP server that keeps the messages it receives
+    """
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((rcpttos, data))
+
+
+@pytest.yield_fixture
+def smtp_sink():
+    sink = SMTPSink()
+    thread = threading.Thread(
+        target=asyncore.loop, kwargs={'timeout': 0.05, 'map': None}
+    )
+    thread.daemon = True
+    thread.start()
+    yield sink
+    sink.close()
+    thread.join()
+
+
+@pytest.yield_fixture
+def http_receiver():
+    """
+    A local HTTP server that keeps the JSON bodies posted to it and
+    responds with the status in its `status` attribute.
+    """
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            length = int(self.headers['Content-Length'])
+            server.requests.append(
+                (self.path, json.loads(self.rfile.read(length)))
+            )
+            self.send_response(server.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def decode_header(value):
+    return u''.join(
+        part.decode(charset or 'ascii')
+        for part, charset in email.header.decode_header(value)
+    )
+
+
+class TestNotifications:
+
+    def test_subscribers(self, user, page, testapp):
+        testapp.post(
+            '/login',
+            {
+                'email': user.email,
+                'password': 'myprecious',
+            }
+        )
+        res = testapp.get('/pages/%d/subscribers' % page.id)
+        form = res.forms['add-subscriber-form']
+        form['kind'] = 'email'
+        form['address'] = 'not-an-email'
+        res = form.submit()
+        assert Subscriber.query.count() == 0
+
+        form = res.forms['add-subscriber-form']
+        form['kind'] = 'webhook'
+        form['address'] = 'https://example.com/hook'
+        res = form.submit().follow()
+        assert 'https://example.com/hook' in res
+
+        res = res.forms[1].submit().follow()
+        assert Subscriber.query.count() == 0
+
+    def test_delivery(self, app, page, smtp_sink, http_receiver):
+        app.config.update(
+            NOTIFICATION_COLLAPSE_DELAY=0,
+            NOTIFICATION_SMTP_HOST='127.0.0.1',
+            NOTIFICATION_SMTP_PORT=smtp_sink.port,
+        )
+        hook = 'http://127.0.0.1:%d/hook?key=secret' % \
+            http_receiver.server_port
+        for address in ('ops@example.com', 'dev@example.com'):
+            Subscriber.create(page=page, kind='email', address=address)
+        Subscriber.create(page=page, kind='webhook', address=hook)
+        incident = IncidentFactory(page=page, title='DNS outage')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+        # The worker removes the session when it is done
+        page_id, page_name, incident_id = page.id, page.name, incident.id
+
+        worker = NotificationWorker(app, concurrency=2)
+        assert worker.run_once() == 3
+        assert worker.run_once() == 0
+
+        assert sorted(to for (to,), _ in smtp_sink.messages) == [
+            'dev@example.com', 'ops@example.com'
+        ]
+        message = email.message_from_string(smtp_sink.messages[0][1])
+        assert decode_header(message['Subject']) == \
+            u'[%s] DNS outage: Investigating' % page_name
+        (path, body), = http_receiver.requests
+        assert path == '/hook?key=secret'
+        assert body['event'] == 'incident-update'
+        assert body['page']['id'] == page_id
+        assert body['incident']['message'] == 'Looking'
+        assert Notification.query.filter_by(state='sent').count() == 3
+
+        # Failed deliveries are retried later
+        http_receiver.status = 500
+        IncidentUpdate(
+            incident_id=incident_id, status='Fixed', message='Fixed'
+        ).save()
+        assert worker.run_once() == 3
+        notification = Notification.query.filter_by(state='pending').one()
+        assert notification.attempts == 1
+        assert notification.last_error == 'HTTP 500 Internal Server Error'
+        assert notification.due_time > dt.datetime.utcnow() + \
+            dt.timedelta(seconds=20)
+        assert worker.run_once() == 0
+
+    def test_delivery_of_non_ascii_email(self, app, db, smtp_sink):
+        app.config.update(
+            NOTIFICATION_COLLAPSE_DELAY=0,
+            NOTIFICATION_SMTP_HOST='127.0.0.1',
+            NOTIFICATION_SMTP_PORT=smtp_sink.port,
+        )
+        page = PageFactory(name=u'Café Status')
+        Subscriber.create(page=page, kind='email', address='ops@example.com')
+        incident = IncidentFactory(page=page, title=u'Dépôt indisponible')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message=u'Enquête'
+        ).save()
+
+        worker = NotificationWorker(app, concurrency=1)
+        assert worker.run_once() == 1
+
+        (_, data), = smtp_sink.messages
+        message = email.message_from_string(data)
+        assert decode_header(message['Subject']) == \
+            u'[Café Status] Dépôt indisponible: Investigating'
+        name, sender = email.utils.parseaddr(message['From'])
+        assert decode_header(name) == u'Café Status'
+        assert sender == app.config['NOTIFICATION_SENDER']
+        assert u'Enquête' in \
+            message.get_payload(decode=True).decode('utf-8')
+
+    def test_partial_delivery(self, app, smtp_sink, monkeypatch):
+        app.config.update(
+            NOTIFICATION_SMTP_HOST='127.0.0.1',
+            NOTIFICATION_SMTP_PORT=smtp_sink.port,
+        )
+        sendmail = smtplib.SMTP.sendmail
+
+        def disconnect_after_first(smtp, sender, to, message):
+            if smtp_sink.messages:
+                raise smtplib.SMTPServerDisconnected('Gone')
+            sendmail(smtp, sender, to, message)
+            # The sink receives the message asynchronously
+            while not smtp_sink.messages:
+                time.sleep(0.01)
+        monkeypatch.setattr(smtplib.SMTP, 'sendmail', disconnect_after_first)
+
+        page = {'id': 1, 'name': 'Demo', 'url': 'http://demo.example.com'}
+        payload = {
+            'event': 'incident-update',
+            'incident': {
+                'id': 1, 'title': 'DNS outage', 'status': 'Fixed',
+                'message': 'Fixed',
+            },
+        }
+        items = [
+            {'id': id, 'address': address, 'page': page, 'payload': payload}
+            for id, address in [(1, 'ops@example.com'), (2, 'dev@example.com')]
+        ]
+        worker = NotificationWorker(app)
+        (first, error), (second, second_error) = worker.deliver(
+            ('email', 'example.com', items)
+        )
+        # The email sent before the failure is not sent again
+        assert (first, error) == (1, None)
+        assert second == 2 and 'Gone' in second_error
+
+
+class TestAlerts:
+
+    def test_ingest(self, user, page, testapp):
+        component = Component.create(name='API', page_id=page.id)
+        url = '/pages/%d/alerts/ingest' % page.id
+        alerts = {'alerts': [{'name': 'api-down', 'status': 'firing'}]}
+        testapp.post_json(url, alerts, status=401)
+
+        testapp.post(
+            '/login',
+            {
+                'email': user.email,
+                'password': 'myprecious',
+            }
+        )
+        res = testapp.get('/pages/%d/alerts' % page.id)
+        res = res.forms['alert-token-form'].submit().follow()
+        form = res.forms['add-alert-rule-form']
+        form['pattern'] = 'api-*'
+        form['component'] = str(component.id)
+        form['status'] = 'Major Outage'
+        res = form.submit().follow()
+        assert 'api-*' in res
+        token = str(Page.query.get(page.id).alert_token)
+
+        testapp.post_json(url, alerts, headers={
+            'Authorization': 'Bearer wrong'
+        }, status=401)
+        headers = {'Authorization': 'Bearer %s' % token}
+        testapp.post_json(url, {'alerts': 'x'}, headers=headers, status=400)
+        res = testapp.post_json(url, alerts, headers=headers)
+        assert res.json['changed'][0]['status'] == 'Major Outage'
+        assert Component.query.get(component.id).status == 'Major Outage'
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    Serves requests with a fixed number of threads, like the gthread
+    workers of gunicorn.
+    """
+
+    class Handler(WSGIRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self, app, threads):
+        WSGIServer.__init__(self, ('127.0.0.1', 0), self.Handler)
+        self.set_app(app)
+        self.requests = Queue()
+        for _ in range(threads):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def handle_error(self, request, client_address):
+        # The streams closed by the test
+        if not isinstance(sys.exc_info()[1], socket.error):
+            WSGIServer.handle_error(self, request, client_address)
+
+    def work(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class TestLiveUpdates:
+
+    def test_streams_leave_threads_for_other_views(self, tmpdir, monkeypatch):
+        class LiveConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % tmpdir.join('db')
+            LIVE_UPDATES_MAX_STREAMS = 2
+
+        app = create_app(LiveConfig)
+        # Not the app of an earlier test, in the threads of the server
+        monkeypatch.setattr(db, 'app', app)
+        with app.app_context():
+            db.create_all()
+            page = PageFactory()
+            db.session.commit()
+            page_id = page.id
+            db.session.remove()
+
+        server = PooledWSGIServer(app, threads=3)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        def get(path):
+            connection = httplib.HTTPConnection(
+                '127.0.0.1', server.server_port, timeout=5
+            )
+            connection.request('GET', path % page_id)
+            return connection.getresponse()
+
+        streams = []
+        try:
+            for _ in range(2):
+                stream = get('/pages/%d/events')
+                assert stream.status == 200
+                assert stream.fp.readline() == 'retry: 5000\n'
+                streams.append(stream)
+
+            # Turned away instead of taking the last thread...
+            res = get('/pages/%d/events')
+            assert res.status == 503
+            assert res.getheader('Retry-After') == '60'
+            res.read()
+
+            # ...which serves the other views
+            res = get('/pages/%d/status.json')
+            assert json.loads(res.read())['id'] == page_id
+        finally:
+            for stream in streams:
+                stream.close()
+            server.shutdown()
+            server.server_close()
+
+
+class TestReplica:
+
+    def test_public_views_read_from_replica(self, user, page, app, testapp):
+        # An empty replica, so that reads from it are told apart
+        app.config['SQLALCHEMY_REPLICA_URI'] = 'sqlite://'
+        try:
+            db.metadata.create_all(bind=db.get_replica_engine(app))
+            page_id, email = page.id, user.email
+            # As in a new request, nothing is loaded yet
+            db.session.remove()
+            testapp.get('/pages/%d' % page_id, status=404)
+            testapp.get('/pages/%d/status.json' % page_id, status=404)
+
+            # Logging in and the admin views use the primary
+            res = testapp.post(
+                '/login',
+                {
+                    'email': email,
+                    'password': 'myprecious',
+                }
+            )
+            assert res.status_code == 302
+            res = testapp.get('/pages/%d/dashboard' % page_id)
+            assert res.status_code == 200
+        finally:
+            app.config['SQLALCHEMY_REPLICA_URI'] = None
+
+    def test_without_replica(self, page, testapp):
+        res = testapp.get('/pages/%d/status.json' % page.id)
+        assert res.json['name'] == page.name
+
+
+class TestSetupState:
+
+    def test_home(self, db, testapp):
+        res = testapp.get('/')
+        assert res.location.endswith('/users/initial-setup')
+
+        user = UserFactory(password='myprecious')
+        db.session.commit()
+        res = testapp.get('/')
+        assert res.location.endswith('/pages/')
+
+        # Once known, the state is not read from the database again
+        with count_queries() as profile:
+            testapp.get('/')
+        assert not any('users' in s for s in profile.statements)
+        assert not any('setup_state' in s for s in profile.statements)
+
+        user.delete()
+        res = testapp.get('/')
+        assert res.location.endswith('/users/initial-setup')
+
+
+class TestAssets:
+
+    def test_build_and_serve(self, tmpdir):
+        static = tmpdir.mkdir('static')
+        static.mkdir('css').join('style.css').write('body { color: red; }')
+        static.join('extra.css').write('p { margin: 0; }')
+        app = create_app(TestConfig)
+        app.static_folder = str(static)
+        app.config['STATIC_MANIFEST'] = str(tmpdir.join('manifest.json'))
+
+        manifest = build_assets(
+            app, bundles={
+                'css_all': Bundle(
+                    'css/style.css', filters='cssmin',
+                    output='built/common.css'
+                ),
+            }, files=['extra.css']
+        )
+        assert re.match(
+            r'built/common\.[0-9a-f]{12}\.css$', manifest['css_all']
+        )
+        assert re.match(r'extra\.[0-9a-f]{12}\.css$', manifest['extra.css'])
+        assert static.join(manifest['css_all'] + '.gz').check()
+
+        asset_manifest.init_app(app)
+        with app.test_request_context():
+            url, = asset_urls('css_all')
+        assert url == '/static/' + manifest['css_all']
+
+        testapp = webtest.TestApp(app)
+        res = testapp.get(url)
+        assert res.body == b'body{color:red}'
+        assert 'immutable' in res.headers['Cache-Control']
+        assert 'Content-Encoding' not in res.headers
+        assert res.headers['Vary'] == 'Accept-Encoding'
+
+        # Not through WebTest, which decompresses responses
+        res = app.test_client().get(url, headers={'Accept-Encoding': 'gzip'})
+        assert res.headers['Content-Encoding'] == 'gzip'
+        assert res.headers['Content-Type'].startswith('text/css')
+        assert gzip.GzipFile(fileobj=BytesIO(res.data)).read() == \
+            b'body{color:red}'
+
+        # Files that are not fingerprinted are not cached for long
+        res = testapp.get('/static/css/style.css')
+        assert 'immutable' not in res.headers.get('Cache-Control', '')
+
+
+@pytest.yield_fixture
+def status_app(tmpdir):
+    # Status pods serve the assets built at deploy time
+    manifest = tmpdir.join('manifest.json')
+    manifest.write(json.dumps({
+        'css_all': 'public/css/common.0123456789ab.css',
+        'js_all': 'public/js/common.0123456789ab.js',
+    }))
+
+    class StatusConfig(TestConfig):
+        STATIC_MANIFEST = str(manifest)
+
+    app = create_status_app(StatusConfig)
+    ctx = app.test_request_context()
+    ctx.push()
+    db.create_all()
+
+    yield app
+
+    db.session.remove()
+    db.drop_all()
+    ctx.pop()
+
+
+class TestStatusApp:
+
+    def test_public_views(self, status_app):
+        page = PageFactory()
+        db.session.commit()
+        Component.create(name='Public API', page_id=page.id)
+        testapp = webtest.TestApp(status_app)
+
+        res = testapp.get('/pages/%d' % page.id)
+        assert 'Public API' in res
+        res = testapp.get('/pages/%d/status.json' % page.id)
+        assert res.json['name'] == page.name
+        res = testapp.get('/', extra_environ={'HTTP_HOST': str(page.site_url)})
+        assert 'Public API' in res
+
+        # Nothing but the public views
+        testapp.get('/', extra_environ={'HTTP_HOST': 'unknown.com'}, status=404)
+        testapp.get('/pages/%d/dashboard' % page.id, status=404)
+        testapp.get('/login', status=404)
+
+    def test_admin_extensions_not_imported(self):
+        modules = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, clearstate.status_app; print(" ".join(sys.modules))'
+        ]).split()
+        for name in (
+                'clearstate.admin_extensions', 'clearstate.user.forms',
+                'flask_bcrypt', 'flask_migrate', 'flask_debugtoolbar',
+                'flask_gravatar', 'flask_wtf', 'wtforms'):
+            assert name not in modules
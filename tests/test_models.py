@@ -1,11 +1,33 @@
 # -*- coding: utf-8 -*-
 """Model unit tests."""
 import datetime as dt
+import json
+import threading
+from io import BytesIO
 
 import pytest
+from sqlalchemy import event
+from werkzeug.contrib.cache import SimpleCache
 
-from clearstate.user.models import User, Role
-from clearstate.page.models import Component, IncidentUpdate
+from clearstate.extensions import cache
+from clearstate.user.models import User, Role, SetupState
+from clearstate.user.setup import setup_flag
+from clearstate.page.models import Page, Component, ComponentGroup, \
+    Incident, IncidentUpdate, ComponentStatusChange, ComponentDailyStatus, \
+    add_daily_status, Subscriber, Notification, AlertRule, Alert
+from clearstate.page.alerts import ingest_alerts, apply_due_recoveries, \
+    InvalidAlerts
+from clearstate.page.domains import domain_index
+from clearstate.page.live import PageChannel
+from clearstate.page.notifications import recipient_domain
+from clearstate.page.views import get_timezone_from_page
+from clearstate.page import search
+from clearstate.page.search import search_incidents
+from clearstate.page.transfer import export_page, PageImport
+from clearstate.profiling import count_queries, statement_shape
+from clearstate.routing import ping_connection
+from clearstate.admin_extensions import bcrypt
+from clearstate.passwords import HashingPool, PasswordHasherBusy, hash_rounds
 from .factories import UserFactory, PageFactory, IncidentFactory
 
 
@@ -47,6 +69,94 @@ class TestUser:
         assert user.check_password('foobarbaz123') is True
         assert user.check_password("barfoobaz") is False
 
+    def test_check_password_rehashes(self):
+        user = User.create(email="foo@bar.com")
+        user.password = bcrypt.generate_password_hash('foobarbaz123', 5)
+        assert user.check_password('foobarbaz123') is True
+        assert user.password.startswith('$2b$04$') or \
+            user.password.startswith('$2a$04$')
+        assert user.check_password('foobarbaz123') is True
+
+    def test_get_by_session_id(self, app, db, monkeypatch):
+        monkeypatch.setitem(app.config, 'USER_CACHE_SHARED', True)
+        user = UserFactory(password='myprecious')
+        db.session.commit()
+        user_id, session_id = user.id, user.get_id()
+        assert User.get_by_session_id(session_id) is user
+        db.session.remove()
+
+        # Loaded from the cache, with the roles
+        with count_queries() as profile:
+            cached = User.get_by_session_id(session_id)
+            assert cached.roles == []
+        assert profile.count == 0
+        assert cached in db.session
+
+        Role(name='admin', user=cached).save()
+        db.session.remove()
+        assert [
+            role.name for role in User.get_by_session_id(session_id).roles
+        ] == ['admin']
+
+        assert User.get_by_session_id('x') is None
+        assert User.get_by_session_id('%d:wrong' % user_id) is None
+
+    def test_cache_of_each_process(self, app, db, monkeypatch):
+        """
+        A change made by another process, which only drops the user from
+        its own cache, ends the sessions in this process.
+        """
+        user = UserFactory(password='myprecious')
+        db.session.commit()
+        session_id = user.get_id()
+        this_process, other_process = SimpleCache(), SimpleCache()
+        for backend in (other_process, this_process):
+            monkeypatch.setitem(app.extensions['cache'], cache, backend)
+            assert User.get_by_session_id(session_id) is not None
+            db.session.remove()
+
+        # Cached, without the roles
+        with count_queries() as profile:
+            assert User.get_by_session_id(session_id).roles == []
+        assert profile.count == 1
+        db.session.remove()
+
+        monkeypatch.setitem(app.extensions['cache'], cache, other_process)
+        User.get_by_session_id(session_id).update(active=False)
+        db.session.remove()
+        monkeypatch.setitem(app.extensions['cache'], cache, this_process)
+        assert User.get_by_session_id(session_id) is None
+
+    def test_credential_change_ends_sessions(self, db):
+        user = UserFactory(password='myprecious')
+        db.session.commit()
+        session_id = user.get_id()
+        assert User.get_by_session_id(session_id) is not None
+
+        user.update(active=False)
+        assert User.get_by_session_id(session_id) is None
+        user.update(active=True)
+        assert User.get_by_session_id(session_id) is not None
+
+        user.set_password('other')
+        user.save()
+        assert User.get_by_session_id(session_id) is None
+        assert User.get_by_session_id(user.get_id()) is user
+
+    def test_setup_state(self, db):
+        assert not setup_flag.is_done()
+        UserFactory()
+        db.session.commit()
+        assert SetupState.query.count() == 1
+        assert setup_flag.is_done()
+
+        # Databases set up before the state was recorded
+        SetupState.query.delete()
+        db.session.commit()
+        setup_flag.invalidate()
+        assert setup_flag.is_done()
+        assert SetupState.query.count() == 1
+
     def test_roles(self):
         role = Role(name='admin')
         role.save()
@@ -85,6 +195,248 @@ class TestPage:
 
         assert page.component_count == 4
 
+        component.delete()
+        assert page.component_count == 3
+
+    def test_domain_index(self, db):
+        page = PageFactory(site_url='http://status.example.com')
+        db.session.commit()
+        assert domain_index.lookup('status.example.com') == page.id
+
+        # Not until the change is committed...
+        page.site_url = 'http://status.example.org'
+        db.session.flush()
+        assert domain_index.lookup('status.example.com') == page.id
+
+        # ...and not at all if it is rolled back
+        db.session.rollback()
+        assert domain_index.lookup('status.example.org') is None
+
+        page.site_url = 'http://status.example.org'
+        db.session.commit()
+        assert domain_index.lookup('status.example.org') == page.id
+        assert domain_index.lookup('status.example.com') is None
+
+    def test_domain_index_invalidated_during_lookup(self, db, monkeypatch):
+        page = PageFactory(site_url='http://status.example.com')
+        db.session.commit()
+        assert domain_index.lookup('status.example.com') == page.id
+
+        # Another thread invalidates the index while it is being looked up
+        expired = domain_index.expired
+
+        def expired_and_invalidated(state):
+            result = expired(state)
+            domain_index.invalidate()
+            return result
+        monkeypatch.setattr(domain_index, 'expired', expired_and_invalidated)
+        assert domain_index.lookup('status.example.com') == page.id
+
+    def test_incident_count(self, db):
+        page = PageFactory()
+        page.save()
+        IncidentFactory(page=page)
+        IncidentFactory(page=page)
+        db.session.commit()
+        assert page.incident_count == 2
+
+    def test_reconcile_counts(self, db):
+        page = PageFactory()
+        page.save()
+        Component(name='API', page_id=page.id).save()
+        IncidentFactory(page=page)
+        page.component_count = 10
+        page.incident_count = 0
+        db.session.commit()
+
+        Page.reconcile_counts()
+        db.session.commit()
+        assert page.component_count == 1
+        assert page.incident_count == 1
+
+    def test_version(self, db):
+        page = PageFactory()
+        page.save()
+        version = page.version
+
+        component = Component(name='API', page_id=page.id)
+        component.save()
+        assert page.version == version + 1
+
+        component.status = 'Major Outage'
+        component.save()
+        assert page.version == version + 2
+
+        incident = IncidentFactory(page=page)
+        incident.save()
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+        assert page.version == version + 4
+
+        page.about_page = 'Something else'
+        page.save()
+        assert page.version == version + 5
+
+    def test_get_by_id_is_cached(self, app, db):
+        page = PageFactory(timezone='Asia/Kolkata')
+        page.save()
+        page_id = page.id
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda *args: statements.append(args)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            with app.test_request_context('/pages/%d' % page_id):
+                page = Page.get_by_id(page_id)
+                # A commit expires the page, but does not look it up again
+                db.session.commit()
+                assert Page.get_by_id(page_id) is page
+                assert get_timezone_from_page() is page.effective_tz
+                assert get_timezone_from_page().zone == 'Asia/Kolkata'
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        # The lookup and the refresh of the expired page
+        assert len(statements) == 2
+
+    def test_components_by_group(self, db):
+        page = PageFactory()
+        page.save()
+        databases = ComponentGroup.create(name='Databases', page=page)
+        apis = ComponentGroup.create(name='APIs', page=page)
+        for name, group in [
+                ('Postgres', databases), ('Website', None),
+                ('Public API', apis), ('Admin API', apis),
+                ('Blog', None), ('Redis', databases)]:
+            Component.create(name=name, page=page, group=group)
+        db.session.expire_all()
+
+        statements = []
+        listener = lambda *args: statements.append(args)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            page = Page.get_by_id(page.id)
+            grouped = page.components_by_group()
+            names = [
+                (group and group.name, [c.name for c in components])
+                for group, components in grouped
+            ]
+            # Iterating again does not query
+            names_again = [
+                (group and group.name, [c.name for c in components])
+                for group, components in grouped
+            ]
+            assert len(page.components) == 6
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert names == names_again == [
+            ('APIs', ['Admin API', 'Public API']),
+            ('Databases', ['Postgres', 'Redis']),
+            (None, ['Blog', 'Website']),
+        ]
+        # The page, the groups and the components
+        assert len(statements) == 3
+
+    def test_uptime(self, db):
+        page = PageFactory()
+        page.save()
+        component = Component(
+            name='API', page_id=page.id,
+            status_since=dt.datetime(2015, 3, 9, 12, 0),
+        )
+        component.save()
+
+        # Half a day operational, then an outage till noon the next day
+        ComponentDailyStatus.create(
+            component_id=component.id, date=dt.date(2015, 3, 9),
+            status='Operational', seconds=12 * 3600,
+        )
+        add_daily_status(
+            db.session.connection(), component.id, 'Major Outage',
+            dt.datetime(2015, 3, 10, 0, 0), dt.datetime(2015, 3, 10, 12, 0),
+        )
+        add_daily_status(
+            db.session.connection(), component.id, 'Major Outage',
+            dt.datetime(2015, 3, 9, 12, 0), dt.datetime(2015, 3, 10, 0, 0),
+        )
+        component.status_since = None
+        db.session.commit()
+
+        (result_component, uptime, days), = page.uptime(
+            dt.date(2015, 3, 10), days=3
+        )
+        assert result_component == component
+        assert round(uptime) == 33
+        assert [day['status'] for day in days] == [
+            None, 'Major Outage', 'Major Outage'
+        ]
+        assert days[1]['seconds'] == {
+            'Operational': 12 * 3600, 'Major Outage': 12 * 3600,
+        }
+
+    def test_get_incidents(self, db):
+        page = PageFactory(timezone='America/New_York')
+        page.save()
+
+        # 02:00 UTC on the 10th is still the 9th in New York
+        late_night = IncidentFactory(
+            page=page, create_time=dt.datetime(2015, 3, 10, 2, 0)
+        )
+        morning = IncidentFactory(
+            page=page, create_time=dt.datetime(2015, 3, 10, 14, 0)
+        )
+        # Outside the window
+        IncidentFactory(page=page, create_time=dt.datetime(2015, 3, 1))
+        db.session.commit()
+
+        timeline = list(page.get_incidents(dt.date(2015, 3, 10), 3))
+
+        assert [date for date, _ in timeline] == [
+            dt.date(2015, 3, 10), dt.date(2015, 3, 9), dt.date(2015, 3, 8),
+        ]
+        assert timeline[0][1] == [morning]
+        assert timeline[1][1] == [late_night]
+        assert timeline[2][1] == []
+
+
+@pytest.mark.usefixtures('db')
+class TestComponent:
+
+    def test_status_history(self, db):
+        page = PageFactory()
+        page.save()
+        component = Component(name='API', page_id=page.id)
+        component.save()
+        assert component.status_since is not None
+
+        component.status_since = dt.datetime.utcnow() - dt.timedelta(
+            minutes=10
+        )
+        component.save()
+        component.status = 'Major Outage'
+        component.save()
+        component.status = 'Operational'
+        component.save()
+
+        changes = ComponentStatusChange.query.filter_by(
+            component_id=component.id
+        ).order_by(ComponentStatusChange.id).all()
+        assert [(c.previous_status, c.status) for c in changes] == [
+            (None, 'Operational'),
+            ('Operational', 'Major Outage'),
+            ('Major Outage', 'Operational'),
+        ]
+
+        operational = db.session.query(
+            db.func.sum(ComponentDailyStatus.seconds)
+        ).filter_by(
+            component_id=component.id, status='Operational'
+        ).scalar()
+        assert 595 <= operational <= 600
+
 
 @pytest.mark.usefixtures('db')
 class TestIncident:
@@ -124,3 +476,543 @@ class TestIncident:
 
         assert incident.message == "Fixed Broken World!"
         assert incident.status == "Fixed"
+
+    def test_message_and_state_without_querying_updates(self, db):
+        incident = IncidentFactory()
+        incident.save()
+
+        IncidentUpdate(
+            incident=incident,
+            message="Hello Broken World!",
+            status="Investigating",
+        ).save()
+
+        # The state is stored on the incident itself
+        row = db.session.query(
+            Incident.current_status, Incident.current_message,
+            Incident.last_update_time,
+        ).filter(Incident.id == incident.id).one()
+        assert row.current_status == "Investigating"
+        assert row.current_message == "Hello Broken World!"
+        assert row.last_update_time is not None
+        assert incident.update_time == row.last_update_time
+
+    def test_editing_update_changes_state(self, db):
+        incident = IncidentFactory()
+        incident.save()
+
+        update_1 = IncidentUpdate(
+            incident=incident,
+            message="Investigating the issue",
+            status="Investigating",
+        )
+        update_1.save()
+
+        update_1.message = "Investigating the network issue"
+        update_1.save()
+        assert incident.message == "Investigating the network issue"
+
+    def test_older_update_does_not_override_state(self, db):
+        incident = IncidentFactory()
+        incident.save()
+
+        IncidentUpdate(
+            incident=incident,
+            message="Fixed Broken World!",
+            status="Fixed",
+        ).save()
+        IncidentUpdate(
+            incident=incident,
+            message="Hello Broken World!",
+            status="Investigating",
+            create_time=dt.datetime(2000, 1, 1),
+            update_time=dt.datetime(2000, 1, 1),
+        ).save()
+
+        assert incident.status == "Fixed"
+
+    def test_refresh_last_update(self, db):
+        incident = IncidentFactory()
+        incident.save()
+        IncidentUpdate(
+            incident=incident,
+            message="Hello Broken World!",
+            status="Investigating",
+        ).save()
+
+        incident.current_status = None
+        incident.current_message = None
+        incident.refresh_last_update().save()
+
+        assert incident.status == "Investigating"
+        assert incident.message == "Hello Broken World!"
+
+
+@pytest.mark.usefixtures('db')
+class TestPageChannel:
+
+    def test_poll(self, db):
+        page = PageFactory()
+        page.save()
+        component = Component(name='API', page_id=page.id)
+        component.save()
+        incident = IncidentFactory(page=page)
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+
+        channel = PageChannel(page.id)
+        queue = channel.subscribe()
+        channel.prime()
+        assert channel.poll() == 0
+
+        component.status = 'Major Outage'
+        component.save()
+        IncidentUpdate(
+            incident=incident, status='Fixed', message='All good'
+        ).save()
+        assert channel.poll() == 2
+
+        version, event, data = queue.get_nowait()
+        assert event == 'component'
+        assert data['status'] == 'Major Outage'
+        version, event, data = queue.get_nowait()
+        assert event == 'incident-update'
+        assert data['message'] == 'All good'
+        assert data['incident']['status'] == 'Fixed'
+        assert version == page.version
+
+        # Nothing changed since
+        assert channel.poll() == 0
+
+
+class TestQueryProfile:
+
+    def test_repeated_statements(self, db):
+        page = PageFactory()
+        for index in range(4):
+            incident = IncidentFactory(page=page)
+            IncidentUpdate(
+                incident=incident, status='Investigating', message='Looking'
+            ).save()
+        page_id = page.id
+        db.session.expire_all()
+
+        with count_queries() as profile:
+            # Lazy loads the updates of every incident
+            for incident in Incident.query.filter_by(page_id=page_id):
+                assert len(incident.updates) == 1
+
+        assert profile.count == 5
+        (count, shape), = profile.repeated(3)
+        assert count == 4
+        assert 'FROM page_incident_update' in shape
+        assert profile.repeated(5) == []
+
+    def test_failed_statement(self, db):
+        connection = db.session.connection()
+        with pytest.raises(Exception):
+            connection.execute('SELECT * FROM no_such_table')
+        assert connection.info['query_start_time'] == []
+
+    def test_statement_shape(self):
+        assert statement_shape(
+            'SELECT *\n  FROM page WHERE id IN (?, ?, ?)'
+        ) == statement_shape(
+            'SELECT * FROM page WHERE id IN (?)'
+        ) == 'SELECT * FROM page WHERE id IN (?)'
+
+
+class TestSearch:
+
+    def titles(self, results):
+        return [incident.title for incident in results.items]
+
+    def test_search_incidents(self, db):
+        page = PageFactory()
+        other_page = PageFactory(site_url='status.example.com')
+        dns = IncidentFactory(page=page, title='DNS resolution failures')
+        IncidentUpdate(
+            incident=dns, status='Investigating',
+            message='Lookups of our domains are timing out'
+        ).save()
+        api = IncidentFactory(page=page, title='Elevated API errors')
+        IncidentUpdate(
+            incident=api, status='Identified',
+            message='A failing DNS server caused the errors'
+        ).save()
+        IncidentFactory(page=other_page, title='DNS outage').save()
+
+        # Scoped to the page, matches in the title first
+        results = search_incidents(page.id, 'dns')
+        assert self.titles(results) == [
+            'DNS resolution failures', 'Elevated API errors'
+        ]
+        assert results.total == 2
+
+        # Words are stemmed and prefixes match
+        assert self.titles(search_incidents(page.id, 'lookup')) == [
+            'DNS resolution failures'
+        ]
+        assert self.titles(search_incidents(page.id, 'elev')) == [
+            'Elevated API errors'
+        ]
+        assert search_incidents(page.id, '  "* ').total == 0
+
+        # Paginated
+        results = search_incidents(page.id, 'dns', page=2, per_page=1)
+        assert self.titles(results) == ['Elevated API errors']
+        assert results.has_prev and not results.has_next
+
+    def test_index_is_updated(self, db):
+        page = PageFactory()
+        incident = IncidentFactory(page=page, title='Slow website')
+        update = IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        )
+        update.save()
+        assert search_incidents(page.id, 'cdn').total == 0
+
+        update.message = 'The CDN is degraded'
+        update.save()
+        assert self.titles(search_incidents(page.id, 'cdn')) == [
+            'Slow website'
+        ]
+
+        incident.title = 'Slow assets'
+        incident.save()
+        assert self.titles(search_incidents(page.id, 'assets')) == [
+            'Slow assets'
+        ]
+        assert search_incidents(page.id, 'website').total == 0
+
+        update.delete()
+        assert search_incidents(page.id, 'cdn').total == 0
+        incident.delete()
+        assert search_incidents(page.id, 'assets').total == 0
+
+
+    def test_search_without_fts5(self, db, monkeypatch):
+        connection = db.session.connection()
+        monkeypatch.setitem(
+            search._sqlite_fts5, connection.dialect.dbapi.sqlite_version,
+            False
+        )
+        page = PageFactory()
+        incident = IncidentFactory(page=page, title='Slow website')
+        IncidentUpdate(
+            incident=incident, status='Investigating',
+            message='The CDN is degraded'
+        ).save()
+
+        # Searched without the index, which is not written either
+        assert self.titles(search_incidents(page.id, 'cdn')) == [
+            'Slow website'
+        ]
+        assert db.session.execute(
+            'SELECT count(*) FROM %s' % search.SEARCH_TABLE
+        ).scalar() == 0
+
+
+class TestTransfer:
+
+    def test_export_and_import(self, db):
+        page = PageFactory(alert_token='s3cret')
+        group = ComponentGroup.create(name='APIs', page=page)
+        api = Component.create(name='API', page=page, group=group)
+        Component.create(name='Website', page=page)
+        api.status = 'Major Outage'
+        api.save()
+        incident = IncidentFactory(page=page, title='DNS outage')
+        for status in ('Investigating', 'Fixed'):
+            IncidentUpdate(
+                incident=incident, status=status, message=status
+            ).save()
+        db.session.commit()
+
+        out = BytesIO()
+        assert export_page(page.id, out) == 11
+        lines = out.getvalue().splitlines()
+        assert [json.loads(line)['type'] for line in lines] == [
+            'page', 'component_group', 'component', 'component',
+            'component_status_change', 'component_status_change',
+            'component_status_change', 'component_daily_status',
+            'incident', 'incident_update', 'incident_update',
+        ]
+        assert 's3cret' not in out.getvalue()
+
+        copy = PageImport(
+            name='Copy', site_url='copy.example.com', chunk_size=2
+        ).run(lines)
+        assert copy.id != page.id
+        assert (copy.name, copy.site_url) == ('Copy', 'copy.example.com')
+        assert (copy.component_count, copy.incident_count) == (2, 1)
+        assert copy.alert_token is None
+
+        grouped = [
+            (group and group.name, [c.name for c in components])
+            for group, components in copy.components_by_group()
+        ]
+        assert grouped == [('APIs', ['API']), (None, ['Website'])]
+        assert copy.overall_status == 'Major Outage'
+        assert ComponentStatusChange.query.join(Component).filter(
+            Component.page_id == copy.id
+        ).count() == 3
+
+        copied_incident, = copy.incidents
+        assert copied_incident.title == 'DNS outage'
+        assert copied_incident.status == 'Fixed'
+        assert len(copied_incident.updates) == 2
+        assert search_incidents(copy.id, 'dns').items == [copied_incident]
+
+    def test_import_of_export_with_secrets(self, db):
+        page = PageFactory(alert_token='s3cret')
+        db.session.commit()
+        out = BytesIO()
+        export_page(page.id, out)
+        lines = out.getvalue().splitlines()
+        record = json.loads(lines[0])
+        record['alert_token'] = 's3cret'
+        lines[0] = json.dumps(record)
+
+        # Next to the page it was exported from
+        copy = PageImport(name='Copy', site_url='copy.example.com').run(lines)
+        assert copy.alert_token is None
+
+    def test_import_of_invalid_export(self, db):
+        with pytest.raises(ValueError):
+            PageImport().run(['{"type": "incident", "id": 1, "page_id": 1}'])
+
+
+class TestNotification:
+
+    def test_recipient_domain(self):
+        assert recipient_domain('email', 'Ops@Example.com') == 'example.com'
+        # Webhooks on the same host with another scheme are not batched
+        # together
+        assert recipient_domain('webhook', 'https://Example.com/a?k=1') == \
+            'https://example.com'
+        assert recipient_domain('webhook', 'http://example.com:8080/b') == \
+            'http://example.com:8080'
+
+    def test_enqueue(self, db):
+        page = PageFactory()
+        quiet_page = PageFactory(site_url='quiet.example.com')
+        subscriber = Subscriber.create(
+            page=page, kind='email', address='ops@example.com'
+        )
+        Subscriber.create(
+            page=page, kind='email', address='old@example.com', active=False
+        )
+        incident = IncidentFactory(page=page, title='DNS outage')
+        IncidentUpdate(
+            incident=incident, status='Investigating', message='Looking'
+        ).save()
+        IncidentUpdate(
+            incident=IncidentFactory(page=quiet_page),
+            status='Investigating', message='Looking'
+        ).save()
+
+        notification, = Notification.query.all()
+        assert notification.subscriber == subscriber
+        assert notification.state == 'pending'
+        assert notification.due_time > notification.create_time
+        assert json.loads(notification.payload)['incident'] == {
+            'id': incident.id, 'title': 'DNS outage',
+            'status': 'Investigating', 'message': 'Looking',
+        }
+
+        # A newer update replaces the one waiting to be sent
+        IncidentUpdate(
+            incident=incident, status='Fixed', message='Fixed it'
+        ).save()
+        db.session.expire_all()
+        notification, = Notification.query.all()
+        assert json.loads(notification.payload)['incident']['status'] == \
+            'Fixed'
+
+        # ...but not one that was attempted
+        notification.attempts = 1
+        notification.save()
+        IncidentUpdate(
+            incident=incident, status='Fixed', message='Really fixed it'
+        ).save()
+        assert Notification.query.count() == 2
+
+        component = Component.create(name='API', page=page)
+        assert Notification.query.count() == 2
+        component.status = 'Major Outage'
+        component.save()
+        notification = Notification.query.filter_by(
+            collapse_key='component:%d' % component.id
+        ).one()
+        assert json.loads(notification.payload)['component']['status'] == \
+            'Major Outage'
+
+
+class TestAlerts:
+
+    def test_ingest_alerts(self, app, db):
+        app.config['ALERT_RECOVERY_DELAY'] = 300
+        page = PageFactory()
+        api = Component.create(name='API', page=page)
+        website = Component.create(name='Website', page=page)
+        AlertRule.create(
+            page=page, pattern='api-*', component=api,
+            status='Partial Outage'
+        )
+        AlertRule.create(
+            page=page, pattern='api-down', component=api,
+            status='Major Outage'
+        )
+        AlertRule.create(
+            page=page, pattern='web-*', component=website,
+            status='Performance Issues'
+        )
+
+        # A burst is coalesced into one transition per component
+        summary = ingest_alerts(page, {'alerts': [
+            {'name': 'api-latency'},
+            {'name': 'api-down', 'status': 'firing'},
+            {'name': 'api-down', 'status': 'resolved'},
+            {'name': 'api-down', 'status': 'firing'},
+            {'name': 'db-disk'},
+        ]})
+        assert summary['alerts'] == summary['written'] == 3
+        assert [c['name'] for c in summary['changed']] == ['API']
+        assert api.status == 'Major Outage'
+        assert website.status == 'Operational'
+        assert ComponentStatusChange.query.filter_by(
+            component_id=api.id
+        ).count() == 2
+
+        # Repeated alerts do not write anything
+        summary = ingest_alerts(page, [{'name': 'api-latency'}])
+        assert summary['written'] == 0 and summary['changed'] == []
+
+        # A flapping alert does not flap the component
+        summary = ingest_alerts(page, [
+            {'name': 'api-down', 'status': 'resolved'},
+        ])
+        assert summary['changed'] == []
+        assert summary['held'][0]['target'] == 'Partial Outage'
+        assert api.status == 'Major Outage'
+
+        # ...and the recovery happens once the component was stable
+        api.status_since -= dt.timedelta(seconds=301)
+        api.save()
+        summary = ingest_alerts(page, [])
+        assert [c['status'] for c in summary['changed']] == [
+            'Partial Outage'
+        ]
+        assert Alert.query.filter_by(page_id=page.id, firing=True).count() \
+            == 2
+
+    def test_held_recovery_applied_when_due(self, app, db):
+        app.config['ALERT_RECOVERY_DELAY'] = 300
+        page = PageFactory()
+        api = Component.create(name='API', page=page)
+        AlertRule.create(page=page, pattern='api-*', component=api)
+        ingest_alerts(page, [{'name': 'api-down'}])
+        summary = ingest_alerts(page, [
+            {'name': 'api-down', 'status': 'resolved'}
+        ])
+        assert summary['held'][0]['target'] == 'Operational'
+        assert api.recovery_due == api.status_since + dt.timedelta(
+            seconds=300
+        )
+
+        # The monitoring system says nothing more
+        assert apply_due_recoveries() == 0
+        assert api.status == 'Major Outage'
+        assert apply_due_recoveries(api.recovery_due) == 1
+        assert api.status == 'Operational'
+        assert api.recovery_due is None
+
+    def test_alert_inserted_concurrently(self, app, db):
+        page = PageFactory()
+        page.save()
+        table = Alert.__table__
+        inserted = []
+
+        # Another batch inserts the alert right after it was looked up
+        @event.listens_for(db.engine, 'after_execute')
+        def insert_alert(conn, clauseelement, multiparams, params, result):
+            if not inserted and 'FROM page_alert' in str(clauseelement):
+                inserted.append(True)
+                conn.execute(table.insert().values(
+                    page_id=page.id, name='api-down', firing=False,
+                    update_time=dt.datetime.utcnow(),
+                ))
+        try:
+            summary = ingest_alerts(page, [{'name': 'api-down'}])
+        finally:
+            event.remove(db.engine, 'after_execute', insert_alert)
+        assert inserted
+        assert summary['written'] == 1
+        alert, = Alert.query.filter_by(page_id=page.id).all()
+        assert alert.firing
+
+    def test_invalid_alerts(self, db):
+        page = PageFactory()
+        for data in [None, {}, [{}], [{'name': 'x', 'status': 'ok'}]]:
+            with pytest.raises(InvalidAlerts):
+                ingest_alerts(page, data)
+
+
+class TestHashingPool:
+
+    def test_refuses_excess(self):
+        pool = HashingPool(1, 1)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+            return 'done'
+
+        first = threading.Thread(target=pool.submit, args=(5, block))
+        first.start()
+        started.wait()
+        # One job runs and one waits, so the next is refused at once
+        second = threading.Thread(target=pool.submit, args=(5, lambda: 2))
+        second.start()
+        with pytest.raises(PasswordHasherBusy):
+            pool.submit(5, lambda: 3)
+        release.set()
+        first.join()
+        second.join()
+        assert pool.submit(5, lambda: 4) == 4
+
+    def test_timeout(self):
+        pool = HashingPool(1, 1)
+        release = threading.Event()
+        with pytest.raises(PasswordHasherBusy):
+            pool.submit(0.05, release.wait)
+        release.set()
+
+    def test_errors(self):
+        with pytest.raises(ZeroDivisionError):
+            HashingPool(1, 1).submit(5, lambda: 1 / 0)
+
+    def test_hash_rounds(self):
+        assert hash_rounds(bcrypt.generate_password_hash('x', 5)) == 5
+        assert hash_rounds('plain') is None
+        assert hash_rounds(None) is None
+
+
+class TestPools:
+
+    def test_pool_settings(self, app, db, tmpdir):
+        app.config['SQLALCHEMY_BINDS'] = {
+            'archive': 'sqlite:///%s' % tmpdir.join('archive.db'),
+        }
+        app.config['SQLALCHEMY_POOLS'] = {
+            'archive': {'pool_size': 2, 'pool_recycle': 60, 'pre_ping': True},
+        }
+        engine = db.get_engine(app, bind='archive')
+        # Pool sizes do not apply to SQLite
+        assert engine.pool._recycle == 60
+        assert event.contains(engine, 'checkout', ping_connection)
+        assert engine.execute('SELECT 1').scalar() == 1
+        assert db.get_replica_engine(app) is None